@@ -0,0 +1,223 @@
+"""
+Asynchronous execution against Interactive Brokers
+
+The AsyncIBExecutionHandler runs an asyncio event loop on a background thread and talks to TWS over one socket.
+execute_order() only schedules the order on that loop and returns at once, so the event loop of the backtester is
+never blocked: the orders of a rebalance go out concurrently, throttled by a client-side RateLimiter rather than a
+sleep after each one, and a FillEvent is put on the (thread-safe) event queue as each orderStatus message arrives.
+
+The handler speaks a simplified line protocol (see line_protocol) modelled on the TWS API messages:
+
+	client -> server	connect|<client id>
+						placeOrder|<order id>|<symbol>|<sec type>|<exchange>|<currency>|<action>|<quantity>|<order type>|<price>
+						cancelOrder|<order id>
+	server -> client	nextValidId|<order id>
+						openOrder|<order id>|<symbol>|<exchange>|<action>|<quantity>|<order type>
+						orderStatus|<order id>|<status>|<filled>|<remaining>|<avg fill price>
+						error|<order id>|<code>|<message>
+
+The filled quantity and average fill price of orderStatus are cumulative, as in the TWS API. fake_tws.FakeTWS
+serves this protocol locally for tests and dry runs.
+"""
+
+import asyncio
+import datetime
+import threading
+
+from event import EventType, FillEvent
+from execution import ExecutionHandler, RateLimiter
+from line_protocol import SEPARATOR, format_message, parse_message
+
+
+class AsyncIBExecutionHandler(ExecutionHandler):
+	"""
+	Handles order execution via an asyncio connection to TWS, see the module docstring for the protocol.
+	"""
+	# fills are posted from the thread of the asyncio loop
+	requires_thread_safe_queue = True
+
+	def __init__(self, events, host='127.0.0.1', port=7497, client_id=10, order_routing="SMART", currency="USD",
+				 max_rate=45.0, timeout=10.0):
+		"""
+		:param events: The Event Queue object, thread-safe.
+		:param host: host of TWS
+		:param port: port of TWS
+		:param client_id: client id of the connection
+		:param order_routing: The exchange the orders are routed to.
+		:param currency: The currency of the contracts.
+		:param max_rate: Messages per second sent at most.
+		:param timeout: seconds to wait for the connection
+		"""
+		self.events = events
+		self.order_routing = order_routing
+		self.currency = currency
+		self.timeout = timeout
+		self.rate_limiter = RateLimiter(max_rate)
+
+		# order id -> dict of the order, only touched from the loop thread
+		self.fill_dict = {}
+		self._open_orders = 0
+		self._all_done = None
+
+		self.loop = asyncio.new_event_loop()
+		self._thread = threading.Thread(target=self.loop.run_forever, name='AsyncIBExecutionHandler', daemon=True)
+		self._thread.start()
+		self.order_id = self._call(self._connect(host, port, client_id))
+
+	def _call(self, coroutine, timeout=None):
+		"""
+		Runs a coroutine on the loop thread and waits for its result.
+		"""
+		return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout or self.timeout)
+
+	async def _connect(self, host, port, client_id):
+		"""
+		:return: the first valid order id sent by the server
+		"""
+		self.reader, self.writer = await asyncio.open_connection(host, port)
+		self._all_done = asyncio.Event()
+		self._all_done.set()
+		self.writer.write(format_message('connect', client_id))
+		await self.writer.drain()
+
+		fields = parse_message(await self.reader.readline())
+		if fields[0] != 'nextValidId':
+			raise ConnectionError("Expected nextValidId from TWS, got %r" % fields)
+		self._reader_task = self.loop.create_task(self._read_messages())
+		return int(fields[1])
+
+	async def _send(self, *fields):
+		"""
+		Sends a message once the rate limiter allows it.
+		"""
+		wait = self.rate_limiter.reserve()
+		if wait > 0:
+			await asyncio.sleep(wait)
+		self.writer.write(format_message(*fields))
+		await self.writer.drain()
+
+	async def _read_messages(self):
+		"""
+		Dispatches the messages of the server until the connection closes.
+		"""
+		while True:
+			line = await self.reader.readline()
+			if not line:
+				break
+			fields = parse_message(line)
+			if fields[0] == 'orderStatus':
+				self._on_order_status(int(fields[1]), fields[2], int(fields[3]), float(fields[5]))
+			elif fields[0] == 'openOrder':
+				self._on_open_order(int(fields[1]), fields[3])
+			elif fields[0] == 'error':
+				self._on_error(int(fields[1]), fields[2], SEPARATOR.join(fields[3:]))
+
+	def _on_open_order(self, order_id, exchange):
+		"""
+		Records the exchange the order was routed to.
+		"""
+		if order_id in self.fill_dict:
+			self.fill_dict[order_id]["exchange"] = exchange
+
+	def _on_order_status(self, order_id, status, filled, avg_fill_price):
+		"""
+		Puts a FillEvent for the quantity filled since the previous status of the order.
+		"""
+		fd = self.fill_dict.get(order_id)
+		if fd is None or fd["done"]:
+			return
+
+		if filled > fd["filled"]:
+			quantity = filled - fd["filled"]
+			# the price of the new quantity out of the cumulative average
+			fill_cost = (avg_fill_price * filled - fd["avg_price"] * fd["filled"]) / quantity
+			fd["filled"] = filled
+			fd["avg_price"] = avg_fill_price
+			self.events.put(FillEvent(datetime.datetime.utcnow(), fd["symbol"], fd["exchange"],
+									  quantity, fd["direction"], fill_cost))
+
+		if status in ("Filled", "Cancelled", "Inactive"):
+			self._close_order(fd, status)
+
+	def _on_error(self, order_id, code, text):
+		"""
+		Handles the capturing of error messages, an error on an order rejects it.
+		"""
+		print("Server Error: id=%s, code=%s, %s" % (order_id, code, text))
+		fd = self.fill_dict.get(order_id)
+		if fd is not None and not fd["done"]:
+			self._close_order(fd, "Rejected")
+
+	def _close_order(self, fd, status):
+		fd["done"] = True
+		fd["status"] = status
+		self._open_orders -= 1
+		if self._open_orders == 0:
+			self._all_done.set()
+
+	async def _place_order(self, order_id, event):
+		"""
+		Tracks the order by its id in fill_dict and sends it.
+		"""
+		self.fill_dict[order_id] = {
+			"symbol": event.symbol,
+			"exchange": self.order_routing,
+			"direction": event.direction,
+			"filled": 0,
+			"avg_price": 0.0,
+			"done": False,
+			"status": "PendingSubmit",
+		}
+		self._open_orders += 1
+		self._all_done.clear()
+		await self._send('placeOrder', order_id, event.symbol, 'STK', self.order_routing, self.currency,
+						 event.direction, event.quantity, event.order_type, event.price)
+
+	def execute_order(self, event):
+		"""
+		Schedules the order on the asyncio loop and returns at once, the fills arrive on the event queue later.
+
+		:param event: Order event object
+		:return: the order id given to the order
+		"""
+		if event.type == EventType.ORDER:
+			order_id = self.order_id
+			self.order_id += 1
+			asyncio.run_coroutine_threadsafe(self._place_order(order_id, event), self.loop)
+			return order_id
+
+	def cancel_order(self, order_id):
+		"""
+		Requests the cancellation of an order, confirmed by an orderStatus 'Cancelled' message.
+
+		:param order_id: the order id returned by execute_order()
+		"""
+		asyncio.run_coroutine_threadsafe(self._send('cancelOrder', order_id), self.loop)
+
+	def wait_for_fills(self, timeout=None):
+		"""
+		Blocks until every order sent so far is filled, cancelled or rejected.
+
+		:param timeout: seconds to wait at most, the timeout of the handler if None
+		:return: True if no order is still open
+		"""
+		async def wait():
+			# let the orders scheduled before this call be registered first
+			await asyncio.sleep(0)
+			try:
+				await asyncio.wait_for(self._all_done.wait(), timeout or self.timeout)
+			except asyncio.TimeoutError:
+				return False
+			return True
+		return self._call(wait(), (timeout or self.timeout) + 1.0)
+
+	def close(self):
+		"""
+		Closes the connection and stops the loop thread.
+		"""
+		async def disconnect():
+			self._reader_task.cancel()
+			self.writer.close()
+		self._call(disconnect())
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self._thread.join(self.timeout)
@@ -0,0 +1,275 @@
+"""
+Backtest
+Encapsulates the settings and components for carrying out an event-driven backtest.
+
+The Backtest object wires a DataHandler, a Strategy, a Portfolio and an ExecutionHandler together
+around one event queue and runs the outer (heartbeat) and inner (event queue) loops. In backtest mode
+the loops run at full speed; in live mode the inner loop waits on the event queue, so it wakes up as soon as
+a data handler such as live_data.LiveDataHandler closes a bar or an execution handler reports a fill.
+With profile=True the handlers of the loop are timed by a profiler.EventLoopProfiler, and with a
+checkpoint_dir its state is saved periodically by a checkpoint.Checkpointer, to resume from after a crash.
+"""
+
+import queue
+import time
+
+import numpy as np
+
+from checkpoint import Checkpointer
+from data import HistoricCSVDataHandler
+from event import EventType, make_dispatch_table
+from event_queue import create_event_queue, requires_thread_safe_queue
+from execution import SimulatedExecutionHandler
+from portfolio import NaivePortfolio
+from profiler import EventLoopProfiler
+from strategy import BuyAndHoldStrategy
+from vectorized import simulate_target_positions
+
+
+class BacktestResult(object):
+	"""
+	The outcome of a run: the summary statistics and equity curve of the portfolio,
+	together with the number of heartbeats and events processed.
+	"""
+	def __init__(self, stats, equity_curve, heartbeats, event_counts, elapsed, metrics=None, profile=None):
+		"""
+		:param stats: list of (name, formatted value) from Portfolio.output_summary_stats()
+		:param equity_curve: pandas DataFrame of the holdings, returns and equity curve
+		:param heartbeats: number of heartbeats (bars) processed
+		:param event_counts: dict of EventType -> number of events dispatched
+		:param elapsed: wall-clock seconds of the run
+		:param metrics: dict of the numeric metrics of the portfolio, see performance.OnlineMetrics
+		:param profile: the EventLoopProfiler of a profiled run, None otherwise
+		"""
+		self.stats = stats
+		self.equity_curve = equity_curve
+		self.heartbeats = heartbeats
+		self.event_counts = event_counts
+		self.elapsed = elapsed
+		self.metrics = metrics
+		self.profile = profile
+
+	def print_summary(self):
+		"""
+		Outputs the summary statistics and the counters of the run.
+		"""
+		for name, value in self.stats:
+			print("%-18s %s" % (name, value))
+		print("%-18s %d" % ("Heartbeats", self.heartbeats))
+		for t in EventType:
+			print("%-18s %d" % ("%s events" % t.name.capitalize(), self.event_counts[t]))
+		print("%-18s %0.2fs" % ("Elapsed", self.elapsed))
+		if self.profile is not None:
+			print('')
+			print(self.profile.format_table())
+
+
+class Backtest(object):
+	"""
+	Wires the components of a backtest together and runs the event loop.
+	"""
+	def __init__(self, csv_dir, symbol_list, init_capital, start_date,
+				 data_handler_cls=HistoricCSVDataHandler, strategy_cls=BuyAndHoldStrategy,
+				 portfolio_cls=NaivePortfolio, execution_handler_cls=SimulatedExecutionHandler,
+				 live=False, heartbeat=60.0, vectorized=False, profile=False, checkpoint_dir=None, checkpoint_every=1000,
+				 resume=False, data_handler_kwargs=None, strategy_kwargs=None, execution_handler_kwargs=None):
+		"""
+		:param csv_dir: The hard root to the CSV data directory.
+		:param symbol_list: The list of symbol strings.
+		:param init_capital: The starting capital for the portfolio.
+		:param start_date: The start datetime of the strategy.
+		:param data_handler_cls: Handles the market data feed.
+		:param strategy_cls: Generates signals based on market data.
+		:param portfolio_cls: Keeps track of portfolio current and prior positions.
+		:param execution_handler_cls: Handles the orders and fills for trades.
+		:param live: If True, the loop waits on the event queue for the data and fills to arrive.
+		:param heartbeat: Seconds the loop waits on an empty queue in live mode before polling the data handler again.
+		:param vectorized: If True, a VectorizedStrategy is simulated with array operations instead of the event loop.
+		:param profile: If True, the event loop is instrumented with an EventLoopProfiler, see profiler.
+		:param checkpoint_dir: Directory a checkpoint of the run is saved to every checkpoint_every heartbeats and at
+		the end, see checkpoint; None for no checkpoints.
+		:param checkpoint_every: Heartbeats between two checkpoints.
+		:param resume: If True, the run continues from the checkpoint in checkpoint_dir instead of the first bar.
+		:param data_handler_kwargs: Extra keyword arguments of the data handler, e.g. fill_policy.
+		:param strategy_kwargs: Extra keyword arguments of the strategy, i.e. its parameters.
+		:param execution_handler_kwargs: Extra keyword arguments of the execution handler, e.g. fill_model.
+		"""
+		self.csv_dir = csv_dir
+		self.symbol_list = symbol_list
+		self.init_capital = init_capital
+		self.start_date = start_date
+		self.live = live
+		self.heartbeat = heartbeat
+		self.vectorized = vectorized
+
+		self.data_handler_cls = data_handler_cls
+		self.strategy_cls = strategy_cls
+		self.portfolio_cls = portfolio_cls
+		self.execution_handler_cls = execution_handler_cls
+		self.data_handler_kwargs = data_handler_kwargs or {}
+		self.strategy_kwargs = strategy_kwargs or {}
+		self.execution_handler_kwargs = execution_handler_kwargs or {}
+
+		# a plain deque unless a component posts events from another thread
+		self.events = create_event_queue(requires_thread_safe_queue(
+			data_handler_cls, strategy_cls, portfolio_cls, execution_handler_cls
+		))
+		self.event_counts = [0] * len(EventType)
+		self.profiler = EventLoopProfiler(self.events) if profile and not vectorized else None
+		self.checkpointer = None
+		if checkpoint_dir is not None and not vectorized:
+			self.checkpointer = Checkpointer(checkpoint_dir, checkpoint_every)
+		elif resume:
+			raise ValueError("resume requires a checkpoint_dir and the event-driven mode.")
+
+		self._generate_trading_instances()
+		if resume:
+			self.checkpointer.restore(self)
+
+	def _generate_trading_instances(self):
+		"""
+		Generates the trading instance objects from their class types.
+		"""
+		self.data_handler = self.data_handler_cls(self.events, self.csv_dir, self.symbol_list, **self.data_handler_kwargs)
+		self.strategy = self.strategy_cls(self.data_handler, self.events, **self.strategy_kwargs)
+		self.portfolio = self.portfolio_cls(self.data_handler, self.events, self.start_date, self.init_capital)
+		execution_handler_kwargs = dict(self.execution_handler_kwargs)
+		if getattr(self.execution_handler_cls, 'requires_market_data', False):
+			execution_handler_kwargs.setdefault('bars', self.data_handler)
+		self.execution_handler = self.execution_handler_cls(self.events, **execution_handler_kwargs)
+
+	def _run(self):
+		"""
+		Executes the backtest: the outer loop pulls a new bar on each heartbeat,
+		the inner loop drains the event queue through the dispatch table.
+		"""
+		bars = self.data_handler
+		update_bars = bars.update_bars
+		flush = self.execution_handler.flush
+		get = self.events.get
+		heartbeat = self.heartbeat
+		event_counts = self.event_counts
+		handlers = make_dispatch_table({
+			# the fills of the orders waiting for this bar come before the new signals
+			EventType.MARKET: [self.execution_handler.update_market, self.strategy.caculate_signals,
+							   self.portfolio.update_timeindex],
+			EventType.SIGNAL: [self.portfolio.update_signal],
+			EventType.ORDER: [self.execution_handler.execute_order],
+			EventType.FILL: [self.portfolio.update_fill],
+		})
+		# the instrumented versions are only swapped in when profiling, the plain loop stays untouched
+		profiler = self.profiler
+		if profiler is not None:
+			handlers = profiler.instrument(handlers)
+			update_bars = profiler.wrap_update_bars(update_bars)
+			flush = profiler.timed(flush)
+			profiler.start()
+		checkpointer = self.checkpointer
+		if checkpointer is not None:
+			update_bars = checkpointer.wrap_update_bars(self, update_bars)
+
+		### Outer loops: update market data
+		while True:
+			if bars.continue_backtest:
+				update_bars()
+			else:
+				break
+
+			### Inner loops: handle event queue object
+			# Only a live session waits for the market, a backtest runs at full speed
+			wait = self.live and bars.continue_backtest
+			while True:
+				try:
+					event = get(wait, heartbeat)
+				except queue.Empty:
+					# the execution handler may match the orders of the heartbeat at once, then handle their fills
+					if flush():
+						continue
+					break
+				else:
+					wait = False
+					if event is not None:
+						event_counts[event.type] += 1
+						for handler in handlers[event.type]:
+							handler(event)
+
+		if profiler is not None:
+			profiler.stop()
+		if checkpointer is not None:
+			checkpointer.save(self)
+
+	def _run_vectorized(self):
+		"""
+		Executes the backtest of a VectorizedStrategy in one pass of array operations.
+		The ledger of the portfolio is replaced by the simulated one, its current
+		positions and holdings and its online metrics are not updated.
+		"""
+		bar_store = self.data_handler.bar_store
+		targets = self.strategy.generate_target_positions(bar_store)
+		ledger, trades = simulate_target_positions(bar_store, targets, self.init_capital, self.start_date)
+
+		self.portfolio.ledger = ledger
+		bar_store.cursor = bar_store.size
+		self.data_handler.continue_backtest = False
+
+		n_trades = int(np.count_nonzero(trades))
+		self.event_counts = [bar_store.size, n_trades, n_trades, n_trades]
+
+	def simulate_trading(self):
+		"""
+		Runs the backtest and collects the performance of the portfolio.
+
+		:return: a BacktestResult
+		"""
+		start = time.perf_counter()
+		if self.vectorized:
+			self._run_vectorized()
+		else:
+			self._run()
+		stats = self.portfolio.output_summary_stats()
+		metrics = None
+		if hasattr(self.portfolio, 'metrics') and not self.vectorized:
+			metrics = self.portfolio.metrics.snapshot()
+		return BacktestResult(
+			stats, self.portfolio.equity_curve, self.event_counts[EventType.MARKET],
+			{t: self.event_counts[t] for t in EventType}, time.perf_counter() - start, metrics, self.profiler
+		)
+
+
+def check_vectorized_equivalence(csv_dir, symbol_list, strategy_cls, init_capital=100000.0, start_date=None,
+								 rtol=1e-9, atol=1e-6, data_handler_kwargs=None, **strategy_kwargs):
+	"""
+	Test harness: runs a VectorizedStrategy through the event loop and through the vectorized mode
+	on the same data and checks that both produce the same positions and holdings at every bar.
+
+	:param csv_dir: Absolute directory path to the CSV files.
+	:param symbol_list: A list of symbol strings.
+	:param strategy_cls: a VectorizedStrategy class
+	:param init_capital: The starting capital for the portfolio.
+	:param start_date: The start datetime of the strategy.
+	:param rtol, atol: tolerances of the comparison, see numpy.allclose
+	:param data_handler_kwargs: extra keyword arguments of the data handler, e.g. the fill_policy
+	:param strategy_kwargs: the parameters of the strategy
+	:return: (event-driven result, vectorized result)
+	:raise AssertionError: if the two ledgers differ
+	"""
+	results = []
+	ledgers = []
+	for vectorized in (False, True):
+		backtest = Backtest(csv_dir, symbol_list, init_capital, start_date, strategy_cls=strategy_cls,
+							vectorized=vectorized, strategy_kwargs=strategy_kwargs, data_handler_kwargs=data_handler_kwargs)
+		results.append(backtest.simulate_trading())
+		ledgers.append(backtest.portfolio.ledger)
+
+	event_ledger, vector_ledger = ledgers
+	assert event_ledger.size == vector_ledger.size, \
+		'Ledger lengths differ: %d event-driven, %d vectorized' % (event_ledger.size, vector_ledger.size)
+	for name in ('positions', 'holdings'):
+		a = getattr(event_ledger, name)[:event_ledger.size]
+		b = getattr(vector_ledger, name)[:vector_ledger.size]
+		if not np.allclose(a, b, rtol=rtol, atol=atol, equal_nan=True):
+			bar, col = np.argwhere(~np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True))[0]
+			raise AssertionError('%s differ first at bar %d, column %d: %r event-driven, %r vectorized'
+								 % (name.capitalize(), bar, col, a[bar, col], b[bar, col]))
+	assert results[0].stats == results[1].stats, 'Summary statistics differ: %r, %r' % (results[0].stats, results[1].stats)
+	return results[0], results[1]
@@ -0,0 +1,110 @@
+"""
+Events/sec through the event loop: dict-backed events with string types and an if/elif chain,
+against the slotted events of event.py dispatched through a table, with validation on and off.
+
+Run from the repository root:
+	python -m benchmarks.bench_events --heartbeats 200000
+"""
+
+import argparse
+import datetime
+import queue
+import time
+
+import event
+from event import EventType, FillEvent, MarketEvent, OrderEvent, SignalEvent, make_dispatch_table
+
+
+class LegacyEvent(object):
+	"""
+	An event as it was before __slots__: an instance dictionary and a string type.
+	"""
+	def __init__(self, type, **kwargs):
+		self.type = type
+		self.__dict__.update(kwargs)
+
+def noop(event):
+	pass
+
+def legacy_loop(heartbeats):
+	"""
+	:return: number of events dispatched
+	"""
+	events = queue.Queue()
+	now = datetime.datetime(2020, 1, 1)
+	n = 0
+	for _ in range(heartbeats):
+		events.put(LegacyEvent('MARKET'))
+		events.put(LegacyEvent('SIGNAL', symbol='AAPL', datetime=now, signal_type='LONG', strength=1.0))
+		events.put(LegacyEvent('ORDER', symbol='AAPL', order_type='MKT', quantity=100, direction='BUY'))
+		events.put(LegacyEvent('FILL', timeindex=now, symbol='AAPL', exchange='ARCA', quantity=100,
+							   direction='BUY', fill_cost=100.0, commission=1.3))
+		while True:
+			try:
+				e = events.get(False)
+			except queue.Empty:
+				break
+			else:
+				if e.type == 'MARKET':
+					noop(e)
+					noop(e)
+				elif e.type == 'SIGNAL':
+					noop(e)
+				elif e.type == 'ORDER':
+					noop(e)
+				elif e.type == 'FILL':
+					noop(e)
+				n += 1
+	return n
+
+def table_loop(heartbeats):
+	"""
+	:return: number of events dispatched
+	"""
+	events = queue.Queue()
+	handlers = make_dispatch_table({
+		EventType.MARKET: [noop, noop],
+		EventType.SIGNAL: [noop],
+		EventType.ORDER: [noop],
+		EventType.FILL: [noop],
+	})
+	now = datetime.datetime(2020, 1, 1)
+	n = 0
+	for _ in range(heartbeats):
+		events.put(MarketEvent())
+		events.put(SignalEvent('AAPL', now, 'LONG'))
+		events.put(OrderEvent('AAPL', 'MKT', 100, 'BUY'))
+		events.put(FillEvent(now, 'AAPL', 'ARCA', 100, 'BUY', 100.0, 1.3))
+		while True:
+			try:
+				e = events.get(False)
+			except queue.Empty:
+				break
+			else:
+				for handler in handlers[e.type]:
+					handler(e)
+				n += 1
+	return n
+
+def run(loop, heartbeats):
+	"""
+	:return: (events dispatched, seconds elapsed)
+	"""
+	start = time.perf_counter()
+	n = loop(heartbeats)
+	return n, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--heartbeats', type=int, default=200000)
+	args = parser.parse_args()
+
+	print("%-22s %12s %10s %14s" % ("loop", "events", "seconds", "events/sec"))
+	for name, loop, validate in [('legacy if/elif', legacy_loop, True),
+								 ('table, validation on', table_loop, True),
+								 ('table, validation off', table_loop, False)]:
+		event.set_validation(validate)
+		n, elapsed = run(loop, args.heartbeats)
+		print("%-22s %12d %10.2f %14.0f" % (name, n, elapsed, n / elapsed))
+	event.set_validation(True)
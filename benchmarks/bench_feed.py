@@ -0,0 +1,95 @@
+"""
+Bars/sec of HistoricCSVDataHandler against the former iterrows()/strptime feed.
+
+Run from the repository root:
+	python -m benchmarks.bench_feed --symbols 500 --rows 1000000
+"""
+
+import argparse
+import datetime
+import os, os.path
+import queue
+import tempfile
+import time
+
+import pandas as pd
+
+from data import HistoricCSVDataHandler
+from benchmarks.synthetic import write_synthetic_csvs
+
+
+def legacy_feed(events, csv_dir, symbol_list):
+	"""
+	The feed as it was before the bar store: one iterrows() generator per symbol
+	and one strptime per bar, appended as tuples to per-symbol lists.
+
+	:return: number of bars served
+	"""
+	symbol_data = {}
+	latest_symbol_data = {}
+	comb_index = None
+	for s in symbol_list:
+		symbol_data[s] = pd.read_csv(
+			os.path.join(csv_dir, '%s.csv' % s),
+			header=0, index_col=0,
+			names=['datetime', 'open', 'low', 'high', 'close', 'volume', 'oi']
+		)
+		if comb_index is None:
+			comb_index = symbol_data[s].index
+		latest_symbol_data[s] = []
+
+	def get_new_bar(symbol, rows):
+		for b in rows:
+			yield tuple([symbol, datetime.datetime.strptime(b[0], '%Y-%m-%d %H:%M:%S')] + list(b[1].values))
+
+	for s in symbol_list:
+		symbol_data[s] = get_new_bar(s, symbol_data[s].reindex(index=comb_index, method='pad').iterrows())
+
+	n = 0
+	while True:
+		try:
+			for s in symbol_list:
+				latest_symbol_data[s].append(next(symbol_data[s]))
+				n += 1
+		except StopIteration:
+			return n
+		events.put(None)
+
+def vectorized_feed(events, csv_dir, symbol_list):
+	"""
+	The feed served by HistoricCSVDataHandler's bar store.
+
+	:return: number of bars served
+	"""
+	bars = HistoricCSVDataHandler(events, csv_dir, symbol_list)
+	while True:
+		bars.update_bars()
+		if not bars.continue_backtest:
+			break
+	return bars.bar_store.size * len(symbol_list)
+
+def run(feed, csv_dir, symbol_list):
+	"""
+	:return: (bars served, seconds elapsed)
+	"""
+	events = queue.SimpleQueue()
+	start = time.perf_counter()
+	n = feed(events, csv_dir, symbol_list)
+	return n, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--symbols', type=int, default=500)
+	parser.add_argument('--rows', type=int, default=1000000, help='total rows across all symbols')
+	parser.add_argument('--csv-dir', default=None, help='reuse this directory instead of a temporary one')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		csv_dir = args.csv_dir or tmp
+		symbol_list = write_synthetic_csvs(csv_dir, args.symbols, args.rows // args.symbols)
+
+		print("%-12s %12s %10s %14s" % ("feed", "bars", "seconds", "bars/sec"))
+		for name, feed in [('before', legacy_feed), ('after', vectorized_feed)]:
+			n, elapsed = run(feed, csv_dir, symbol_list)
+			print("%-12s %12d %10.2f %14.0f" % (name, n, elapsed, n / elapsed))
@@ -0,0 +1,224 @@
+"""
+Benchmark suite of the full backtest pipeline: BuyAndHoldStrategy, NaivePortfolio and SimulatedExecutionHandler
+over synthetic CSV files, at every scale of a grid of symbols x total bars. Each case runs in its own process so
+its peak RSS is its own, and records the time of the stages separately:
+
+	load		HistoricCSVDataHandler reads and aligns the CSV files
+	feed		update_bars() alone over the whole history
+	run			Backtest.simulate_trading(): the event loop, the equity curve frame and the summary statistics
+	stats		the equity curve frame and the summary statistics again on their own, the part of run after the loop
+
+The results go to a JSON file together with the commit and the versions they were measured on, and two such
+files are compared case by case with --compare, e.g. before and after a change.
+
+Run from the repository root:
+	python -m benchmarks.suite --output before.json
+	python -m benchmarks.suite --output after.json
+	python -m benchmarks.suite --compare before.json after.json
+"""
+
+import argparse
+import datetime
+import json
+import os, os.path
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from data import HistoricCSVDataHandler
+from portfolio import summary_stats
+from benchmarks.synthetic import make_symbol_list, write_synthetic_csvs
+
+SYMBOLS = (10, 100, 1000)
+BARS = (10000, 100000, 1000000)
+
+# metrics of a case compared by --compare, and whether higher is better
+COMPARED = (
+	('bars_per_s', True),
+	('events_per_s', True),
+	('feed_bars_per_s', True),
+	('load_s', False),
+	('stats_s', False),
+	('peak_rss_mb', False),
+)
+
+
+def peak_rss_mb():
+	"""
+	:return: peak resident set size of the process in megabytes
+	"""
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return rss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+def case_dir(data_dir, n_symbols, n_bars):
+	"""
+	Writes the synthetic CSV files of a case, unless a previous run left them in data_dir.
+
+	:param n_bars: total bars across all symbols
+	:return: the directory of the CSV files of the case
+	"""
+	csv_dir = os.path.join(data_dir, '%dx%d' % (n_symbols, n_bars))
+	symbol_list = make_symbol_list(n_symbols)
+	if not all(os.path.exists(os.path.join(csv_dir, '%s.csv' % s)) for s in symbol_list):
+		write_synthetic_csvs(csv_dir, n_symbols, max(1, n_bars // n_symbols))
+	return csv_dir
+
+def run_case(csv_dir, n_symbols, n_bars):
+	"""
+	Runs the stages of one case in the current process.
+
+	:return: dict of the measures of the case
+	"""
+	symbol_list = make_symbol_list(n_symbols)
+
+	start = time.perf_counter()
+	bars = HistoricCSVDataHandler(queue.SimpleQueue(), csv_dir, symbol_list)
+	load_s = time.perf_counter() - start
+
+	start = time.perf_counter()
+	while bars.continue_backtest:
+		bars.update_bars()
+	feed_s = time.perf_counter() - start
+
+	# the pipeline replays the loaded bar store from its first bar
+	bar_store = bars.bar_store
+	bar_store.cursor = 0
+	backtest = Backtest(csv_dir, symbol_list, 100000.0, datetime.datetime(1990, 1, 1),
+						data_handler_kwargs=dict(bar_store=bar_store))
+	start = time.perf_counter()
+	backtest.simulate_trading()
+	run_s = time.perf_counter() - start
+
+	start = time.perf_counter()
+	backtest.portfolio.create_equity_curve_dataframe()
+	summary_stats(backtest.portfolio.equity_curve)
+	stats_s = time.perf_counter() - start
+
+	symbol_bars = bar_store.size * n_symbols
+	events = sum(backtest.event_counts)
+	return {
+		'symbols': n_symbols,
+		'bars': n_bars,
+		'heartbeats': bar_store.size,
+		'events': events,
+		'load_s': load_s,
+		'feed_s': feed_s,
+		'feed_bars_per_s': symbol_bars / feed_s,
+		'run_s': run_s,
+		'bars_per_s': symbol_bars / run_s,
+		'events_per_s': events / run_s,
+		'stats_s': stats_s,
+		'peak_rss_mb': peak_rss_mb(),
+	}
+
+def run_case_in_process(csv_dir, n_symbols, n_bars):
+	"""
+	Runs a case in a fresh interpreter, for a peak RSS of its own.
+
+	:return: dict of the measures of the case
+	"""
+	output = subprocess.check_output(
+		[sys.executable, '-m', 'benchmarks.suite', '--case', str(n_symbols), str(n_bars), '--data-dir', csv_dir],
+		cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	return json.loads(output.decode('utf-8').splitlines()[-1])
+
+def environment():
+	"""
+	:return: dict of the commit, interpreter, library versions and machine the results are measured on
+	"""
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+										 cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		'commit': commit,
+		'date': datetime.datetime.now().isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'pandas': pd.__version__,
+		'machine': platform.machine(),
+		'system': platform.system(),
+		'cpus': os.cpu_count(),
+	}
+
+def run_suite(symbols=SYMBOLS, bars=BARS, data_dir=None):
+	"""
+	:param symbols: numbers of symbols of the grid
+	:param bars: total numbers of bars of the grid, across all symbols
+	:param data_dir: directory the synthetic CSV files are kept in, a temporary one if None
+	:return: dict with the environment and the list of the results of the cases
+	"""
+	with tempfile.TemporaryDirectory() as tmp:
+		data_dir = data_dir or tmp
+		results = []
+		for n_symbols in symbols:
+			for n_bars in bars:
+				result = run_case_in_process(case_dir(data_dir, n_symbols, n_bars), n_symbols, n_bars)
+				print(format_row(result))
+				results.append(result)
+	return {'environment': environment(), 'results': results}
+
+def format_header():
+	return "%8s %9s %8s %10s %12s %12s %12s %9s %9s" % (
+		'symbols', 'bars', 'load s', 'run s', 'bars/sec', 'events/sec', 'feed bars/s', 'stats s', 'RSS MB')
+
+def format_row(r):
+	return "%8d %9d %8.2f %10.2f %12.0f %12.0f %12.0f %9.4f %9.1f" % (
+		r['symbols'], r['bars'], r['load_s'], r['run_s'], r['bars_per_s'], r['events_per_s'],
+		r['feed_bars_per_s'], r['stats_s'], r['peak_rss_mb'])
+
+def compare(base, new):
+	"""
+	:param base: results of run_suite(), the reference
+	:param new: results of run_suite() to compare with the reference
+	:return: text table of the ratio new / base of the compared metrics, per case both contain
+	"""
+	base_cases = dict(((r['symbols'], r['bars']), r) for r in base['results'])
+	lines = ["base %s, new %s" % (base['environment'].get('commit'), new['environment'].get('commit')),
+			 "%8s %9s " % ('symbols', 'bars') + ' '.join('%15s' % name for name, _ in COMPARED)]
+	for r in new['results']:
+		b = base_cases.get((r['symbols'], r['bars']))
+		if b is None:
+			continue
+		cells = []
+		for name, higher_is_better in COMPARED:
+			ratio = r[name] / b[name] if b[name] else float('nan')
+			worse = ratio < 0.9 if higher_is_better else ratio > 1.1
+			cells.append('%14.2fx%s' % (ratio, '!' if worse else ' '))
+		lines.append("%8d %9d " % (r['symbols'], r['bars']) + ' '.join(cells))
+	lines.append("ratios are new / base, '!' marks a regression of more than 10%")
+	return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--symbols', type=int, nargs='+', default=list(SYMBOLS))
+	parser.add_argument('--bars', type=int, nargs='+', default=list(BARS), help='total bars across all symbols')
+	parser.add_argument('--data-dir', default=None, help='keep the synthetic CSV files in this directory')
+	parser.add_argument('--output', default='benchmark_results.json')
+	parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files')
+	parser.add_argument('--case', type=int, nargs=2, metavar=('SYMBOLS', 'BARS'), help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.compare:
+		with open(args.compare[0]) as f, open(args.compare[1]) as g:
+			print(compare(json.load(f), json.load(g)))
+	elif args.case:
+		# a single case in this process, --data-dir being the directory of its CSV files
+		print(json.dumps(run_case(args.data_dir, *args.case)))
+	else:
+		print(format_header())
+		report = run_suite(args.symbols, args.bars, args.data_dir)
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+		print("Results written to %s" % args.output)
@@ -0,0 +1,49 @@
+"""
+Synthetic OHLCV data in the format read by HistoricCSVDataHandler,
+i.e. one 'symbol.csv' per symbol with the columns datetime, open, low, high, close, volume, oi.
+"""
+
+import os, os.path
+import numpy as np
+import pandas as pd
+
+
+def make_symbol_list(n_symbols):
+	"""
+	:param n_symbols: number of symbols
+	:return: list of symbol strings 'S0000', 'S0001', ...
+	"""
+	return ['S%04d' % i for i in range(n_symbols)]
+
+def write_synthetic_csvs(csv_dir, n_symbols, n_bars, start='2010-01-04 09:30:00', freq='min', seed=0):
+	"""
+	Writes a random walk of n_bars minute bars for each of n_symbols symbols.
+
+	:param csv_dir: directory the CSV files are written to, created if missing
+	:param n_symbols: number of symbols
+	:param n_bars: number of bars per symbol
+	:param start: timestamp of the first bar
+	:param freq: pandas frequency string of the bars
+	:param seed: seed of the random generator
+	:return: the list of symbols written
+	"""
+	os.makedirs(csv_dir, exist_ok=True)
+	rng = np.random.default_rng(seed)
+	index = pd.date_range(start, periods=n_bars, freq=freq).strftime('%Y-%m-%d %H:%M:%S')
+
+	symbol_list = make_symbol_list(n_symbols)
+	for s in symbol_list:
+		close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.001, n_bars)))
+		open_ = np.concatenate(([close[0]], close[:-1]))
+		spread = np.abs(rng.normal(0.0, 0.0005, n_bars)) * close
+		frame = pd.DataFrame({
+			'datetime': index,
+			'open': open_,
+			'low': np.minimum(open_, close) - spread,
+			'high': np.maximum(open_, close) + spread,
+			'close': close,
+			'volume': rng.integers(100, 10000, n_bars),
+			'oi': 0,
+		})
+		frame.to_csv(os.path.join(csv_dir, '%s.csv' % s), index=False, float_format='%.4f')
+	return symbol_list
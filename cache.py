@@ -0,0 +1,205 @@
+"""
+Binary on-disk cache of the historic CSV files.
+
+The first time a 'symbol.csv' is read it is parsed once and written as two NPY files, the bar timestamps and
+the OLHCVI values, under a key built from the file's path, mtime and size. Later runs memory-map those arrays
+directly, without parsing anything. Editing or replacing the CSV changes the key, so a stale entry is never
+served; it is removed the next time the file is cached.
+
+The cache directory is capped in size and the least recently used entries are evicted first.
+
+Usage as a command:
+	python cache.py CACHE_DIR --clear
+	python cache.py CACHE_DIR --rebuild CSV_DIR SYMBOL [SYMBOL ...]
+	python cache.py CACHE_DIR --evict --max-size 2048
+"""
+
+import argparse
+import hashlib
+import os, os.path
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+CSV_COLUMNS = ['datetime', 'open', 'low', 'high', 'close', 'volume', 'oi']
+
+# 10 GiB
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+# seconds a '.build-*' directory is assumed to belong to a build under way, in this or another process
+BUILD_GRACE_SECONDS = 3600
+
+
+def read_csv_bars(csv_path):
+	"""
+	Parses a CSV file in the DTN IQFeed format respected by HistoricCSVDataHandler.
+
+	:param csv_path: path of the 'symbol.csv' file
+	:return: (timestamps, values) - a datetime64[ns] array of length T and a float array of shape (OLHCVI, T)
+	"""
+	frame = pd.read_csv(csv_path, header=0, index_col=0, names=CSV_COLUMNS)
+	timestamps = pd.to_datetime(frame.index, format='%Y-%m-%d %H:%M:%S').to_numpy(dtype='datetime64[ns]')
+	values = np.ascontiguousarray(frame.to_numpy(dtype=np.float64).T)
+	return timestamps, values
+
+
+class CSVCache(object):
+	"""
+	Converts CSV files to memory-mappable NPY arrays and keeps the cache directory under a size cap.
+
+	Each entry is a directory named '<path key>-<version key>': the path key identifies the CSV file,
+	the version key its mtime and size. The mtime of the entry directory is its last access time for
+	the LRU eviction.
+	"""
+	def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, build_grace=BUILD_GRACE_SECONDS):
+		"""
+		:param cache_dir: directory holding the cache entries, created if missing
+		:param max_bytes: cap on the total size of the cache entries, None for no cap
+		:param build_grace: seconds during which invalidate() leaves a temporary build directory alone
+		"""
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.build_grace = build_grace
+		os.makedirs(self.cache_dir, exist_ok=True)
+
+	# private function
+	def _path_key(self, csv_path):
+		return hashlib.sha1(os.path.abspath(csv_path).encode('utf-8')).hexdigest()[:20]
+
+	def _entry_name(self, csv_path):
+		st = os.stat(csv_path)
+		version = hashlib.sha1(('%d:%d' % (st.st_mtime_ns, st.st_size)).encode('utf-8')).hexdigest()[:12]
+		return '%s-%s' % (self._path_key(csv_path), version)
+
+	def _entries(self):
+		"""
+		:return: list of (last access time, total bytes, entry path) of every entry
+		"""
+		entries = []
+		for name in os.listdir(self.cache_dir):
+			path = os.path.join(self.cache_dir, name)
+			if not os.path.isdir(path) or name.startswith('.'):
+				continue
+			size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+			entries.append((os.stat(path).st_mtime, size, path))
+		return entries
+
+	def _build(self, csv_path, entry):
+		"""
+		Parses the CSV file and writes its arrays as a new entry, replacing older versions of the same file.
+		"""
+		self.invalidate(csv_path)
+		timestamps, values = read_csv_bars(csv_path)
+
+		# Write into a temporary directory first so a crash never leaves a half written entry
+		tmp = tempfile.mkdtemp(prefix='.build-', dir=self.cache_dir)
+		try:
+			np.save(os.path.join(tmp, 'timestamps.npy'), timestamps)
+			np.save(os.path.join(tmp, 'values.npy'), values)
+			os.replace(tmp, entry)
+		except Exception:
+			shutil.rmtree(tmp, ignore_errors=True)
+			raise
+
+	# public function
+	def load(self, csv_path):
+		"""
+		Returns the arrays of a CSV file, parsing and caching it if it has no up to date entry.
+
+		:param csv_path: path of the 'symbol.csv' file
+		:return: (timestamps, values) - read-only memory-mapped arrays, see read_csv_bars()
+		"""
+		entry = os.path.join(self.cache_dir, self._entry_name(csv_path))
+		if not os.path.isdir(entry):
+			self._build(csv_path, entry)
+			self.evict(keep=entry)
+		else:
+			# Mark the entry as most recently used
+			os.utime(entry)
+
+		timestamps = np.load(os.path.join(entry, 'timestamps.npy'), mmap_mode='r')
+		values = np.load(os.path.join(entry, 'values.npy'), mmap_mode='r')
+		return timestamps, values
+
+	def rebuild(self, csv_path):
+		"""
+		Drops the entry of a CSV file, if any, and parses it again.
+
+		:param csv_path: path of the 'symbol.csv' file
+		"""
+		self._build(csv_path, os.path.join(self.cache_dir, self._entry_name(csv_path)))
+		self.evict()
+
+	def invalidate(self, csv_path=None):
+		"""
+		Removes every entry of a CSV file, or the whole cache if no file is given. The temporary directories
+		of the builds started less than build_grace seconds ago are left to their build.
+
+		:param csv_path: path of the 'symbol.csv' file, or None
+		"""
+		prefix = None if csv_path is None else self._path_key(csv_path) + '-'
+		recent = time.time() - self.build_grace
+		for name in os.listdir(self.cache_dir):
+			if prefix is not None and not name.startswith(prefix):
+				continue
+			path = os.path.join(self.cache_dir, name)
+			if name.startswith('.build-'):
+				try:
+					if os.stat(path).st_mtime > recent:
+						continue
+				except FileNotFoundError:
+					# the build has just moved it into place
+					continue
+			shutil.rmtree(path, ignore_errors=True)
+
+	def evict(self, keep=None):
+		"""
+		Removes the least recently used entries until the cache fits under max_bytes.
+
+		:param keep: an entry path that must not be removed, e.g. the one just built
+		:return: number of bytes freed
+		"""
+		if self.max_bytes is None:
+			return 0
+		entries = sorted(self._entries())
+		total = sum(e[1] for e in entries)
+		freed = 0
+		for _, size, path in entries:
+			if total - freed <= self.max_bytes:
+				break
+			if path == keep:
+				continue
+			shutil.rmtree(path, ignore_errors=True)
+			freed += size
+		return freed
+
+	def size(self):
+		"""
+		:return: total bytes held by the cache entries
+		"""
+		return sum(e[1] for e in self._entries())
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Manage the binary cache of historic CSV files.")
+	parser.add_argument('cache_dir')
+	parser.add_argument('--clear', action='store_true', help='remove every entry')
+	parser.add_argument('--rebuild', nargs='+', metavar='ARG', help='CSV_DIR SYMBOL [SYMBOL ...]: parse the symbols again')
+	parser.add_argument('--evict', action='store_true', help='evict entries until under --max-size')
+	parser.add_argument('--max-size', type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2, help='cap in MiB')
+	args = parser.parse_args()
+	if args.rebuild and len(args.rebuild) < 2:
+		parser.error("--rebuild needs a CSV_DIR and at least one SYMBOL")
+
+	cache = CSVCache(args.cache_dir, max_bytes=int(args.max_size * 1024 ** 2))
+	if args.clear:
+		cache.invalidate()
+	if args.rebuild:
+		csv_dir, symbols = args.rebuild[0], args.rebuild[1:]
+		for s in symbols:
+			cache.rebuild(os.path.join(csv_dir, '%s.csv' % s))
+	if args.evict:
+		cache.evict()
+	print("Cache %s: %.1f MiB" % (args.cache_dir, cache.size() / 1024.0 ** 2))
@@ -0,0 +1,142 @@
+"""
+Checkpoint and resume
+
+A Checkpointer saves the state of a Backtest every N heartbeats, between two heartbeats when the event queue
+is drained, so a long backtest or a live session that crashes can resume from its last checkpoint without
+replaying the history. A checkpoint directory holds two files:
+
+	ledger.bin		the rows of the ledger of the portfolio, one fixed-size binary record per bar (see
+					portfolio.Ledger.write_rows); each checkpoint only appends the rows added since the previous
+					one, so the cost of a checkpoint does not grow with the length of the run
+	snapshot.pkl	everything else, small: the number of ledger rows, the event counters, the events still
+					queued, the next order id and the state of every component, replaced atomically
+
+The components save and restore their own state through get_state() and set_state(state); a component
+without them is assumed stateless. The rows of ledger.bin after those counted by the snapshot, written by a
+checkpoint interrupted before its snapshot, are dropped on resuming.
+"""
+
+import os, os.path
+import pickle
+
+import event
+
+SNAPSHOT_VERSION = 1
+LEDGER_FILE = 'ledger.bin'
+SNAPSHOT_FILE = 'snapshot.pkl'
+
+COMPONENTS = ('data_handler', 'strategy', 'portfolio', 'execution_handler')
+
+
+def _queued_events(events):
+	"""
+	:return: list of the events in the queue, oldest first, without removing them
+	"""
+	if hasattr(events, 'mutex'):
+		with events.mutex:
+			return list(events.queue)
+	return list(events)
+
+
+class Checkpointer(object):
+	"""
+	Saves and restores the state of a Backtest in a checkpoint directory, see the module docstring.
+	"""
+	def __init__(self, directory, every=1000):
+		"""
+		:param directory: the checkpoint directory, created if missing
+		:param every: number of heartbeats between two checkpoints
+		"""
+		self.directory = directory
+		self.every = every
+		self.ledger_path = os.path.join(directory, LEDGER_FILE)
+		self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+		# rows of the ledger already in ledger.bin, None until the file is started or resumed
+		self.ledger_rows = None
+		os.makedirs(directory, exist_ok=True)
+
+	def exists(self):
+		return os.path.exists(self.snapshot_path)
+
+	def save(self, backtest):
+		"""
+		Appends the new ledger rows, then replaces the snapshot.
+
+		:param backtest: the Backtest, between two heartbeats
+		"""
+		ledger = backtest.portfolio.ledger
+		if self.ledger_rows is None:
+			# a new run starts the ledger file over
+			with open(self.ledger_path, 'wb'):
+				pass
+			self.ledger_rows = 0
+		with open(self.ledger_path, 'ab') as f:
+			self.ledger_rows += ledger.write_rows(f, self.ledger_rows)
+			f.flush()
+			os.fsync(f.fileno())
+
+		snapshot = {
+			'version': SNAPSHOT_VERSION,
+			'symbol_list': list(backtest.symbol_list),
+			'ledger_rows': self.ledger_rows,
+			'event_counts': list(backtest.event_counts),
+			'events': [e for e in _queued_events(backtest.events) if e is not None],
+			'next_order_id': event.get_next_order_id(),
+		}
+		for name in COMPONENTS:
+			get_state = getattr(getattr(backtest, name), 'get_state', None)
+			snapshot[name] = None if get_state is None else get_state()
+
+		tmp_path = self.snapshot_path + '.tmp'
+		with open(tmp_path, 'wb') as f:
+			pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, self.snapshot_path)
+
+	def restore(self, backtest):
+		"""
+		Puts a freshly built Backtest back into the state of the last checkpoint.
+
+		:param backtest: the Backtest, before it runs
+		:raise ValueError: if there is no checkpoint, or it was taken on other symbols
+		"""
+		if not self.exists():
+			raise ValueError("No checkpoint to resume from in %s." % self.directory)
+		with open(self.snapshot_path, 'rb') as f:
+			snapshot = pickle.load(f)
+		if snapshot['version'] != SNAPSHOT_VERSION:
+			raise ValueError("Checkpoint version %s, expected %s." % (snapshot['version'], SNAPSHOT_VERSION))
+		if snapshot['symbol_list'] != list(backtest.symbol_list):
+			raise ValueError("Checkpoint taken on the symbols %s, not %s." % (snapshot['symbol_list'], backtest.symbol_list))
+
+		# the rows of a checkpoint interrupted before its snapshot are dropped
+		self.ledger_rows = snapshot['ledger_rows']
+		backtest.portfolio.ledger.read_rows(self.ledger_path, self.ledger_rows)
+		with open(self.ledger_path, 'r+b') as f:
+			f.truncate(self.ledger_rows * backtest.portfolio.ledger.record_dtype().itemsize)
+
+		for name in COMPONENTS:
+			set_state = getattr(getattr(backtest, name), 'set_state', None)
+			if snapshot[name] is not None and set_state is not None:
+				set_state(snapshot[name])
+		backtest.event_counts[:] = snapshot['event_counts']
+		event.set_next_order_id(snapshot['next_order_id'])
+		for e in snapshot['events']:
+			backtest.events.put(e)
+
+	def wrap_update_bars(self, backtest, update_bars):
+		"""
+		:param backtest: the Backtest
+		:param update_bars: the update_bars() of the data handler
+		:return: an update_bars() that saves a checkpoint every `every` heartbeats before pulling the next bar
+		"""
+		every = self.every
+		calls = [0]
+
+		def checkpointed_update_bars():
+			calls[0] += 1
+			if calls[0] % every == 0:
+				self.save(backtest)
+			update_bars()
+		return checkpointed_update_bars
@@ -4,12 +4,14 @@ This is a class hierarchy that allows both historic backtesting and live trading
 """
 
 
-import datetime
+import heapq
 import os, os.path
+import numpy as np
 import pandas as pd
 
 from abc import ABCMeta, abstractmethod
 
+from cache import CSVCache, CSV_COLUMNS, DEFAULT_MAX_BYTES, read_csv_bars
 from event import MarketEvent
 
 class DataHandler(object):
@@ -28,16 +30,44 @@ class DataHandler(object):
 	# mark as abstract base class(ABC)
 	__metaclass__ = ABCMeta
 
+	# True if the handler posts events from another thread, see event_queue
+	requires_thread_safe_queue = False
+
 	# pure virtual method (must be override)
 	@abstractmethod
 	def get_latest_bars(self, symbol, N=1):
 		"""
 		:param symbol: a list of bars of a symbol
 		:param N: numbers of bar to be return
-		:return: the last N bars from the symbol list, or fewer if less bars are available
+		:return: the last N bars from the symbol list as an (N, OLHCVI) array, or fewer if less bars are available
 		"""
 		raise NotImplementedError("Should implement get_latest_bars()")
 
+	@abstractmethod
+	def get_latest_bars_values(self, symbol, field, N=1):
+		"""
+		:param symbol: the ticker symbol
+		:param field: one of 'open', 'low', 'high', 'close', 'volume', 'oi'
+		:param N: numbers of bar to be return
+		:return: the last N values of field as a float array, or fewer if less bars are available
+		"""
+		raise NotImplementedError("Should implement get_latest_bars_values()")
+
+	@abstractmethod
+	def get_latest_bar_datetime(self, symbol):
+		"""
+		:param symbol: the ticker symbol
+		:return: the datetime of the latest bar of the symbol, or None if no bar is available yet
+		"""
+		raise NotImplementedError("Should implement get_latest_bar_datetime()")
+
+	@abstractmethod
+	def get_latest_cross_section(self):
+		"""
+		:return: the latest bar of every symbol as a (symbol, OLHCVI) array, in symbol list order
+		"""
+		raise NotImplementedError("Should implement get_latest_cross_section()")
+
 	@abstractmethod
 	def update_bars(self):
 		"""
@@ -46,98 +76,550 @@ class DataHandler(object):
 		"""
 		raise NotImplementedError("Should implement update_bars()")
 
+	def _check_lookback(self, N):
+		"""
+		Raises if more bars are requested than the handler keeps per symbol.
+		:param N: numbers of bar requested
+		"""
+		max_lookback = getattr(self, 'max_lookback', None)
+		if max_lookback is not None and N > max_lookback:
+			raise ValueError("Requested %d bars but the data handler keeps only max_lookback=%d bars per symbol." % (N, max_lookback))
+
+# field order of a bar, identical to the column order of the CSV files
+BAR_FIELDS = ('open', 'low', 'high', 'close', 'volume', 'oi')
+
+
+class BarStore(object):
+	"""
+	Preallocated, array-backed storage of the OLHCVI bars of every symbol.
+
+	The bars live in a single float array indexed by (symbol, field, time), so the history of one
+	field of one symbol is contiguous in memory, plus one array holding the timestamp of every bar.
+	size counts how many bars have been stored, the cursor counts how many of them have been released
+	to the rest of the system; everything before the cursor is "latest" data, everything after it is
+	still in the future.
+	"""
+	def __init__(self, symbol_list, capacity, timestamps=None, values=None):
+		"""
+		:param symbol_list: A list of symbol strings.
+		:param capacity: The number of bars to preallocate for each symbol.
+		:param timestamps: Optional existing datetime64 array of length capacity to use without copying.
+		:param values: Optional existing (symbol, OLHCVI, capacity) array to use without copying,
+		the store is then full and none of its bars is released yet.
+		"""
+		self.symbol_list = list(symbol_list)
+		self.symbol_index = {s: i for i, s in enumerate(self.symbol_list)}
+		self.field_index = {f: i for i, f in enumerate(BAR_FIELDS)}
+		self.capacity = capacity
+
+		if values is None:
+			self.values = np.full((len(self.symbol_list), len(BAR_FIELDS), capacity), np.nan)
+			self.timestamps = np.empty(capacity, dtype='datetime64[ns]')
+			self.size = 0
+		else:
+			self.values = values
+			self.timestamps = timestamps
+			self.size = capacity
+		self.cursor = 0
+
+	def window(self, start, stop):
+		"""
+		A zero-copy view of the stored bars [start, stop), with a cursor of its own, e.g. one fold of a walk-forward.
+
+		:param start: index of the first bar of the window
+		:param stop: index after the last bar of the window
+		:return: a full BarStore with none of its bars released
+		"""
+		start, stop, _ = slice(start, stop).indices(self.size)
+		return BarStore(self.symbol_list, max(stop - start, 0), self.timestamps[start:stop], self.values[:, :, start:stop])
+
+	def save(self, directory):
+		"""
+		Writes the stored bars as NPY files, to be memory-mapped by load().
+
+		:param directory: the directory to write to, created if missing
+		"""
+		os.makedirs(directory, exist_ok=True)
+		np.save(os.path.join(directory, 'symbols.npy'), np.array(self.symbol_list))
+		np.save(os.path.join(directory, 'timestamps.npy'), self.timestamps[:self.size])
+		np.save(os.path.join(directory, 'values.npy'), self.values[:, :, :self.size])
+
+	@classmethod
+	def load(cls, directory, mmap_mode='r'):
+		"""
+		Opens bars written by save(), memory-mapped by default so that processes share them.
+
+		:param directory: the directory written by save()
+		:param mmap_mode: see numpy.load, None to read the arrays into memory
+		:return: a full BarStore with none of its bars released
+		"""
+		symbol_list = np.load(os.path.join(directory, 'symbols.npy')).tolist()
+		timestamps = np.load(os.path.join(directory, 'timestamps.npy'), mmap_mode=mmap_mode)
+		values = np.load(os.path.join(directory, 'values.npy'), mmap_mode=mmap_mode)
+		return cls(symbol_list, len(timestamps), timestamps, values)
+
+	def append(self, timestamp, bars):
+		"""
+		Stores the bar of every symbol after the bars already stored.
+
+		:param timestamp: the datetime of the bar
+		:param bars: an array-like of shape (symbol, OLHCVI)
+		"""
+		if self.size >= self.capacity:
+			raise IndexError("BarStore is full (capacity %d)." % self.capacity)
+		self.timestamps[self.size] = np.datetime64(timestamp, 'ns')
+		self.values[:, :, self.size] = bars
+		self.size += 1
+
+	def advance(self):
+		"""
+		Releases the next stored bar of every symbol.
+
+		:return: False if every stored bar has already been released
+		"""
+		if self.cursor >= self.size:
+			return False
+		self.cursor += 1
+		return True
+
+	def get_latest_bars(self, symbol, N=1):
+		"""
+		:param symbol: the ticker symbol
+		:param N: numbers of bar to be return
+		:return: a zero-copy (N, OLHCVI) view of the last N bars, or fewer if less bars are available
+		"""
+		i = self.symbol_index[symbol]
+		return self.values[i, :, max(self.cursor - N, 0):self.cursor].T
+
+	def get_latest_bars_values(self, symbol, field, N=1):
+		"""
+		:param symbol: the ticker symbol
+		:param field: one of BAR_FIELDS
+		:param N: numbers of bar to be return
+		:return: a contiguous zero-copy float array of the last N values of field
+		"""
+		i = self.symbol_index[symbol]
+		return self.values[i, self.field_index[field], max(self.cursor - N, 0):self.cursor]
+
+	def get_latest_cross_section(self):
+		"""
+		:return: a (symbol, OLHCVI) view of the latest released bar of every symbol, NaN if no bar is released yet
+		"""
+		if self.cursor == 0:
+			return np.full((len(self.symbol_list), len(BAR_FIELDS)), np.nan)
+		return self.values[:, :, self.cursor - 1]
+
+	def get_latest_datetime(self):
+		"""
+		:return: the datetime of the latest released bar, or None if no bar is released yet
+		"""
+		if self.cursor == 0:
+			return None
+		return pd.Timestamp(self.timestamps[self.cursor - 1])
+
+
+class RingBuffer(object):
+	"""
+	Fixed-capacity history of the OLHCVI bars of one symbol.
+
+	Every bar is written twice, at slot i and slot i + capacity of a buffer twice the capacity long,
+	so the last N bars are always one contiguous slice and can be returned as views without copying.
+	Like the BarStore, the buffer is indexed by (field, slot).
+	"""
+	def __init__(self, capacity, width=len(BAR_FIELDS)):
+		"""
+		:param capacity: maximum number of bars kept
+		:param width: number of fields of a bar
+		"""
+		self.capacity = capacity
+		self.values = np.full((width, 2 * capacity), np.nan)
+		self.count = 0
+
+	def append(self, bar):
+		"""
+		:param bar: an array-like of the fields of a bar
+		"""
+		slot = self.count % self.capacity
+		self.values[:, slot] = bar
+		self.values[:, slot + self.capacity] = bar
+		self.count += 1
+
+	def repeat(self):
+		"""
+		Appends the latest bar again, if any.
+		"""
+		if self.count > 0:
+			self.append(self.values[:, (self.count - 1) % self.capacity])
+
+	def latest(self, N=1):
+		"""
+		:param N: numbers of bar to be return, at most capacity
+		:return: a zero-copy (field, N) view of the last N bars, or fewer if less bars are available
+		"""
+		N = min(N, self.count, self.capacity)
+		end = (self.count - 1) % self.capacity + 1 + self.capacity
+		return self.values[:, end - N:end]
+
+	def restore(self, bars, count):
+		"""
+		Refills the buffer, e.g. from a checkpoint.
+
+		:param bars: (field, N) array of the last N bars, as returned by latest()
+		:param count: number of bars appended in total
+		"""
+		self.values[:] = np.nan
+		slots = np.arange(count - bars.shape[1], count) % self.capacity
+		self.values[:, slots] = bars
+		self.values[:, slots + self.capacity] = bars
+		self.count = count
+
+
+# 'pad': carry the last bar forward, 'nan': leave the gaps as NaN,
+# 'drop': start the timeline once every symbol is listed, then carry the last bar forward
+FILL_POLICIES = ('pad', 'nan', 'drop')
+
+
+def align_bars(symbol_list, symbol_bars, fill_policy='pad'):
+	"""
+	Aligns the bars of every symbol onto the union of their timelines, in a single bar store.
+
+	The union timeline is built once by merging the sorted timestamps of all symbols. Each symbol is then
+	placed by looking up where its own bars fall on that timeline and, depending on the fill policy, carrying
+	the last bar forward over the gaps, so the cost is linear in the total number of rows.
+
+	:param symbol_list: A list of symbol strings.
+	:param symbol_bars: dict of symbol -> (timestamps, values), see cache.read_csv_bars()
+	:param fill_policy: one of FILL_POLICIES
+	:return: a BarStore holding every aligned bar, none of them released yet
+	"""
+	if fill_policy not in FILL_POLICIES:
+		raise ValueError("Unknown fill_policy %s, expected one of %s." % (fill_policy, FILL_POLICIES))
+
+	# Sorting the concatenated runs of sorted timestamps merges them (stable sort is a run-detecting merge)
+	union = np.sort(np.concatenate([symbol_bars[s][0] for s in symbol_list]), kind='stable')
+	if len(union) > 0:
+		union = union[np.concatenate(([True], union[1:] != union[:-1]))]
+	if fill_policy == 'drop' and len(union) > 0:
+		listed = max(symbol_bars[s][0][0] if len(symbol_bars[s][0]) else union[-1] + 1 for s in symbol_list)
+		union = union[np.searchsorted(union, listed):]
+
+	bar_store = BarStore(symbol_list, len(union))
+	for i, s in enumerate(symbol_list):
+		timestamps, values = symbol_bars[s]
+		# index of the symbol's own bar at each point of the union timeline, -1 where it has none
+		idx = np.full(len(union), -1, dtype=np.int64)
+		pos = np.searchsorted(union, timestamps)
+		inside = pos < len(union)
+		inside[inside] = union[pos[inside]] == timestamps[inside]
+		idx[pos[inside]] = np.flatnonzero(inside)
+		if fill_policy != 'nan':
+			np.maximum.accumulate(idx, out=idx)
+			if fill_policy == 'drop' and len(union) > 0 and idx[0] < 0:
+				# the first bar of the symbol is before the trimmed timeline, carry its last one in
+				idx[idx < 0] = np.searchsorted(timestamps, union[0], side='right') - 1
+		valid = idx >= 0
+		bar_store.values[i][:, valid] = values[:, idx[valid]]
+	bar_store.timestamps[:] = union
+	bar_store.size = len(union)
+	return bar_store
+
+
 class HistoricCSVDataHandler(DataHandler):
 	"""
 	Derived class to read CSV files for each requested symbol from disk and provide an interface
 	to obtain the "latest" bar in a manner identical to a live trading interface
 	"""
-	def __init__(self, events, csv_dir, symbol_list):
+	def __init__(self, events, csv_dir, symbol_list, fill_policy='pad', max_lookback=None,
+				 cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES, bar_store=None):
 		"""
 		Initialises the historic data handler by requesting the location of the CSV files and a list of symbols.
 
 		:param events: The Event Queue
 		:param csv_dir: Absolute directory path to the CSV files.
 		:param symbol_list: A list of symbol strings, which are all assumed of the form 'symbol.csv'
+		:param fill_policy: How the gaps of a symbol on the combined timeline are filled, see FILL_POLICIES.
+		:param max_lookback: Optional maximum number of bars a strategy may request at once.
+		:param cache_dir: Optional directory of the binary CSV cache, see cache.CSVCache.
+		:param cache_max_bytes: Size cap of the cache directory, None for no cap.
+		:param bar_store: Optional BarStore already loaded, e.g. shared by the processes of a sweep;
+		the CSV files are then not read.
 		"""
 		self.events = events
 		self.csv_dir = csv_dir
 		self.symbol_list = symbol_list
+		self.fill_policy = fill_policy
+		self.max_lookback = max_lookback
+		self.cache = None if cache_dir is None else CSVCache(cache_dir, cache_max_bytes)
 
-		self.symbol_data = {}
-		self.latest_symbol_data = {}
+		self.bar_store = bar_store
 		self.continue_backtest = True
 
-		self._open_convert_csv_files()
+		if self.bar_store is None:
+			self._open_convert_csv_files()
 
 	# private function
 	def _open_convert_csv_files(self):
 		"""
-		Opens the CSV files from the data directory, converting
-		them into pandas DataFrames within a symbol dictionary.
+		Opens the CSV files from the data directory and aligns
+		them into the bar store on their combined timeline.
 
 		For this handler it will be assumed that the data is
 		taken from DTN IQFeed. Thus its format will be respected.
 		"""
-		comb_index = None
+		symbol_bars = {}
 		for s in self.symbol_list:
-			# Load the CSV file with no header information, indexed on date
-			self.symbol_data[s] = pd.io.parsers.read_csv(
-				os.path.join(self.csv_dir, '%s.csv' % s),
-				header=0, index_col=0,
-				names=['datetime', 'open', 'low', 'high', 'close', 'volume', 'oi']
-			)
-
-			# Combine the index to pad forward values
-			if comb_index is None:
-				comb_index = self.symbol_data[s].index
+			# Load the CSV file, or its memory-mapped arrays if cached, indexed on date
+			csv_path = os.path.join(self.csv_dir, '%s.csv' % s)
+			if self.cache is None:
+				symbol_bars[s] = read_csv_bars(csv_path)
 			else:
-				comb_index.union(self.symbol_data[s].index)
+				symbol_bars[s] = self.cache.load(csv_path)
 
-			# Set the latest symbol_data to None
-			self.latest_symbol_data[s] = []
+		# all bars are released through the cursor of the bar store
+		self.bar_store = align_bars(self.symbol_list, symbol_bars, self.fill_policy)
 
-		# Reindex the dataframes
-		for s in self.symbol_list:
-			self.symbol_data[s] = self.symbol_data[s].reindex(index=comb_index, method='pad').iterrows()
+	# public function
+	def get_latest_bars(self, symbol, N=1):
+		"""
+		function overrided
+		:param symbol: a list of bars of a symbol
+		:param N: numbers of bar to be return
+		:return: the last N bars from the symbol list, or fewer if less bars are available
+		"""
+		self._check_lookback(N)
+		try:
+			return self.bar_store.get_latest_bars(symbol, N)
+		except KeyError:
+			print("That symbol %s is not available in the historical data set." % (symbol))
+
+	def get_latest_bars_values(self, symbol, field, N=1):
+		"""
+		function overrided
+		:param symbol: the ticker symbol
+		:param field: one of 'open', 'low', 'high', 'close', 'volume', 'oi'
+		:param N: numbers of bar to be return
+		:return: the last N values of field as a contiguous float array, or fewer if less bars are available
+		"""
+		self._check_lookback(N)
+		try:
+			return self.bar_store.get_latest_bars_values(symbol, field, N)
+		except KeyError:
+			print("That symbol %s or field %s is not available in the historical data set." % (symbol, field))
+
+	def get_latest_bar_datetime(self, symbol):
+		"""
+		function overrided
+		:param symbol: the ticker symbol
+		:return: the datetime of the latest bar, or None if no bar is available yet
+		"""
+		if symbol not in self.bar_store.symbol_index:
+			print("That symbol %s is not available in the historical data set." % (symbol))
+			return None
+		return self.bar_store.get_latest_datetime()
 
-	def _get_new_bar(self, symbol):
+	def get_latest_cross_section(self):
 		"""
-		return the latest bar from the data feed as a tuple iterator
-		:param symbol:
-		:return: tuple of (sybmbol, datetime, open, low, high, close, volume)
+		function overrided
+		:return: a (symbol, OLHCVI) view of the latest bar of every symbol
 		"""
-		for b in self.symbol_data:
-			yield tuple([symbol,
-						 datetime.datetime.strptime(b[0], '%Y-%m-%d %H:%M:%S'),
-						 b[1][0], b[1][1], b[1][2], b[1][3], b[1][4]])
+		return self.bar_store.get_latest_cross_section()
+
+	def get_state(self):
+		"""
+		:return: the cursor of the bar store, for a checkpoint
+		"""
+		return {'cursor': self.bar_store.cursor}
+
+	def set_state(self, state):
+		"""
+		:param state: a state from get_state(), the bars are not replayed
+		"""
+		self.bar_store.cursor = state['cursor']
+
+	def update_bars(self):
+		"""
+		overrided function
+		:return:
+		"""
+		if self.bar_store.advance():
+			self.events.put(MarketEvent())
+		else:
+			self.continue_backtest = False
+
+
+class RingBufferDataHandler(DataHandler):
+	"""
+	Base class of the data handlers that receive the bars one heartbeat at a time and keep only the last
+	max_lookback bars of each symbol, in one RingBuffer per symbol. A symbol without a bar at a heartbeat
+	carries its previous bar forward, as with the 'pad' policy of HistoricCSVDataHandler, so the last N bars of
+	every symbol are those of the last N heartbeats. Derived classes set up the buffers with _init_buffers() and
+	implement update_bars(), which calls _carry_forward() once the new bars of a heartbeat are appended.
+	"""
+	def _init_buffers(self, symbol_list, max_lookback):
+		"""
+		:param symbol_list: A list of symbol strings.
+		:param max_lookback: Number of bars kept per symbol.
+		"""
+		self.symbol_list = symbol_list
+		self.max_lookback = max_lookback
+		self.symbol_index = {s: i for i, s in enumerate(self.symbol_list)}
+		self.field_index = {f: i for i, f in enumerate(BAR_FIELDS)}
+		self.latest_symbol_data = [RingBuffer(max_lookback) for _ in self.symbol_list]
+		self.latest_datetime = None
+
+	def _carry_forward(self, updated):
+		"""
+		Appends the previous bar again to every symbol without a new bar at the heartbeat, once it has a bar.
+
+		:param updated: indices of the symbols with a new bar at the heartbeat
+		"""
+		updated = set(updated)
+		for i, window in enumerate(self.latest_symbol_data):
+			if i not in updated:
+				window.repeat()
 
-	# public function
 	def get_latest_bars(self, symbol, N=1):
 		"""
 		function overrided
 		:param symbol: a list of bars of a symbol
 		:param N: numbers of bar to be return
-		:return: the last N bars from the symbol list, or fewer if less bars are available
+		:return: a view of the last N bars from the symbol list, or fewer if less bars are available
 		"""
+		self._check_lookback(N)
 		try:
-			bar_list = self.latest_symbol_data[symbol]
+			return self.latest_symbol_data[self.symbol_index[symbol]].latest(N).T
 		except KeyError:
 			print("That symbol %s is not available in the historical data set." % (symbol))
-		else:
-			return bar_list[-N:]
 
+	def get_latest_bars_values(self, symbol, field, N=1):
+		"""
+		function overrided
+		:param symbol: the ticker symbol
+		:param field: one of 'open', 'low', 'high', 'close', 'volume', 'oi'
+		:param N: numbers of bar to be return
+		:return: the last N values of field as a contiguous float array, or fewer if less bars are available
+		"""
+		self._check_lookback(N)
+		try:
+			return self.latest_symbol_data[self.symbol_index[symbol]].latest(N)[self.field_index[field]]
+		except KeyError:
+			print("That symbol %s or field %s is not available in the historical data set." % (symbol, field))
+
+	def get_latest_bar_datetime(self, symbol):
+		"""
+		function overrided
+		:param symbol: the ticker symbol
+		:return: the datetime of the latest heartbeat, or None if no bar is available yet
+		"""
+		if symbol not in self.symbol_index:
+			print("That symbol %s is not available in the historical data set." % (symbol))
+			return None
+		if self.latest_datetime is None:
+			return None
+		return pd.Timestamp(self.latest_datetime)
+
+	def get_latest_cross_section(self):
+		"""
+		function overrided
+		:return: the latest bar of every symbol as a (symbol, OLHCVI) array, NaN for a symbol without bars yet
+		"""
+		cross_section = np.full((len(self.symbol_list), len(BAR_FIELDS)), np.nan)
+		for i, window in enumerate(self.latest_symbol_data):
+			if window.count > 0:
+				cross_section[i] = window.latest(1)[:, 0]
+		return cross_section
+
+	def get_state(self):
+		"""
+		:return: the bars kept of every symbol and the latest heartbeat, for a checkpoint
+		"""
+		return {
+			'buffers': [(window.latest(window.capacity).copy(), window.count) for window in self.latest_symbol_data],
+			'latest_datetime': self.latest_datetime,
+		}
+
+	def set_state(self, state):
+		"""
+		:param state: a state from get_state()
+		"""
+		for window, (bars, count) in zip(self.latest_symbol_data, state['buffers']):
+			window.restore(bars, count)
+		self.latest_datetime = state['latest_datetime']
+
+
+class StreamingCSVDataHandler(RingBufferDataHandler):
+	"""
+	Derived class that streams the CSV files of each requested symbol from disk in fixed-size chunks, for data
+	sets larger than memory.
+
+	The rows of all symbols are merged by timestamp into a single feed, and only the last max_lookback bars
+	of each symbol are kept, so peak memory depends on the lookback window and the chunk size, not on the
+	length of the history. A symbol without a bar at a timestamp carries its previous bar forward.
+	"""
+	def __init__(self, events, csv_dir, symbol_list, max_lookback=500, chunksize=10000):
+		"""
+		:param events: The Event Queue
+		:param csv_dir: Absolute directory path to the CSV files.
+		:param symbol_list: A list of symbol strings, which are all assumed of the form 'symbol.csv'
+		:param max_lookback: Number of bars kept per symbol.
+		:param chunksize: Number of rows read from a CSV file at a time.
+		"""
+		self.events = events
+		self.csv_dir = csv_dir
+		self.chunksize = chunksize
+		self._init_buffers(symbol_list, max_lookback)
+		self.continue_backtest = True
+
+		# k-way merge of the symbol files by timestamp
+		self._feed = heapq.merge(*[self._read_symbol_chunks(i, s) for i, s in enumerate(self.symbol_list)])
+		self._next_bar = next(self._feed, None)
 
+	# private function
+	def _read_symbol_chunks(self, i, symbol):
+		"""
+		Reads the CSV file of a symbol chunk by chunk, parsing the timestamps of a chunk at once.
+
+		:param i: index of the symbol in the symbol list
+		:param symbol: the ticker symbol
+		:return: generator of (timestamp as int64 nanoseconds, i, OLHCVI array)
+		"""
+		reader = pd.read_csv(
+			os.path.join(self.csv_dir, '%s.csv' % symbol),
+			header=0, index_col=0, names=CSV_COLUMNS, chunksize=self.chunksize
+		)
+		for chunk in reader:
+			timestamps = pd.to_datetime(chunk.index, format='%Y-%m-%d %H:%M:%S').to_numpy(dtype='datetime64[ns]')
+			values = chunk.to_numpy(dtype=np.float64)
+			for ts, row in zip(timestamps.view(np.int64).tolist(), values):
+				yield ts, i, row
+
+	def set_state(self, state):
+		"""
+		:param state: a state from get_state(); the rows up to its latest heartbeat are read past, not replayed
+		"""
+		RingBufferDataHandler.set_state(self, state)
+		if self.latest_datetime is not None:
+			while self._next_bar is not None and self._next_bar[0] <= self.latest_datetime:
+				self._next_bar = next(self._feed, None)
+
+	# public function
 	def update_bars(self):
 		"""
 		overrided function
+		Pushes every bar sharing the next timestamp of the merged feed.
 		:return:
 		"""
-		for s in self.symbol_list:
-			try:
-				bar = self._get_new_bar(s).next()
-			except StopIteration:
-				self.continue_backtest = False
-			else:
-				if bar is not None:
-					self.latest_symbol_data[s].append(bar)
-		self.events.put(MarketEvent())
\ No newline at end of file
+		if self._next_bar is None:
+			self.continue_backtest = False
+			return
+
+		ts = self._next_bar[0]
+		updated = []
+		while self._next_bar is not None and self._next_bar[0] == ts:
+			_, i, row = self._next_bar
+			self.latest_symbol_data[i].append(row)
+			updated.append(i)
+			self._next_bar = next(self._feed, None)
+		self._carry_forward(updated)
+		self.latest_datetime = ts
+		self.events.put(MarketEvent())
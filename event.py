@@ -22,13 +22,92 @@ as well as the transaction costs, such as fees or slippage.
 
 """
 
+import itertools
+
+from enum import IntEnum
+
+import numpy as np
+
+
+class EventType(IntEnum):
+	"""
+	Integer tag of every event class, also the index of the event in a dispatch table.
+	"""
+	MARKET = 0
+	SIGNAL = 1
+	ORDER = 2
+	FILL = 3
+
+# Validation of the constructor arguments, switch off with set_validation(False) for production runs
+VALIDATE = True
+
+def set_validation(enabled):
+	"""
+	Switches the validation of the event constructor arguments on or off.
+	:param enabled: bool
+	"""
+	global VALIDATE
+	VALIDATE = enabled
+
+# Identifiers given to the orders created without one
+_order_ids = itertools.count(1)
+
+def get_next_order_id():
+	"""
+	:return: the identifier the next order created without one will get, e.g. for a checkpoint
+	"""
+	global _order_ids
+	order_id = next(_order_ids)
+	_order_ids = itertools.count(order_id)
+	return order_id
+
+def set_next_order_id(order_id):
+	"""
+	:param order_id: the identifier the next order created without one gets, e.g. on resuming from a checkpoint
+	"""
+	global _order_ids
+	_order_ids = itertools.count(order_id)
+
+# Interactive Brokers fee structure for API orders, "US API Directed Orders"
+IB_MIN_COMMISSION = 1.3
+IB_TIER_QUANTITY = 500
+IB_RATE_PER_SHARE = (0.013, 0.008)	# up to / above IB_TIER_QUANTITY
+IB_MAX_RATE = 0.5 / 100.0			# of the trade value
+
+def ib_commission(quantity, fill_cost):
+	"""
+	Vectorized form of FillEvent.caculate_ib_commission() over arrays of fills.
+
+	:param quantity: array of filled quantities
+	:param fill_cost: array of fill prices, the same shape as quantity
+	:return: array of broker commissions
+	"""
+	quantity = np.asarray(quantity, dtype=np.float64)
+	rate = np.where(quantity <= IB_TIER_QUANTITY, IB_RATE_PER_SHARE[0], IB_RATE_PER_SHARE[1])
+	full_cost = np.maximum(IB_MIN_COMMISSION, rate * quantity)
+	return np.minimum(full_cost, IB_MAX_RATE * quantity * np.asarray(fill_cost, dtype=np.float64))
+
+def make_dispatch_table(handlers):
+	"""
+	Builds the table the event loop dispatches on, in place of a chain of type comparisons.
+
+	:param handlers: dict of EventType -> list of callables taking the event, called in order
+	:return: tuple indexed by the event type, each entry a tuple of callables
+	"""
+	return tuple(tuple(handlers.get(t, ())) for t in EventType)
+
+
 class Event(object):
 	"""
     Event is base class providing an interface for all subsequent
     (inherited) events, that will trigger further events in the
     trading infrastructure.
+
+    Events use __slots__ and keep their type as a class attribute,
+    so creating one allocates no instance dictionary.
     """
-	pass
+	__slots__ = ()
+	type = None
 
 
 class MarketEvent(Event):
@@ -37,12 +116,8 @@ class MarketEvent(Event):
 	which are currently being tracked.
 	It is used to trigger the Strategy object generating new trading signals.
     """
-
-	def __init__(self):
-		"""
-		Initialises the MarketEvent.
-		"""
-		self.type = 'MARKET'
+	__slots__ = ()
+	type = EventType.MARKET
 
 
 class SignalEvent(Event):
@@ -50,44 +125,66 @@ class SignalEvent(Event):
 	Handles the event of sending a Signal
 	Created by strategy object and received by portfolio object
 	"""
-	def __init__(self,symbol, datetime, signal_type):
+	__slots__ = ('symbol', 'datetime', 'signal_type', 'strength')
+	type = EventType.SIGNAL
+
+	def __init__(self,symbol, datetime, signal_type, strength=1.0):
 		"""
 		Initize the SingalEvent
 		:param symbol: the ticker symbol, e.g. AAPL
 		:param datetime: '%%Y-%%M-%%D'
 		:param signal_type: 'LONG', 'SHORT', 'EXIT'
+		:param strength: scaling of the quantity of the signal, used by the portfolio for position sizing
 		"""
-		assert signal_type == 'LONG' or signal_type == 'SHORT' or signal_type == 'EXIT', 'Input value error: signal_type'
+		if VALIDATE:
+			assert signal_type == 'LONG' or signal_type == 'SHORT' or signal_type == 'EXIT', 'Input value error: signal_type'
 
-		self.type = 'SIGNAL'
 		self.symbol = symbol
 		self.datetime = datetime
 		self.signal_type = signal_type
+		self.strength = strength
 
 class OrderEvent(Event):
 	"""
 	Handle the event of sending an Order to an execution system.
 	"""
+	__slots__ = ('symbol', 'order_type', 'quantity', 'direction', 'price', 'order_id', 'expiry')
+	type = EventType.ORDER
 
-	def __init__(self, symbol, order_type, quantity, direction):
+	def __init__(self, symbol, order_type, quantity, direction, price=None, order_id=None, expiry=None):
 		"""
 		Initialize the OrderEvent
 
 		:param symbol: the instrument to trade, e.g. AAPL
-		:param order_type: 'MKT' or 'LMT' for market or limit
+		:param order_type: 'MKT', 'LMT' or 'STP' for market, limit or stop
 		:param quantity: Non-negative integar for quantity
 		:param direction: 'BUY' or 'SELL' for long or short
+		:param price: the limit price of a 'LMT' order, the stop price of a 'STP' order
+		:param order_id: identifier of the order, a new one if None; an order with the id of a resting order replaces it
+		:param expiry: number of bars a 'LMT' or 'STP' order rests at the market before it is cancelled, None until filled
 		"""
-		assert order_type == 'MKT' or order_type == 'LMT', 'Input value error: order_type'
-		assert quantity >= 0, 'Input value error: quantity'
-		assert isinstance(quantity, int), 'Input type error: quantity'
-		assert direction == 'BUY' or direction == 'SELL', 'Input value error: direction'
+		if VALIDATE:
+			assert order_type == 'MKT' or order_type == 'LMT' or order_type == 'STP', 'Input value error: order_type'
+			assert quantity >= 0, 'Input value error: quantity'
+			assert isinstance(quantity, int), 'Input type error: quantity'
+			assert direction == 'BUY' or direction == 'SELL', 'Input value error: direction'
+			assert order_type == 'MKT' or price is not None, 'Input value error: price'
+			assert expiry is None or expiry >= 1, 'Input value error: expiry'
+
+		self.symbol = symbol
+		self.order_type = order_type
+		self.quantity = quantity
+		self.direction = direction
+		self.price = price
+		self.order_id = next(_order_ids) if order_id is None else order_id
+		self.expiry = expiry
 
 	def print_order(self):
 		"""
 		Outputs the values within the Order.
 		"""
-		print("Order: Symbol=%s, Type=%s, Quantity=%s, Direction=%s" % (self.symbol, self.order_type, self.quantity, self.direction))
+		print("Order: Id=%s, Symbol=%s, Type=%s, Quantity=%s, Direction=%s, Price=%s"
+			  % (self.order_id, self.symbol, self.order_type, self.quantity, self.direction, self.price))
 
 class FillEvent(Event):
 	"""
@@ -95,6 +192,8 @@ class FillEvent(Event):
 	Stroes the quantity of an instrument actually filled and at what price.
 	In addition, stores the commission of the trade from the brokerage.
 	"""
+	__slots__ = ('timeindex', 'symbol', 'exchange', 'quantity', 'direction', 'fill_cost', 'commission')
+	type = EventType.FILL
 
 	def __init__(self, timeindex, symbol, exchange, quantity, direction, fill_cost, commission=None):
 		"""
@@ -106,10 +205,9 @@ class FillEvent(Event):
 		:param exchange: The exchange where the order was filled.
 		:param quantity: The filled quantity.
 		:param direction: The direction of fill ('BUY' or 'SELL')
-		:param fill_cost: The holdings value in dollars.
+		:param fill_cost: The price of a unit of the fill in dollars, or None if unknown.
 		:param commission: An optional commission sent from IB.
 		"""
-		self.type = 'FILL'
 		self.timeindex = timeindex
 		self.symbol = symbol
 		self.exchange = exchange
@@ -133,10 +231,12 @@ class FillEvent(Event):
 
 		:return: cost of broker commission
 		"""
-		full_cost = 1.3
-		if self.quantity <= 500:
-			full_cost = max(1.3, 0.013 * self.quantity)
+		full_cost = IB_MIN_COMMISSION
+		if self.quantity <= IB_TIER_QUANTITY:
+			full_cost = max(IB_MIN_COMMISSION, IB_RATE_PER_SHARE[0] * self.quantity)
 		else:
-			full_cost = max(1.3, 0.008 * self.quantity)
-		full_cost = min(full_cost, 0.5 / 100.0 * self.quantity * self.fill_cost)
+			full_cost = max(IB_MIN_COMMISSION, IB_RATE_PER_SHARE[1] * self.quantity)
+		# the cap needs the fill price, which a simulated fill may not know
+		if self.fill_cost is not None:
+			full_cost = min(full_cost, IB_MAX_RATE * self.quantity * self.fill_cost)
 		return full_cost
\ No newline at end of file
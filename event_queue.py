@@ -0,0 +1,57 @@
+"""
+Event queues
+
+The components only ever call put(event) on the event queue and the event loop calls get(False) until
+queue.Empty is raised. A backtest runs on a single thread, so the mutex and condition variables of a
+queue.Queue are wasted work there; a plain deque does the job. A thread-safe queue is only needed once a
+component posts events from another thread, e.g. the callback thread of IBExecutionHandler. Such
+component classes declare requires_thread_safe_queue = True.
+"""
+
+import queue
+
+from collections import deque
+
+
+class DequeEventQueue(deque):
+	"""
+	Lock-free event queue for single-threaded use, with the put/get interface of queue.Queue.
+	"""
+	__slots__ = ()
+
+	put = deque.append
+
+	def get(self, block=False, timeout=None):
+		"""
+		:param block: ignored, a single-threaded queue can never be filled while waiting
+		:param timeout: ignored
+		:return: the oldest event
+		:raise queue.Empty: if there is no event
+		"""
+		try:
+			return self.popleft()
+		except IndexError:
+			raise queue.Empty
+
+	def empty(self):
+		return not self
+
+	def qsize(self):
+		return len(self)
+
+
+def create_event_queue(thread_safe=False):
+	"""
+	:param thread_safe: True if events are posted from more than one thread
+	:return: a queue.Queue if thread_safe, otherwise a DequeEventQueue
+	"""
+	if thread_safe:
+		return queue.Queue()
+	return DequeEventQueue()
+
+def requires_thread_safe_queue(*component_classes):
+	"""
+	:param component_classes: the classes of the components sharing the event queue
+	:return: True if any of them posts events from another thread
+	"""
+	return any(getattr(cls, 'requires_thread_safe_queue', False) for cls in component_classes)
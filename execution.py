@@ -3,16 +3,26 @@
 A class hierarchy that will represent a simulated order handling mechanism and
 ultimately tie into a brokerage or other means of market connectivity.
 
-The ExecutionHandler described here is exceedingly simple, since it fills all orders at the current market price.
-This is highly unrealistic, but serves as a good baseline for improvement.
+Limit and stop orders rest in the price-sorted heaps of an orderbook.OrderBook until a bar reaches their price, they
+are cancelled or replaced, or they expire.
+
+The SimulatedExecutionHandler fills the market orders against the bars of the DataHandler through a pluggable FillModel
+(at the close of the bar, at the open of the next bar, at the VWAP of the next N bars or as partial fills capped by a
+share of the volume), with an optional Slippage model and a latency in bars. The pending orders are kept as arrays and
+every model prices all of them at once on each bar, so only the fills themselves cost a Python object.
 """
 
 import datetime
 import queue
+import time
+
+import numpy as np
 
 from abc import ABCMeta, abstractmethod
 
-from event import FillEvent, OrderEvent
+from data import BAR_FIELDS
+from event import EventType, FillEvent, OrderEvent, ib_commission
+from orderbook import BUY, SELL, OrderBook, RestingOrder
 
 class ExecutionHandler(object):
     """
@@ -29,6 +39,11 @@ class ExecutionHandler(object):
 
     __metaclass__ = ABCMeta
 
+    # True if the handler posts events from another thread, see event_queue
+    requires_thread_safe_queue = False
+    # True if the handler is constructed with the DataHandler as bars=, to price its fills
+    requires_market_data = False
+
     @abstractmethod
     def execute_order(self, event):
         """
@@ -39,29 +54,448 @@ class ExecutionHandler(object):
         """
         raise NotImplementedError("Should implement execute_order()")
 
+    def update_market(self, event):
+        """
+        Called on every MarketEvent before the strategy, e.g. to fill the orders waiting for the new bar.
+        Does nothing by default.
+
+        :param event - a market event object
+        """
+        pass
+
+    def flush(self):
+        """
+        Called by the event loop each time the event queue drains, e.g. to match the orders of the heartbeat at once.
+        Does nothing by default.
+
+        :return - True if events were put on the queue, which the loop then handles before the next heartbeat
+        """
+        return False
+
+class RateLimiter(object):
+	"""
+	Token bucket capping the rate of the messages sent to a broker, in place of a fixed sleep after every order.
+	TWS disconnects a client sending more than 50 messages per second.
+	"""
+	def __init__(self, rate=45.0, burst=None, clock=time.monotonic):
+		"""
+		:param rate: messages per second
+		:param burst: messages that may be sent at once after a quiet period, rate if None
+		:param clock: callable returning the time in seconds
+		"""
+		self.rate = float(rate)
+		self.burst = float(burst or rate)
+		self.clock = clock
+		self.tokens = self.burst
+		self.last = clock()
+
+	def reserve(self):
+		"""
+		Takes the token of one message. The tokens go negative while messages are queued,
+		so consecutive reservations beyond the rate wait one after the other.
+
+		:return: seconds to wait before sending the message, 0 within the rate
+		"""
+		now = self.clock()
+		self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+		self.last = now
+		self.tokens -= 1.0
+		return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+OPEN = BAR_FIELDS.index('open')
+LOW = BAR_FIELDS.index('low')
+HIGH = BAR_FIELDS.index('high')
+CLOSE = BAR_FIELDS.index('close')
+VOLUME = BAR_FIELDS.index('volume')
+
+
+def typical_price(cross_section):
+	"""
+	:param cross_section: (symbol, OLHCVI) array of bars
+	:return: (high + low + close) / 3 of every bar, the usual stand-in for the average traded price of a bar
+	"""
+	return (cross_section[:, HIGH] + cross_section[:, LOW] + cross_section[:, CLOSE]) / 3.0
+
+
+class PendingOrders(object):
+	"""
+	The orders waiting for a fill, as parallel arrays: the symbol index, the side (+1 BUY, -1 SELL), the quantity
+	left to fill and the bar the order reaches the market. acc_value, acc_volume and acc_bars are scratch
+	accumulators for the fill models averaging over several bars. New orders are buffered in lists and merged
+	into the arrays once per matching.
+	"""
+	COLUMNS = ('symbol', 'side', 'remaining', 'arrival', 'acc_value', 'acc_volume', 'acc_bars')
+
+	def __init__(self):
+		self.symbol = np.empty(0, dtype=np.int64)
+		self.side = np.empty(0)
+		self.remaining = np.empty(0)
+		self.arrival = np.empty(0, dtype=np.int64)
+		self.acc_value = np.empty(0)
+		self.acc_volume = np.empty(0)
+		self.acc_bars = np.empty(0, dtype=np.int64)
+		self._incoming = []
+
+	def __len__(self):
+		return len(self.symbol) + len(self._incoming)
+
+	def add(self, symbol, side, quantity, arrival):
+		"""
+		:param symbol: index of the symbol in the symbol list
+		:param side: +1 for BUY, -1 for SELL
+		:param quantity: quantity to fill
+		:param arrival: index of the bar the order reaches the market
+		"""
+		self._incoming.append((symbol, side, quantity, arrival))
+
+	def flush(self):
+		"""
+		Merges the buffered orders into the arrays.
+		"""
+		if self._incoming:
+			symbol, side, quantity, arrival = zip(*self._incoming)
+			n = len(self._incoming)
+			self._incoming = []
+			self.symbol = np.concatenate((self.symbol, symbol))
+			self.side = np.concatenate((self.side, side))
+			self.remaining = np.concatenate((self.remaining, quantity))
+			self.arrival = np.concatenate((self.arrival, arrival))
+			self.acc_value = np.concatenate((self.acc_value, np.zeros(n)))
+			self.acc_volume = np.concatenate((self.acc_volume, np.zeros(n)))
+			self.acc_bars = np.concatenate((self.acc_bars, np.zeros(n, dtype=np.int64)))
+
+	def compact(self):
+		"""
+		Drops the orders filled completely.
+		"""
+		keep = self.remaining > 0
+		if not keep.all():
+			for name in self.COLUMNS:
+				setattr(self, name, getattr(self, name)[keep])
+
+
+class FillModel(object):
+	"""
+	FillModel is an abstract base class deciding how much of every pending order fills on a bar, and at what price.
+	"""
+
+	__metaclass__ = ABCMeta
+
+	# bars between the arrival of an order at the market and its first possible fill
+	delay = 0
+
+	@abstractmethod
+	def match(self, orders, cross_section, age):
+		"""
+		:param orders: the PendingOrders, flushed
+		:param cross_section: (symbol, OLHCVI) array of the bar, indexed by orders.symbol
+		:param age: vector of the bars since each order reached the market, negative while it is in flight
+		:return: (quantity, price) - vectors over the orders of the unsigned quantity filled on this bar,
+		0 for none, and of its price before slippage
+		"""
+		raise NotImplementedError("Should implement match()")
+
+class CloseFillModel(FillModel):
+	"""
+	Fills the whole order at the close of the bar it reaches the market, the behaviour of the original simulator.
+	"""
+	def match(self, orders, cross_section, age):
+		price = cross_section[orders.symbol, CLOSE]
+		return np.where(age >= 0, orders.remaining, 0.0), price
+
+class NextBarOpenFillModel(FillModel):
+	"""
+	Fills the whole order at the open of the bar after it reaches the market.
+	"""
+	delay = 1
+
+	def match(self, orders, cross_section, age):
+		price = cross_section[orders.symbol, OPEN]
+		return np.where(age >= 1, orders.remaining, 0.0), price
+
+class VWAPFillModel(FillModel):
+	"""
+	Fills the whole order at the volume-weighted average of the typical prices of the N bars after it reaches the market.
+	"""
+	delay = 1
+
+	def __init__(self, bars=5):
+		"""
+		:param bars: number of bars of the average
+		"""
+		self.bars = bars
+
+	def match(self, orders, cross_section, age):
+		bar = cross_section[orders.symbol]
+		price = typical_price(bar)
+		volume = bar[:, VOLUME]
+		# bars without a price (symbol not trading) do not count towards the N bars
+		counted = (age >= 1) & ~np.isnan(price)
+		orders.acc_value += np.where(counted, price * np.nan_to_num(volume), 0.0)
+		orders.acc_volume += np.where(counted, np.nan_to_num(volume), 0.0)
+		orders.acc_bars += counted
+
+		done = orders.acc_bars >= self.bars
+		with np.errstate(divide='ignore', invalid='ignore'):
+			vwap = np.where(orders.acc_volume > 0, orders.acc_value / orders.acc_volume, price)
+		return np.where(done, orders.remaining, 0.0), vwap
+
+class ParticipationFillModel(FillModel):
+	"""
+	From the bar after it reaches the market, fills on every bar at most a share of the volume of the bar, at its
+	typical price, until the order is complete. The rest of an order carries over to the next bar as a partial fill.
+	"""
+	delay = 1
+
+	def __init__(self, rate=0.1):
+		"""
+		:param rate: share of the volume of a bar the orders of a symbol may take, e.g. 0.1 for 10%
+		"""
+		self.rate = rate
+
+	def match(self, orders, cross_section, age):
+		bar = cross_section[orders.symbol]
+		capacity = np.floor(self.rate * np.nan_to_num(bar[:, VOLUME]))
+		# the orders of a symbol share its capacity, the oldest first
+		quantity = np.zeros(len(orders.symbol))
+		active = np.flatnonzero(age >= 1)
+		if len(active) > 0:
+			order = active[np.argsort(orders.symbol[active], kind='stable')]
+			symbol, remaining = orders.symbol[order], orders.remaining[order]
+			before = np.cumsum(remaining) - remaining
+			# cumulative quantity of the earlier orders of the same symbol
+			start = np.flatnonzero(np.r_[True, symbol[1:] != symbol[:-1]])
+			before -= np.repeat(before[start], np.diff(np.r_[start, len(order)]))
+			quantity[order] = np.clip(capacity[order] - before, 0.0, remaining)
+		return quantity, typical_price(bar)
+
+
+class Slippage(object):
+	"""
+	Slippage is an abstract base class moving the fill prices against the orders.
+	"""
+
+	__metaclass__ = ABCMeta
+
+	@abstractmethod
+	def apply(self, price, side):
+		"""
+		:param price: vector of fill prices
+		:param side: vector of +1 for BUY, -1 for SELL
+		:return: vector of the prices after slippage
+		"""
+		raise NotImplementedError("Should implement apply()")
+
+class FixedSlippage(Slippage):
+	"""
+	Moves every fill by a fixed amount per unit.
+	"""
+	def __init__(self, amount=0.01):
+		"""
+		:param amount: price difference per unit, in USD
+		"""
+		self.amount = amount
+
+	def apply(self, price, side):
+		return price + side * self.amount
+
+class PercentSlippage(Slippage):
+	"""
+	Moves every fill by a fraction of its price.
+	"""
+	def __init__(self, fraction=0.0005):
+		"""
+		:param fraction: price difference as a fraction of the price, e.g. 0.0005 for 5 basis points
+		"""
+		self.fraction = fraction
+
+	def apply(self, price, side):
+		return price * (1.0 + side * self.fraction)
+
+
 class SimulatedExecutionHandler(ExecutionHandler):
 	"""
-	The simulated execution handler simply converts all order objects into their equivalent fill objects automatically
-    without consideration of :
-    * latency
-    * slippage
-    * fill-ratio issues
+	The simulated execution handler converts the order objects into fill objects against the bars of the
+	DataHandler, timestamped with the bar they fill on, with consideration of :
+    * latency: the orders reach the market a number of bars after they are made
+    * slippage: a Slippage model moves the fill prices against the orders
+    * fill-ratio issues: the FillModel may fill an order in parts over several bars
+
+	Limit and stop orders rest in an OrderBook from the bar after they reach the market and fill in full when a bar
+	reaches their price, a limit at its price or better and a stop at its price or worse, with slippage.
 	"""
-	def __init__(self, events):
+	requires_market_data = True
+
+	def __init__(self, events, bars=None, fill_model=None, slippage=None, latency=0, exchange='ARCA'):
 		"""
 		Set up events queue
 		:param events -  a Queue object
+		:param bars - the DataHandler; without it every order fills at once with no price nor bar timestamp
+		:param fill_model - a FillModel, CloseFillModel() if None
+		:param slippage - a Slippage model, or None
+		:param latency - bars between an order and its arrival at the market
+		:param exchange - exchange reported on the fills
 		"""
 		self.events = events
+		self.bars = bars
+		self.fill_model = fill_model or CloseFillModel()
+		self.slippage = slippage
+		self.latency = latency
+		self.exchange = exchange
+
+		if self.bars is not None:
+			self.symbol_list = self.bars.symbol_list
+			self.symbol_index = {s: i for i, s in enumerate(self.symbol_list)}
+		self.orders = PendingOrders()
+		# index of the latest bar
+		self.bar = -1
+		# an order can fill on the bar it is made, so the orders of a heartbeat are matched together by flush()
+		self.fill_on_order = self.latency == 0 and self.fill_model.delay == 0
+		self._unmatched = False
+		self.order_book = OrderBook()
 
 	def execute_order(self, event):
 		"""
-		Simply converts all order objects into fill objects without consideration of : latency, slippage, and fill-ratio issues
+		Queues the order until it reaches the market, or fills it right away when it can fill on the current bar.
+		A limit or stop order rests in the order book, or replaces the resting order with the same order_id.
 
 		:param event -  Order event object
 		:return:
 		"""
-		if event.type == 'ORDER':
-			fill_event = FillEvent(datetime.datetime.utcnow(), event.symbol, 'ARCA',
-								   event.quantity, event.direction, None)
-			self.events.put(fill_event)
\ No newline at end of file
+		if event.type == EventType.ORDER:
+			if self.bars is None:
+				fill_event = FillEvent(datetime.datetime.utcnow(), event.symbol, self.exchange,
+									   event.quantity, event.direction, None)
+				self.events.put(fill_event)
+				return
+
+			if event.order_type != 'MKT':
+				self._rest_order(event)
+				return
+
+			side = 1.0 if event.direction == 'BUY' else -1.0
+			self.orders.add(self.symbol_index[event.symbol], side, float(event.quantity), self.bar + self.latency)
+			if self.fill_on_order:
+				self._unmatched = True
+
+	def flush(self):
+		"""
+		Matches the orders that can fill on the current bar in one pass, once the event queue has drained.
+
+		:return: True if fills were put on the queue
+		"""
+		if self._unmatched:
+			self._unmatched = False
+			return self._match_orders() > 0
+		return False
+
+	def get_state(self):
+		"""
+		:return: the pending and resting orders and the bar index, for a checkpoint
+		"""
+		return {'orders': self.orders, 'order_book': self.order_book, 'bar': self.bar}
+
+	def set_state(self, state):
+		"""
+		:param state: a state from get_state()
+		"""
+		self.orders = state['orders']
+		self.order_book = state['order_book']
+		self.bar = state['bar']
+
+	def update_market(self, event):
+		"""
+		Matches the pending orders against the new bar.
+
+		:param event - a market event object
+		"""
+		if event.type == EventType.MARKET and self.bars is not None:
+			self.bar += 1
+			self.order_book.advance(self.bar)
+			if len(self.order_book) > 0:
+				self._match_resting_orders()
+			if len(self.orders) > 0:
+				self._match_orders()
+
+	def _rest_order(self, event):
+		"""
+		Adds a limit or stop order to the order book, or replaces the resting order with its order_id.
+		"""
+		if event.order_id in self.order_book:
+			self.replace_order(event.order_id, event.quantity, event.price, event.expiry)
+			return
+		activation = self.bar + self.latency + 1
+		expiry = None if event.expiry is None else activation + event.expiry - 1
+		side = BUY if event.direction == 'BUY' else SELL
+		self.order_book.add(RestingOrder(event.order_id, event.symbol, event.order_type, side,
+										 event.quantity, event.price, activation, expiry))
+
+	def cancel_order(self, order_id):
+		"""
+		Cancels a resting limit or stop order.
+
+		:param order_id: identifier of the order
+		:return: True if the order was live
+		"""
+		return self.order_book.cancel(order_id) is not None
+
+	def replace_order(self, order_id, quantity=None, price=None, expiry=None):
+		"""
+		Changes a resting limit or stop order; a new price loses its time priority.
+
+		:param order_id: identifier of the order
+		:param quantity: new quantity, or None to keep it
+		:param price: new limit or stop price, or None to keep it
+		:param expiry: number of bars from the next one the order rests before it is cancelled, or None to keep it
+		:return: True if the order was live
+		"""
+		if expiry is not None and order_id in self.order_book:
+			# counted from the next bar, or from the activation of an order still in flight
+			expiry = max(self.bar + 1, self.order_book.orders[order_id].activation) + expiry - 1
+		return self.order_book.replace(order_id, quantity, price, expiry) is not None
+
+	def _match_resting_orders(self):
+		"""
+		Fills the resting orders reached by the latest bar, popping only those from the heaps of each symbol.
+		"""
+		cross_section = self.bars.get_latest_cross_section()
+		dt = None
+		for symbol in self.order_book.symbols():
+			bar = cross_section[self.symbol_index[symbol]]
+			for order, price in self.order_book.match(symbol, bar[OPEN], bar[HIGH], bar[LOW]):
+				if order.order_type == 'STP' and self.slippage is not None:
+					price = float(self.slippage.apply(price, order.side))
+				if dt is None:
+					dt = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+				self.events.put(FillEvent(dt, symbol, self.exchange, order.quantity,
+										  'BUY' if order.side == BUY else 'SELL', price))
+
+	def _match_orders(self):
+		"""
+		Prices every pending order on the latest bar at once and puts a FillEvent for each (partial) fill.
+
+		:return: the number of fills
+		"""
+		orders = self.orders
+		orders.flush()
+		cross_section = self.bars.get_latest_cross_section()
+		quantity, price = self.fill_model.match(orders, cross_section, self.bar - orders.arrival)
+		if self.slippage is not None:
+			price = self.slippage.apply(price, orders.side)
+
+		# a symbol without a price on this bar does not trade
+		filled = np.flatnonzero((quantity > 0) & ~np.isnan(price))
+		if len(filled) == 0:
+			return 0
+		quantity, price = quantity[filled], price[filled]
+		commission = ib_commission(quantity, price)
+		orders.remaining[filled] -= quantity
+
+		dt = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+		put = self.events.put
+		for i, side, q, p, c in zip(orders.symbol[filled].tolist(), orders.side[filled].tolist(),
+									quantity.tolist(), price.tolist(), commission.tolist()):
+			put(FillEvent(dt, self.symbol_list[i], self.exchange, int(q), 'BUY' if side > 0 else 'SELL', p, c))
+		orders.compact()
+		return len(filled)
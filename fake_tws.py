@@ -0,0 +1,148 @@
+"""
+Fake TWS server
+
+Serves the simplified line protocol of async_execution locally, to test the AsyncIBExecutionHandler without a
+brokerage account. Every order is acknowledged with openOrder and a 'Submitted' orderStatus, then filled after
+a delay, in one or several partial fills: a market order at the price set for its symbol, a limit or stop order
+at its own price. The server also records the time every message was received, e.g. to check the rate limiting.
+
+Usage as a command:
+	python fake_tws.py --port 7497 --fill-delay 0.05 --partial-fills 2
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+
+from line_protocol import format_message, parse_message
+
+
+class FakeTWS(object):
+	"""
+	asyncio server speaking enough of the protocol for the AsyncIBExecutionHandler.
+	"""
+	def __init__(self, host='127.0.0.1', port=0, prices=None, default_price=100.0, fill_delay=0.01,
+				 partial_fills=1, reject_symbols=(), first_order_id=1):
+		"""
+		:param host: host to listen on
+		:param port: port to listen on, 0 for any free port
+		:param prices: dict of symbol -> fill price of the market orders
+		:param default_price: fill price of the market orders of the other symbols
+		:param fill_delay: seconds between the acknowledgement of an order and each of its fills
+		:param partial_fills: number of fills an order is split into
+		:param reject_symbols: symbols whose orders are rejected with an error message
+		:param first_order_id: order id sent as nextValidId
+		"""
+		self.host = host
+		self.port = port
+		self.prices = dict(prices or {})
+		self.default_price = default_price
+		self.fill_delay = fill_delay
+		self.partial_fills = partial_fills
+		self.reject_symbols = set(reject_symbols)
+		self.first_order_id = first_order_id
+
+		# (time received, fields) of every message from the clients
+		self.received = []
+		self._orders = {}
+		self._server = None
+		self._loop = None
+		self._thread = None
+
+	async def start(self):
+		"""
+		Starts listening, on the running loop.
+
+		:return: the port listened on
+		"""
+		self._server = await asyncio.start_server(self._serve_client, self.host, self.port)
+		self.port = self._server.sockets[0].getsockname()[1]
+		return self.port
+
+	async def stop(self):
+		self._server.close()
+		await self._server.wait_closed()
+
+	def start_in_thread(self):
+		"""
+		Runs the server on its own loop in a background thread.
+
+		:return: the port listened on
+		"""
+		self._loop = asyncio.new_event_loop()
+		self._thread = threading.Thread(target=self._loop.run_forever, name='FakeTWS', daemon=True)
+		self._thread.start()
+		return asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+	def stop_thread(self):
+		asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+		self._loop.call_soon_threadsafe(self._loop.stop)
+		self._thread.join()
+
+	async def _serve_client(self, reader, writer):
+		writer.write(format_message('nextValidId', self.first_order_id))
+		await writer.drain()
+		tasks = []
+		while True:
+			line = await reader.readline()
+			if not line:
+				break
+			fields = parse_message(line)
+			self.received.append((time.monotonic(), fields))
+			if fields[0] == 'placeOrder':
+				tasks.append(asyncio.ensure_future(self._handle_order(writer, fields)))
+			elif fields[0] == 'cancelOrder':
+				self._cancel_order(writer, int(fields[1]))
+		for task in tasks:
+			task.cancel()
+		writer.close()
+
+	async def _handle_order(self, writer, fields):
+		order_id, symbol, _, exchange, _, action, quantity, order_type, price = fields[1:10]
+		order_id, quantity = int(order_id), int(quantity)
+		if symbol in self.reject_symbols:
+			writer.write(format_message('error', order_id, 201, 'Order rejected - reason: %s is not tradable' % symbol))
+			return
+
+		price = float(price) if order_type in ('LMT', 'STP') else self.prices.get(symbol, self.default_price)
+		order = self._orders[order_id] = {'filled': 0, 'remaining': quantity, 'cancelled': False}
+		writer.write(format_message('openOrder', order_id, symbol, exchange, action, quantity, order_type))
+		writer.write(format_message('orderStatus', order_id, 'Submitted', 0, quantity, 0.0))
+
+		n = max(1, min(self.partial_fills, quantity))
+		for k in range(n):
+			await asyncio.sleep(self.fill_delay)
+			if order['cancelled']:
+				return
+			lot = quantity // n + (1 if k < quantity % n else 0)
+			order['filled'] += lot
+			order['remaining'] -= lot
+			status = 'Filled' if order['remaining'] == 0 else 'PartiallyFilled'
+			writer.write(format_message('orderStatus', order_id, status, order['filled'], order['remaining'], price))
+		await writer.drain()
+
+	def _cancel_order(self, writer, order_id):
+		order = self._orders.get(order_id)
+		if order is None or order['remaining'] == 0:
+			writer.write(format_message('error', order_id, 135, "Can't find order with id = %d" % order_id))
+			return
+		order['cancelled'] = True
+		writer.write(format_message('orderStatus', order_id, 'Cancelled', order['filled'], order['remaining'], 0.0))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Serve the simplified TWS protocol of async_execution.")
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=7497)
+	parser.add_argument('--price', type=float, default=100.0, help='fill price of the market orders')
+	parser.add_argument('--fill-delay', type=float, default=0.01, help='seconds before each fill')
+	parser.add_argument('--partial-fills', type=int, default=1, help='fills an order is split into')
+	args = parser.parse_args()
+
+	async def serve():
+		server = FakeTWS(args.host, args.port, default_price=args.price, fill_delay=args.fill_delay,
+						 partial_fills=args.partial_fills)
+		print("Fake TWS listening on %s:%d" % (args.host, await server.start()))
+		await server._server.serve_forever()
+	asyncio.run(serve())
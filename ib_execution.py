@@ -5,6 +5,10 @@ and then to execute them directly against the Interactive Brokers order API usin
 The class will also handle the "Server Response" messages sent back via the API. At this stage, the only action
 taken will be to create corresponding FillEvent instances that will then be sent back to the events queue.
 
+The orders are not followed by a fixed sleep: they are tracked by order ID in fill_dict from the moment they are
+placed, and a client-side RateLimiter only delays the orders sent faster than TWS accepts them. See async_execution
+for an asyncio implementation that does not need IbPy.
+
 Notice that this class is only for example hence not includes:
 - execution optimisation logic
 - sophisticated error handling
@@ -17,25 +21,30 @@ from ib.ext.Contract import Contract
 from ib.ext.Order import Order
 from ib.opt import ibConnection, message
 
-from event import FillEvent, OrderEvent
-from execution import ExecutionHandler
+from event import EventType, FillEvent, OrderEvent
+from execution import ExecutionHandler, RateLimiter
 
 class IBExecutionHandler(ExecutionHandler):
-    """
-    Handles order execution via the Interactive Brokers
-    API, for use against accounts when trading live
-    directly.
-    """
-	def __init__(self, events, order_routing="SMART", currency="USD"):
+	"""
+	Handles order execution via the Interactive Brokers
+	API, for use against accounts when trading live
+	directly.
+	"""
+	# fills are posted from the callback thread of the TWS connection
+	requires_thread_safe_queue = True
+
+	def __init__(self, events, order_routing="SMART", currency="USD", max_rate=45.0):
 		"""
-		:param events:
-		:param order_routing:
-		:param currency:
+		:param events: The Event Queue object.
+		:param order_routing: The exchange the orders are routed to.
+		:param currency: The currency of the contracts.
+		:param max_rate: Orders per second sent at most.
 		"""
 		self.events = events
 		self.order_routing = order_routing
 		self.currency = currency
 		self.fill_dict = {}
+		self.rate_limiter = RateLimiter(max_rate)
 
 		self.tws_conn = self.create_tws_connection()
 		self.order_id = self.create_init_order_id()
@@ -55,37 +64,34 @@ class IBExecutionHandler(ExecutionHandler):
 		:param msg:
 		:return:
 		"""
-		# Handle open order orderId processing
-		if msg.typeName == "openOrder" and \
-			msg.orderId == self.order_id and \
-			not self.fill_dict.has_key(msg.orderId):
-			self.create_fill_dict_entrp(msg)
+		# Handle open order orderId processing, for orders not placed by this handler
+		if msg.typeName == "openOrder" and msg.orderId not in self.fill_dict:
+			self.create_fill_dict_entry(msg)
 
 		# Handle Fills
-		if msg.typeName == "orderStatus" and \
-			msg.status == "Filled" and \
-			self.fill_dict[msg.orderId]["filled"] == False:
+		if msg.typeName == "orderStatus" and msg.orderId in self.fill_dict and \
+			self.fill_dict[msg.orderId]["filled"] < msg.filled:
 			self.create_fill(msg)
-		print("Server Response: %s, %s\n" % msg.typeName, msg)
+		print("Server Response: %s, %s\n" % (msg.typeName, msg))
 
 	def create_tws_connection(self):
 		"""
-    	Connect to the Trader Workstation (TWS)
-    	- port: 7496
-    	- clientId: 10
+		Connect to the Trader Workstation (TWS)
+		- port: 7496
+		- clientId: 10
 
-    	The clientId is chosen by us and we will need  separate IDs for both the execution connection and
-    	market data connection, if the latter is used elsewhere.
-    	"""
+		The clientId is chosen by us and we will need  separate IDs for both the execution connection and
+		market data connection, if the latter is used elsewhere.
+		"""
 		tws_conn = ibConnection()
 		tws_conn.connect()
 		return tws_conn
 
 	def create_init_order_id(self):
 		"""
-        Creates the initial order ID used for Interactive
-        Brokers to keep track of submitted orders.
-        """
+		Creates the initial order ID used for Interactive
+		Brokers to keep track of submitted orders.
+		"""
 		# There is scope for more logic here, but we
 		# will use "1" as the default for now.
 		return 1
@@ -93,21 +99,21 @@ class IBExecutionHandler(ExecutionHandler):
 
 	def register_handlers(self):
 		"""
-        Register the error and server reply
-        message handling functions.
-        """
+		Register the error and server reply
+		message handling functions.
+		"""
 		# Assign the error handling function defined above
-        # to the TWS connection
-        self.tws_conn.register(self._error_handler, 'Error')
+		# to the TWS connection
+		self.tws_conn.register(self._error_handler, 'Error')
 
 		# Assign all of the server reply messages to the
-        # reply_handler function defined above
-        self.tws_conn.registerAll(self._reply_handler)
+		# reply_handler function defined above
+		self.tws_conn.registerAll(self._reply_handler)
 
 	def create_contract(self, symbol, sec_type, exch, prim_exch, curr):
 		"""
 		Create a Contract object defining what will
-        be purchased, at which exchange and in which currency.
+		be purchased, at which exchange and in which currency.
 
 		:param symbol - The ticker symbol for the contract
 		:param sec_type - The security type for the contract ('STK' is 'stock')
@@ -124,25 +130,30 @@ class IBExecutionHandler(ExecutionHandler):
 		contract.m_currency = curr
 		return contract
 
-	def create_order(self, order_type, quantity, action):
+	def create_order(self, order_type, quantity, action, price=None):
 		"""
-		Create an Order object (Market/Limit) to go long/short
+		Create an Order object (Market/Limit/Stop) to go long/short
 
-		:param order_type: 'MKT', 'LMT' for market or limit order
+		:param order_type: 'MKT', 'LMT' or 'STP' for market, limit or stop order
 		:param quantity: Integral numbers of assets to order
 		:param action: 'BUY' or 'SELL'
+		:param price: the limit price of a 'LMT' order, the stop price of a 'STP' order
 		:return: order object
 		"""
 		order = Order()
 		order.m_orderType = order_type
 		order.m_totalQuantity = quantity
 		order.m_action = action
+		if order_type == 'LMT':
+			order.m_lmtPrice = price
+		elif order_type == 'STP':
+			order.m_auxPrice = price
 		return order
 
 	def create_fill_dict_entry(self, msg):
 		"""
 		Creates an entry in the Fill Dictionary that lists orderIds and provides security information. This is
-        needed for the event-driven behaviour of the IB server message behaviour.
+		needed for the event-driven behaviour of the IB server message behaviour.
 
 		:param msg:
 		:return:
@@ -151,13 +162,15 @@ class IBExecutionHandler(ExecutionHandler):
 			"symbol":msg.contract.m_symbol,
 			"exchange":msg.contract.m_exchange,
 			"direction":msg.order.m_action,
-			"filled":False
+			"filled":0,
+			"avg_price":0.0
 		}
 
 	def create_fill(self, msg):
 		"""
 		Handles the creation of the FillEvent that will be placed onto the events queue subsequent to an order
-        being filled.
+		being filled, in full or in part. The filled quantity and average price of an orderStatus message are
+		cumulative, the fill carries the difference with the previous message.
 
 		:param msg:
 		:return:
@@ -168,8 +181,8 @@ class IBExecutionHandler(ExecutionHandler):
 		symbol = fd["symbol"]
 		exchange = fd["exchange"]
 		direction = fd["direction"]
-		filled = msg.filled
-		fill_cost = msg.avgFillPrice
+		filled = msg.filled - fd["filled"]
+		fill_cost = (msg.avgFillPrice * msg.filled - fd["avg_price"] * fd["filled"]) / filled
 
 		# Create a fill event object
 		fill_event = FillEvent(
@@ -179,7 +192,8 @@ class IBExecutionHandler(ExecutionHandler):
 
 		# Make sure that multiple messages don't create
 		# additional fills.
-		self.fill_dict[msg.orderId]["filled"] = True
+		fd["filled"] = msg.filled
+		fd["avg_price"] = msg.avgFillPrice
 
 		# Place the fill event onto the event queue
 		self.events.put(fill_event)
@@ -187,13 +201,12 @@ class IBExecutionHandler(ExecutionHandler):
 	def execute_order(self, event):
 		"""
 		Creates the necessary InteractiveBrokers order object and submits it to IB via their API.
-        The results are then queried in order to generate a corresponding Fill object, which is placed back on
-        the event queue.
+		The fills are placed on the event queue by the reply handler as the orderStatus messages arrive.
 
 		:param event: Order event object
 		:return:
 		"""
-		if event.type == 'ORDER':
+		if event.type == EventType.ORDER:
 			# Prepare the parameters for the asset order
 			asset = event.symbol
 			asset_type = "STK"
@@ -202,21 +215,32 @@ class IBExecutionHandler(ExecutionHandler):
 			direction = event.direction
 
 			# Create the Interactive Brokers contract via the passed Order event
-            ib_contract = self.create_contract(
-                asset, asset_type, self.order_routing,
-                self.order_routing, self.currency
-            )
+			ib_contract = self.create_contract(
+				asset, asset_type, self.order_routing,
+				self.order_routing, self.currency
+			)
 
 			# Create the Interactive Brokers order via the passed Order event
-            ib_order = self.create_order(
-                order_type, quantity, direction
-            )
+			ib_order = self.create_order(
+				order_type, quantity, direction, event.price
+			)
+
+			# Track the order by its ID before any reply can arrive
+			self.fill_dict[self.order_id] = {
+				"symbol":asset,
+				"exchange":self.order_routing,
+				"direction":direction,
+				"filled":0,
+				"avg_price":0.0
+			}
+
+			# Wait only if the orders are sent faster than TWS accepts them
+			wait = self.rate_limiter.reserve()
+			if wait > 0:
+				time.sleep(wait)
 
 			# Use the connection to the send the order to IB
-            self.tws_conn.placeOrder(
-                self.order_id, ib_contract, ib_order
-            )
-
-			# NOTE: This following line is crucial, it ensures the order goes through!
-            time.sleep(1)
-			self.order_id += 1
\ No newline at end of file
+			self.tws_conn.placeOrder(
+				self.order_id, ib_contract, ib_order
+			)
+			self.order_id += 1
@@ -0,0 +1,322 @@
+"""
+Incremental indicators
+
+An indicator keeps a running state per symbol and is updated once per bar with the latest cross-section of the
+DataHandler, a (symbol, OLHCVI) array. Every update costs O(1) per symbol whatever the length of the window, and
+the state and value of all the symbols are NumPy vectors, so a bar costs a handful of array operations rather
+than a loop over the symbols and a recomputation over get_latest_bars(s, N).
+
+A missing bar (NaN, e.g. a symbol not listed yet) never poisons the state: windowed indicators are NaN until
+their window holds period valid bars again, smoothed indicators keep their state and skip the bar.
+
+A Strategy registers its indicators once and updates them at the start of caculate_signals():
+
+	self.indicators = IndicatorSet(bars)
+	self.fast = self.indicators.add('fast', SMA(len(symbol_list), 10))
+	...
+	self.indicators.update()
+	long = self.fast.value > self.slow.value
+"""
+
+import numpy as np
+
+from abc import ABCMeta, abstractmethod
+
+from data import BAR_FIELDS
+
+CLOSE = BAR_FIELDS.index('close')
+HIGH = BAR_FIELDS.index('high')
+LOW = BAR_FIELDS.index('low')
+
+
+class Indicator(object):
+	"""
+	Indicator is an abstract base class of the incremental indicators, computed for every symbol at once.
+	"""
+
+	__metaclass__ = ABCMeta
+
+	def __init__(self, n_symbols, period):
+		"""
+		:param n_symbols: number of symbols of the cross-sections
+		:param period: number of bars of the indicator
+		"""
+		if period < 1:
+			raise ValueError("The period of an indicator must be at least 1, got %d." % period)
+		self.n_symbols = n_symbols
+		self.period = period
+		self.value = np.full(n_symbols, np.nan)
+
+	@abstractmethod
+	def update(self, cross_section):
+		"""
+		Folds the latest bar of every symbol into the indicator and refreshes value.
+
+		:param cross_section: (symbol, OLHCVI) array of the latest bar of every symbol
+		"""
+		raise NotImplementedError("Should implement update()")
+
+	@property
+	def ready(self):
+		"""
+		:return: boolean vector, True for the symbols whose value is known
+		"""
+		return ~np.isnan(self.value)
+
+
+class RollingWindow(Indicator):
+	"""
+	Base class of the indicators over the last period values of one field. The window is a (period, symbol)
+	ring; a NaN enters the window as 0 and is counted, and the value of a symbol is NaN while its window
+	holds any NaN.
+	"""
+	def __init__(self, n_symbols, period, field='close'):
+		"""
+		:param n_symbols: number of symbols of the cross-sections
+		:param period: number of bars of the window
+		:param field: one of 'open', 'low', 'high', 'close', 'volume', 'oi'
+		"""
+		super(RollingWindow, self).__init__(n_symbols, period)
+		self.field = BAR_FIELDS.index(field)
+		self.window = np.zeros((period, n_symbols))
+		self.missing = np.zeros((period, n_symbols), dtype=bool)
+		# the first period bars are missing until they are seen
+		self.missing[:] = True
+		self.n_missing = np.full(n_symbols, period)
+		self.count = 0
+
+	def _push(self, cross_section):
+		"""
+		Replaces the oldest value of the window by the latest one.
+
+		:return: (slot, old, new) - the ring slot written and the values leaving and entering the window, NaN as 0
+		"""
+		x = cross_section[:, self.field]
+		slot = self.count % self.period
+		nan = np.isnan(x)
+		new = np.where(nan, 0.0, x)
+		old = self.window[slot].copy()
+		self.n_missing += nan.astype(np.int64) - self.missing[slot]
+		self.window[slot] = new
+		self.missing[slot] = nan
+		self.count += 1
+		return slot, old, new
+
+
+class SMA(RollingWindow):
+	"""
+	Simple moving average over the last period bars, kept as a running sum.
+	"""
+	def __init__(self, n_symbols, period, field='close'):
+		super(SMA, self).__init__(n_symbols, period, field)
+		self.total = np.zeros(n_symbols)
+
+	def update(self, cross_section):
+		slot, old, new = self._push(cross_section)
+		if slot == self.period - 1:
+			# re-sum once per lap of the ring so the rounding errors of the running sum do not build up
+			self.total = self.window.sum(axis=0)
+		else:
+			self.total += new - old
+		self.value = np.where(self.n_missing == 0, self.total / self.period, np.nan)
+
+
+class RollingStd(RollingWindow):
+	"""
+	Rolling standard deviation over the last period bars, kept as a running sum and sum of squares.
+	"""
+	def __init__(self, n_symbols, period, field='close', ddof=1):
+		"""
+		:param ddof: delta degrees of freedom, 1 for the sample standard deviation as in pandas
+		"""
+		super(RollingStd, self).__init__(n_symbols, period, field)
+		if period <= ddof:
+			raise ValueError("The period of a rolling std must be larger than ddof=%d." % ddof)
+		self.ddof = ddof
+		self.total = np.zeros(n_symbols)
+		self.total_sq = np.zeros(n_symbols)
+
+	def update(self, cross_section):
+		slot, old, new = self._push(cross_section)
+		if slot == self.period - 1:
+			self.total = self.window.sum(axis=0)
+			self.total_sq = np.square(self.window).sum(axis=0)
+		else:
+			self.total += new - old
+			self.total_sq += new * new - old * old
+		var = (self.total_sq - self.total * self.total / self.period) / (self.period - self.ddof)
+		# the difference of the sums may round slightly below zero for a constant window
+		self.value = np.where(self.n_missing == 0, np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+
+class RollingMax(RollingWindow):
+	"""
+	Rolling maximum over the last period bars.
+
+	The classic monotonic deque holds a different number of candidates per symbol, which cannot be kept
+	as one vector. The van Herk/Gil-Werman scheme reaches the same amortised O(1) per bar with fixed-shape
+	arrays: the window is split at the last multiple of period into the tail of the previous block, whose
+	suffix maxima are computed once per block, and the head of the current block, whose running maximum is
+	updated on every bar.
+	"""
+	# np.maximum for RollingMax, np.minimum for RollingMin
+	_reduce = np.maximum
+	_empty = -np.inf
+
+	def __init__(self, n_symbols, period, field='close'):
+		super(RollingMax, self).__init__(n_symbols, period, field)
+		# suffix[j] is the extremum of the slots j.. of the previous block, the last row is the empty suffix
+		self.suffix = np.full((period + 1, n_symbols), self._empty)
+		self.prefix = np.full(n_symbols, self._empty)
+
+	def update(self, cross_section):
+		slot, old, new = self._push(cross_section)
+		x = np.where(self.missing[slot], self._empty, new)
+		self.prefix = self._reduce(self.prefix, x)
+		extremum = self._reduce(self.suffix[slot + 1], self.prefix)
+		self.value = np.where(self.n_missing == 0, extremum, np.nan)
+
+		if slot == self.period - 1:
+			# the block is complete: it becomes the previous block of the next one
+			block = np.where(self.missing, self._empty, self.window)
+			self.suffix[:-1] = self._reduce.accumulate(block[::-1], axis=0)[::-1]
+			self.prefix[:] = self._empty
+
+
+class RollingMin(RollingMax):
+	"""
+	Rolling minimum over the last period bars, see RollingMax.
+	"""
+	_reduce = np.minimum
+	_empty = np.inf
+
+
+class EMA(Indicator):
+	"""
+	Exponential moving average with alpha = 2 / (period + 1), seeded with the first valid value of each
+	symbol. The value is NaN until a symbol has period valid bars.
+	"""
+	def __init__(self, n_symbols, period, field='close'):
+		"""
+		:param n_symbols: number of symbols of the cross-sections
+		:param period: span of the average
+		:param field: one of 'open', 'low', 'high', 'close', 'volume', 'oi'
+		"""
+		super(EMA, self).__init__(n_symbols, period)
+		self.field = BAR_FIELDS.index(field)
+		self.alpha = 2.0 / (period + 1)
+		self.ema = np.full(n_symbols, np.nan)
+		self.count = np.zeros(n_symbols, dtype=np.int64)
+
+	def update(self, cross_section):
+		x = cross_section[:, self.field]
+		valid = ~np.isnan(x)
+		seeded = self.count > 0
+		self.ema = np.where(valid & seeded, self.ema + self.alpha * (x - self.ema), np.where(valid, x, self.ema))
+		self.count += valid
+		self.value = np.where(self.count >= self.period, self.ema, np.nan)
+
+
+class WilderAverage(Indicator):
+	"""
+	Base class of the indicators smoothed with Wilder's average: the mean of the first period inputs, then
+	avg = (avg * (period - 1) + x) / period. Both are avg += (x - avg) / min(n, period) for the n-th input,
+	so the symbols can be at different stages of their history within one vector update.
+	"""
+	def __init__(self, n_symbols, period):
+		super(WilderAverage, self).__init__(n_symbols, period)
+		self.count = np.zeros(n_symbols, dtype=np.int64)
+
+	def _smooth(self, avg, x, valid):
+		"""
+		:param avg: the averages, updated in place where valid
+		:param x: the new inputs
+		:param valid: boolean vector of the symbols having a new input
+		"""
+		n = np.minimum(self.count, self.period)
+		np.add(avg, (x - avg) / np.maximum(n, 1), out=avg, where=valid)
+
+
+class RSI(WilderAverage):
+	"""
+	Relative Strength Index of the closes, with Wilder's smoothing of the gains and losses.
+	"""
+	def __init__(self, n_symbols, period=14):
+		super(RSI, self).__init__(n_symbols, period)
+		self.prev_close = np.full(n_symbols, np.nan)
+		self.avg_gain = np.zeros(n_symbols)
+		self.avg_loss = np.zeros(n_symbols)
+
+	def update(self, cross_section):
+		close = cross_section[:, CLOSE]
+		# a change needs two valid closes
+		valid = ~np.isnan(close) & ~np.isnan(self.prev_close)
+		change = np.where(valid, close - self.prev_close, 0.0)
+
+		self.count += valid
+		self._smooth(self.avg_gain, np.maximum(change, 0.0), valid)
+		self._smooth(self.avg_loss, np.maximum(-change, 0.0), valid)
+		self.prev_close = np.where(np.isnan(close), self.prev_close, close)
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			rsi = 100.0 - 100.0 / (1.0 + self.avg_gain / self.avg_loss)
+		# no loss over the period: 100, or 50 if the price did not move at all
+		rsi = np.where(self.avg_loss == 0, np.where(self.avg_gain == 0, 50.0, 100.0), rsi)
+		self.value = np.where(self.count >= self.period, rsi, np.nan)
+
+
+class ATR(WilderAverage):
+	"""
+	Average True Range, with Wilder's smoothing of the true ranges.
+	"""
+	def __init__(self, n_symbols, period=14):
+		super(ATR, self).__init__(n_symbols, period)
+		self.prev_close = np.full(n_symbols, np.nan)
+		self.atr = np.zeros(n_symbols)
+
+	def update(self, cross_section):
+		high, low, close = cross_section[:, HIGH], cross_section[:, LOW], cross_section[:, CLOSE]
+		valid = ~(np.isnan(high) | np.isnan(low) | np.isnan(close))
+		# the first bar of a symbol has no previous close, its true range is high - low
+		prev_close = np.where(np.isnan(self.prev_close), close, self.prev_close)
+		true_range = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+		self.count += valid
+		self._smooth(self.atr, true_range, valid)
+		self.prev_close = np.where(valid, close, self.prev_close)
+		self.value = np.where(self.count >= self.period, self.atr, np.nan)
+
+
+class IndicatorSet(object):
+	"""
+	The indicators registered by a strategy, updated together from one cross-section per bar.
+	"""
+	def __init__(self, bars):
+		"""
+		:param bars: The DataHandler object that provides bar information
+		"""
+		self.bars = bars
+		self.indicators = {}
+
+	def add(self, name, indicator):
+		"""
+		:param name: name of the indicator within the set
+		:param indicator: an Indicator over len(bars.symbol_list) symbols
+		:return: the indicator
+		"""
+		if indicator.n_symbols != len(self.bars.symbol_list):
+			raise ValueError("Indicator %s has %d symbols but the data handler has %d."
+							 % (name, indicator.n_symbols, len(self.bars.symbol_list)))
+		self.indicators[name] = indicator
+		return indicator
+
+	def __getitem__(self, name):
+		return self.indicators[name]
+
+	def update(self):
+		"""
+		Updates every indicator with the latest cross-section of the data handler, once per MarketEvent.
+		"""
+		cross_section = self.bars.get_latest_cross_section()
+		for indicator in self.indicators.values():
+			indicator.update(cross_section)
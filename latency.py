@@ -0,0 +1,284 @@
+"""
+End-to-end latency of the live path
+
+A LatencyRecorder puts a RecordingEventQueue between the components and the event queue of a live Backtest, so it
+works whatever the class of the queue, and measures, for every event put on the queue, the wall-clock time elapsed since the bar it stems from was published by the feed:
+
+	market		the bar is released to the event loop (feed, socket, aggregation and wake-up of the loop)
+	signal		the strategy has computed a signal on the bar
+	order		the portfolio has sized the order of the signal
+	fill		the execution handler reports a fill of the order, from the bar the order was sent on
+	heartbeat	the event queue is drained and the loop is back to wait for the next bar
+
+The publish time is the send time stamped on the messages by replay.ReplayServer (see live_data), so the feed and
+the backtester have to run on the same host, or on hosts with synchronised clocks. The latencies are kept per stage
+and reported as percentiles and log-scale histograms, to see where the time of a heartbeat goes before going live.
+
+Usage as a command, replaying the CSV files at max speed against fake_tws:
+	python latency.py CSV_DIR SYMBOL [SYMBOL ...] --speed 0 --execution fake_tws
+"""
+
+import argparse
+import collections
+import datetime
+import threading
+import time
+
+import numpy as np
+
+from async_execution import AsyncIBExecutionHandler
+from backtest import Backtest
+from event import EventType
+from execution import SimulatedExecutionHandler
+from fake_tws import FakeTWS
+from live_data import LiveDataHandler
+from replay import ReplayServer
+from strategy import BuyAndHoldStrategy
+
+STAGES = ('market', 'signal', 'order', 'fill', 'heartbeat')
+
+# stage of the events of each EventType
+EVENT_STAGES = {
+	EventType.MARKET: 'market',
+	EventType.SIGNAL: 'signal',
+	EventType.ORDER: 'order',
+	EventType.FILL: 'fill',
+}
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram(object):
+	"""
+	Latency samples of one stage, in nanoseconds.
+	"""
+	def __init__(self):
+		self.samples = []
+
+	def add(self, latency):
+		self.samples.append(latency)
+
+	def summary(self, percentiles=PERCENTILES):
+		"""
+		:param percentiles: the percentiles to compute
+		:return: dict with the count, the percentiles ('p50', ...) and the max in microseconds
+		"""
+		summary = {'count': len(self.samples)}
+		if self.samples:
+			samples = np.asarray(self.samples, dtype=np.float64) / 1e3
+			for p, value in zip(percentiles, np.percentile(samples, percentiles)):
+				summary['p%g' % p] = float(value)
+			summary['max'] = float(samples.max())
+		return summary
+
+	def buckets(self):
+		"""
+		:return: list of (upper bound in microseconds, count) of power of two buckets, up to the largest sample
+		"""
+		if not self.samples:
+			return []
+		samples = np.maximum(np.asarray(self.samples, dtype=np.float64) / 1e3, 1.0)
+		exponents = np.ceil(np.log2(samples)).astype(np.int64)
+		counts = np.bincount(exponents)
+		return [(2 ** k, int(c)) for k, c in enumerate(counts) if k >= exponents.min()]
+
+	def format(self, name, width=40):
+		"""
+		:param name: name of the stage
+		:param width: characters of the largest bar
+		:return: the summary and the histogram as text
+		"""
+		summary = self.summary()
+		lines = ["%-10s n=%d" % (name, summary['count']) + ''.join(
+			"  %s=%s" % (k, _format_us(v)) for k, v in summary.items() if k != 'count')]
+		buckets = self.buckets()
+		peak = max(c for _, c in buckets) if buckets else 0
+		for bound, count in buckets:
+			lines.append("  <= %9s %7d %s" % (_format_us(bound), count, '#' * int(round(width * count / peak))))
+		return '\n'.join(lines)
+
+
+def _format_us(us):
+	"""
+	:param us: duration in microseconds
+	:return: the duration in us, ms or s
+	"""
+	if us < 1e3:
+		return "%.0fus" % us
+	if us < 1e6:
+		return "%.1fms" % (us / 1e3)
+	return "%.2fs" % (us / 1e6)
+
+
+class RecordingEventQueue(object):
+	"""
+	Proxy of an event queue that passes every event put on it to a callback before queueing it.
+	Everything else is delegated to the queue.
+	"""
+	def __init__(self, events, record):
+		"""
+		:param events: the event queue, a queue.Queue or an event_queue.DequeEventQueue
+		:param record: called with every event put, before it is queued
+		"""
+		self.events = events
+		self.record = record
+
+	def put(self, event):
+		self.record(event)
+		self.events.put(event)
+
+	def __getattr__(self, name):
+		return getattr(self.events, name)
+
+	def __iter__(self):
+		return iter(self.events)
+
+
+class LatencyRecorder(object):
+	"""
+	Records the latency of every event put on the event queue of a Backtest running on a LiveDataHandler.
+	"""
+	def __init__(self, backtest):
+		"""
+		:param backtest: the Backtest, before it runs; its components are given a RecordingEventQueue of its queue,
+		and the update_bars() of its LiveDataHandler, whose latest_publish_ns is the publish time of the current bar,
+		is wrapped
+		"""
+		bars = backtest.data_handler
+		self.bars = bars
+		self.histograms = dict((stage, LatencyHistogram()) for stage in STAGES)
+		# symbol -> deque of [publish time, quantity left to fill] of the orders, fills come from another thread
+		self._orders = collections.defaultdict(collections.deque)
+		self._lock = threading.Lock()
+		# publish time of the bar of the heartbeat under way, None once it is recorded
+		self._heartbeat = None
+
+		events = RecordingEventQueue(backtest.events, self.record)
+		backtest.events = events
+		for component in (bars, backtest.strategy, backtest.portfolio, backtest.execution_handler):
+			component.events = events
+		self._update_bars = bars.update_bars
+		bars.update_bars = self.update_bars
+
+	def record(self, event):
+		"""
+		Adds the latency of an event to the histogram of its stage.
+		"""
+		if event is not None:
+			now = time.time_ns()
+			if event.type == EventType.FILL:
+				publish = self._fill_origin(event)
+			else:
+				publish = self.bars.latest_publish_ns
+				if event.type == EventType.MARKET:
+					self._heartbeat = publish
+				elif event.type == EventType.ORDER:
+					with self._lock:
+						self._orders[event.symbol].append([publish, event.quantity])
+			if publish is not None:
+				self.histograms[EVENT_STAGES[event.type]].add(now - publish)
+
+	def _fill_origin(self, event):
+		"""
+		:return: the publish time of the bar of the oldest open order of the symbol of the fill, None if unknown
+		"""
+		with self._lock:
+			orders = self._orders.get(event.symbol)
+			if not orders:
+				return None
+			order = orders[0]
+			order[1] -= event.quantity
+			if order[1] <= 0:
+				orders.popleft()
+			return order[0]
+
+	def update_bars(self):
+		"""
+		Called by the event loop once the queue is drained: ends the heartbeat of the previous bar.
+		"""
+		if self._heartbeat is not None:
+			self.histograms['heartbeat'].add(time.time_ns() - self._heartbeat)
+			self._heartbeat = None
+		self._update_bars()
+
+	def summary(self):
+		"""
+		:return: dict of stage -> LatencyHistogram.summary()
+		"""
+		return dict((stage, self.histograms[stage].summary()) for stage in STAGES)
+
+	def format_report(self):
+		"""
+		:return: the summary and the histogram of every stage as text
+		"""
+		return '\n\n'.join(self.histograms[stage].format(stage) for stage in STAGES)
+
+
+def run_latency_test(csv_dir, symbol_list, speed=None, mode='bars', bar_seconds=60, strategy_cls=BuyAndHoldStrategy,
+					 execution='simulated', fill_delay=0.0, init_capital=100000.0, strategy_kwargs=None):
+	"""
+	Replays the CSV files over a local socket into a live Backtest and records the latency of its events.
+
+	:param csv_dir: Absolute directory path to the CSV files.
+	:param symbol_list: A list of symbol strings.
+	:param speed: multiple of the speed of the history, None for as fast as possible
+	:param mode: 'bars' or 'ticks', see replay.load_replay_messages()
+	:param bar_seconds: length of the bars in 'ticks' mode
+	:param strategy_cls: Generates signals based on market data.
+	:param execution: 'simulated' for the SimulatedExecutionHandler, 'fake_tws' for the AsyncIBExecutionHandler
+	against a local fake_tws.FakeTWS
+	:param fill_delay: seconds the FakeTWS waits before filling an order
+	:param init_capital: The starting capital for the portfolio.
+	:param strategy_kwargs: Extra keyword arguments of the strategy.
+	:return: (recorder, result) - the LatencyRecorder and the BacktestResult
+	"""
+	server = ReplayServer(csv_dir, symbol_list, speed=speed, mode=mode, bar_seconds=bar_seconds)
+	port = server.start_in_thread()
+	tws = None
+	if execution == 'fake_tws':
+		tws = FakeTWS(fill_delay=fill_delay)
+		execution_handler_cls = AsyncIBExecutionHandler
+		execution_handler_kwargs = dict(port=tws.start_in_thread())
+	elif execution == 'simulated':
+		execution_handler_cls = SimulatedExecutionHandler
+		execution_handler_kwargs = {}
+	else:
+		raise ValueError("Unknown execution %r, expected 'simulated' or 'fake_tws'." % execution)
+
+	try:
+		backtest = Backtest(
+			csv_dir, symbol_list, init_capital, datetime.datetime(1990, 1, 1),
+			data_handler_cls=LiveDataHandler, strategy_cls=strategy_cls, execution_handler_cls=execution_handler_cls,
+			live=True, heartbeat=1.0, strategy_kwargs=strategy_kwargs, execution_handler_kwargs=execution_handler_kwargs,
+			data_handler_kwargs=dict(port=port, bar_seconds=bar_seconds if mode == 'ticks' else None)
+		)
+		recorder = LatencyRecorder(backtest)
+		result = backtest.simulate_trading()
+		if tws is not None:
+			# the fills of the last orders arrive after the feed ends
+			backtest.execution_handler.wait_for_fills()
+			backtest.execution_handler.close()
+		backtest.data_handler.close()
+	finally:
+		server.stop_thread()
+		if tws is not None:
+			tws.stop_thread()
+	return recorder, result
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Measure the end-to-end latency of the live path on a replay.")
+	parser.add_argument('csv_dir')
+	parser.add_argument('symbols', nargs='+')
+	parser.add_argument('--speed', type=float, default=0, help='multiple of real time, 0 for as fast as possible')
+	parser.add_argument('--mode', choices=('bars', 'ticks'), default='bars')
+	parser.add_argument('--bar-seconds', type=float, default=60)
+	parser.add_argument('--execution', choices=('simulated', 'fake_tws'), default='simulated')
+	parser.add_argument('--fill-delay', type=float, default=0.0, help='seconds before the fake TWS fills an order')
+	args = parser.parse_args()
+
+	recorder, result = run_latency_test(args.csv_dir, args.symbols, args.speed or None, args.mode, args.bar_seconds,
+										execution=args.execution, fill_delay=args.fill_delay)
+	result.print_summary()
+	print('')
+	print(recorder.format_report())
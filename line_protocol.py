@@ -0,0 +1,21 @@
+"""
+Line protocol of the socket connections: one message per line, the name of the message then its fields,
+separated by '|'. Used by the asyncio execution handler, the live data handler and their local test servers.
+"""
+
+SEPARATOR = '|'
+
+
+def format_message(*fields):
+	"""
+	:param fields: the name and fields of a message
+	:return: the encoded line
+	"""
+	return (SEPARATOR.join('' if f is None else str(f) for f in fields) + '\n').encode('utf-8')
+
+def parse_message(line):
+	"""
+	:param line: an encoded line
+	:return: list of the name and fields of the message
+	"""
+	return line.decode('utf-8').rstrip('\r\n').split(SEPARATOR)
@@ -0,0 +1,328 @@
+"""
+Live market data
+
+The LiveDataHandler consumes bar or tick messages from a TCP or UDP feed on an asyncio loop running in a
+background thread. Ticks are aggregated into bars incrementally, and as soon as a bar closes it is handed to the
+event loop of the backtester, which is woken up through the event queue rather than polling on a sleep. The bars
+are then released into one RingBuffer per symbol by update_bars() on the thread of the event loop, so the
+strategy and portfolio never see a bar change while they handle its MarketEvent.
+
+The feed speaks the line protocol of line_protocol, one message per line (per datagram over UDP), timestamps
+in integer nanoseconds since the epoch:
+
+	bar|<symbol>|<timestamp>|<open>|<low>|<high>|<close>|<volume>|<oi>[|<sent>]
+	tick|<symbol>|<timestamp>|<price>|<size>[|<sent>]
+	close|<timestamp>[|<sent>]
+	end
+
+The optional last field is the wall-clock time.time_ns() the message was sent at; the publish time of a bar, the
+sent time of its last message, is then kept in latest_publish_ns for latency measurements (see latency).
+
+The bars sharing a timestamp form one heartbeat, which closes on a close message with its timestamp, when a
+message with a later timestamp arrives, when the feed ends or, with close_delay, once the wall clock is past the
+end of the bar. replay.ReplayServer plays the
+historic CSV files back in this format at a configurable speed.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+
+import numpy as np
+
+from data import BAR_FIELDS, RingBufferDataHandler
+from event import MarketEvent
+from line_protocol import parse_message
+
+OPEN = BAR_FIELDS.index('open')
+LOW = BAR_FIELDS.index('low')
+HIGH = BAR_FIELDS.index('high')
+CLOSE = BAR_FIELDS.index('close')
+VOLUME = BAR_FIELDS.index('volume')
+
+
+class BarAggregator(object):
+	"""
+	Incremental aggregation of the messages of a feed into the cross-section of the open bar: the first, lowest,
+	highest and last price and the total size of the ticks of each symbol, or the bar message of the symbol.
+	"""
+	def __init__(self, n_symbols, bar_seconds=None):
+		"""
+		:param n_symbols: number of symbols
+		:param bar_seconds: length of the bars the ticks are aggregated into, None for a feed of bars only
+		"""
+		self.n_symbols = n_symbols
+		self.bar_ns = None if bar_seconds is None else int(round(bar_seconds * 1e9))
+		# start of the open bar in nanoseconds, None before the first message
+		self.timestamp = None
+		self.values = np.full((n_symbols, len(BAR_FIELDS)), np.nan)
+		# messages older than the open bar, dropped
+		self.late = 0
+		# latest sent time of the messages of the open bar, 0 if unknown
+		self.sent = 0
+
+	def _roll(self, timestamp):
+		"""
+		Moves to the bar starting at timestamp.
+
+		:return: (completed, accepted) - the (timestamp, values) of the bar closed by the move or None,
+		and False if the message belongs to a bar already closed
+		"""
+		if self.timestamp is None or timestamp == self.timestamp:
+			self.timestamp = timestamp
+			return None, True
+		if timestamp < self.timestamp:
+			self.late += 1
+			return None, False
+		completed = self.flush()
+		self.timestamp = timestamp
+		return completed, True
+
+	def add_bar(self, i, timestamp, bar, sent=0):
+		"""
+		:param i: index of the symbol
+		:param timestamp: start of the bar in nanoseconds
+		:param bar: OLHCVI values of the bar
+		:param sent: time the message was sent in nanoseconds, 0 if unknown
+		:return: the (timestamp, values, sent) of the bar closed by the message, or None
+		"""
+		completed, accepted = self._roll(timestamp)
+		if accepted:
+			self.values[i] = bar
+			self.sent = max(self.sent, sent)
+		return completed
+
+	def add_tick(self, i, timestamp, price, size, sent=0):
+		"""
+		:param i: index of the symbol
+		:param timestamp: time of the tick in nanoseconds
+		:param price: traded price
+		:param size: traded size
+		:param sent: time the message was sent in nanoseconds, 0 if unknown
+		:return: the (timestamp, values, sent) of the bar closed by the tick, or None
+		"""
+		completed, accepted = self._roll(timestamp - timestamp % self.bar_ns)
+		if accepted:
+			row = self.values[i]
+			if np.isnan(row[OPEN]):
+				row[:] = (price, price, price, price, size, 0.0)
+			else:
+				row[LOW] = min(row[LOW], price)
+				row[HIGH] = max(row[HIGH], price)
+				row[CLOSE] = price
+				row[VOLUME] += size
+			self.sent = max(self.sent, sent)
+		return completed
+
+	def close(self, timestamp, sent=0):
+		"""
+		Closes the bar starting at timestamp, if it is the open bar.
+
+		:param timestamp: start of the bar in nanoseconds
+		:param sent: time the message was sent in nanoseconds, 0 if unknown
+		:return: (timestamp, values, sent) of the bar, or None
+		"""
+		if timestamp != self.timestamp:
+			return None
+		self.sent = max(self.sent, sent)
+		return self.flush()
+
+	def flush(self):
+		"""
+		Closes the open bar.
+
+		:return: (timestamp, values, sent) of the bar, NaN for the symbols without a message, or None if no bar is open
+		"""
+		if self.timestamp is None or np.isnan(self.values[:, CLOSE]).all():
+			return None
+		completed = (self.timestamp, self.values, self.sent)
+		self.values = np.full((self.n_symbols, len(BAR_FIELDS)), np.nan)
+		self.sent = 0
+		return completed
+
+
+class _DatagramFeed(asyncio.DatagramProtocol):
+	"""
+	Receives the feed over UDP, one or more lines per datagram.
+	"""
+	def __init__(self, handler):
+		self.handler = handler
+
+	def datagram_received(self, data, addr):
+		try:
+			for line in data.splitlines():
+				self.handler._on_message(parse_message(line))
+		except Exception as e:
+			self.handler._fail(e)
+
+
+class LiveDataHandler(RingBufferDataHandler):
+	"""
+	Derived class that receives bars or ticks from a socket feed, see the module docstring for the protocol.
+	Use it with Backtest(live=True), which waits on the event queue between the bars. An error on the feed, e.g. a
+	malformed message or ticks without bar_seconds, ends it and is raised by update_bars() in the event loop.
+	"""
+	# bars are handed over from the thread of the asyncio loop
+	requires_thread_safe_queue = True
+
+	def __init__(self, events, csv_dir, symbol_list, host='127.0.0.1', port=7600, protocol='tcp', bar_seconds=None,
+				 max_lookback=500, close_delay=None, timeout=10.0):
+		"""
+		:param events: The Event Queue, thread-safe.
+		:param csv_dir: Ignored, for the signature of the Backtest.
+		:param symbol_list: A list of symbol strings.
+		:param host: host of the feed server, or to listen on for UDP
+		:param port: port of the feed server, or to listen on for UDP
+		:param protocol: 'tcp' to connect to the feed, 'udp' to receive its datagrams
+		:param bar_seconds: length of the bars ticks are aggregated into, None for a feed of bars only
+		:param max_lookback: Number of bars kept per symbol.
+		:param close_delay: if set, an open bar also closes this many seconds of wall clock after its end
+		:param timeout: seconds to wait for the connection
+		"""
+		if bar_seconds is not None and bar_seconds <= 0:
+			raise ValueError("bar_seconds must be positive, got %r." % bar_seconds)
+		self.events = events
+		self._init_buffers(symbol_list, max_lookback)
+		self.continue_backtest = True
+
+		self.aggregator = BarAggregator(len(symbol_list), bar_seconds)
+		self.close_delay = close_delay
+		# closed bars waiting for update_bars(), appended by the loop thread
+		self._completed = collections.deque()
+		self._finished = False
+		# exception that stopped the feed on the loop thread, raised again by update_bars()
+		self.error = None
+		# publish time of the latest bar in nanoseconds, None if the feed does not send it
+		self.latest_publish_ns = None
+
+		self.loop = asyncio.new_event_loop()
+		self._thread = threading.Thread(target=self.loop.run_forever, name='LiveDataHandler', daemon=True)
+		self._thread.start()
+		asyncio.run_coroutine_threadsafe(self._connect(host, port, protocol), self.loop).result(timeout)
+
+	async def _connect(self, host, port, protocol):
+		if protocol == 'tcp':
+			self._reader, self._writer = await asyncio.open_connection(host, port)
+			self._tasks = [self.loop.create_task(self._read_stream())]
+		elif protocol == 'udp':
+			self._transport, _ = await self.loop.create_datagram_endpoint(
+				lambda: _DatagramFeed(self), local_addr=(host, port))
+			self._tasks = []
+		else:
+			raise ValueError("Unknown feed protocol %r, expected 'tcp' or 'udp'." % protocol)
+		if self.close_delay is not None:
+			self._tasks.append(self.loop.create_task(self._close_on_time()))
+
+	async def _read_stream(self):
+		try:
+			while True:
+				line = await self._reader.readline()
+				if not line:
+					break
+				self._on_message(parse_message(line))
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			self._fail(e)
+		finally:
+			self._finish()
+
+	async def _close_on_time(self):
+		"""
+		Closes the open bar once the wall clock is past its end plus close_delay, for feeds that go quiet.
+		"""
+		bar_ns = self.aggregator.bar_ns
+		while not self._finished:
+			await asyncio.sleep(self.close_delay)
+			timestamp = self.aggregator.timestamp
+			if timestamp is not None and bar_ns is not None and \
+				time.time_ns() >= timestamp + bar_ns + int(self.close_delay * 1e9):
+				self._publish(self.aggregator.flush())
+				# the ticks of the closed bar arriving later are dropped as late
+				self.aggregator.timestamp = timestamp + bar_ns
+
+	def _on_message(self, fields):
+		"""
+		Folds a message of the feed into the open bar, publishing the bar it closes if any.
+		"""
+		kind = fields[0]
+		if kind == 'end':
+			self._finish()
+			return
+		if kind == 'close':
+			sent = int(fields[2]) if len(fields) > 2 else 0
+			self._publish(self.aggregator.close(int(fields[1]), sent))
+			return
+		i = self.symbol_index.get(fields[1])
+		if i is None:
+			return
+		if kind == 'tick':
+			if self.aggregator.bar_ns is None:
+				raise ValueError("A tick feed needs the bar_seconds of the LiveDataHandler to build its bars.")
+			sent = int(fields[5]) if len(fields) > 5 else 0
+			completed = self.aggregator.add_tick(i, int(fields[2]), float(fields[3]), float(fields[4]), sent)
+		elif kind == 'bar':
+			sent = int(fields[9]) if len(fields) > 9 else 0
+			completed = self.aggregator.add_bar(i, int(fields[2]), [float(f) for f in fields[3:9]], sent)
+		else:
+			return
+		self._publish(completed)
+
+	def _publish(self, completed):
+		"""
+		Hands a closed bar over to the event loop and wakes it up.
+		"""
+		if completed is not None:
+			self._completed.append(completed)
+			# None is skipped by the event loop, it only ends the wait on the queue
+			self.events.put(None)
+
+	def _fail(self, error):
+		"""
+		Ends the feed on an error, which update_bars() raises on the thread of the event loop.
+		"""
+		if self.error is None:
+			self.error = error
+		self._finish()
+
+	def _finish(self):
+		if not self._finished:
+			self._publish(self.aggregator.flush())
+			self._finished = True
+			self.events.put(None)
+
+	def update_bars(self):
+		"""
+		overrided function
+		Releases the next closed bar, if any, and puts its MarketEvent.
+		:return:
+		"""
+		if self._completed:
+			timestamp, values, sent = self._completed.popleft()
+			updated = np.flatnonzero(~np.isnan(values[:, CLOSE])).tolist()
+			for i in updated:
+				self.latest_symbol_data[i].append(values[i])
+			self._carry_forward(updated)
+			self.latest_datetime = timestamp
+			self.latest_publish_ns = sent or None
+			self.events.put(MarketEvent())
+		elif self._finished:
+			self.continue_backtest = False
+			if self.error is not None:
+				raise RuntimeError("The live feed stopped on an error: %r" % (self.error,)) from self.error
+
+	def close(self):
+		"""
+		Disconnects from the feed and stops the loop thread.
+		"""
+		async def disconnect():
+			for task in self._tasks:
+				task.cancel()
+			if hasattr(self, '_writer'):
+				self._writer.close()
+			if hasattr(self, '_transport'):
+				self._transport.close()
+		asyncio.run_coroutine_threadsafe(disconnect(), self.loop).result()
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self._thread.join()
@@ -1,36 +1,45 @@
+"""
+Runs a BuyAndHoldStrategy backtest over the CSV files of the given symbols.
 
-### Declare the components with respective parameters
-bars = DataHandler(..)
-strategy = Strategy(..)
-port = Portfolio(..)
-broker = ExecutionHandler(..)
-
-### Outer loops: update market data if live trading
-while True:
-	# Update the bars (specific backtest code, as opposed to live trading)
-	if bars.continue_backtest == True:
-		bars.update_bars()
-	else:
-		break
-
-	### Inner loops: handle event queue object
-	while True:
-		try:
-			event = events.get(False)
-		except Queue.Empty:
-			break
-		else:
-			if event is not None:
-				if event.type == 'MARKET':
-					strategy.caculate_signal(event)
-					port.update_timeindex(event)
-				elif event.type == 'SIGNAL':
-					port.update_signal(event)
-				elif event.type == 'ORDER':
-					broker.execute_order(event)
-				elif event.type == 'FILL':
-					port.update_fill(event)
-	# 1 min break
-	time.sleep(60)
+	python main.py CSV_DIR SYMBOL [SYMBOL ...]
 
+With --feed HOST:PORT the bars come from a live feed (see live_data and replay) instead of the CSV files.
+"""
 
+import argparse
+import datetime
+
+from backtest import Backtest
+from live_data import LiveDataHandler
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('csv_dir')
+	parser.add_argument('symbols', nargs='+')
+	parser.add_argument('--capital', type=float, default=100000.0)
+	parser.add_argument('--start-date', default='1990-01-01')
+	parser.add_argument('--feed', metavar='HOST:PORT', help='run live on the bars or ticks of a feed')
+	parser.add_argument('--bar-seconds', type=float, default=None, help='length of the bars built from a tick feed')
+	parser.add_argument('--profile', metavar='JSON', help='profile the event loop and write the report to JSON')
+	parser.add_argument('--checkpoint-dir', help='save a checkpoint of the run to this directory')
+	parser.add_argument('--checkpoint-every', type=int, default=1000, help='heartbeats between two checkpoints')
+	parser.add_argument('--resume', action='store_true', help='continue from the checkpoint in --checkpoint-dir')
+	args = parser.parse_args()
+
+	kwargs = dict(profile=bool(args.profile), checkpoint_dir=args.checkpoint_dir,
+				  checkpoint_every=args.checkpoint_every, resume=args.resume)
+	if args.feed:
+		host, port = args.feed.rsplit(':', 1)
+		kwargs.update(data_handler_cls=LiveDataHandler, live=True, heartbeat=1.0,
+					  data_handler_kwargs=dict(host=host, port=int(port), bar_seconds=args.bar_seconds))
+
+	### Declare the components with respective parameters, then run the event loop
+	backtest = Backtest(
+		args.csv_dir, args.symbols, args.capital,
+		datetime.datetime.strptime(args.start_date, '%Y-%m-%d'), **kwargs
+	)
+	results = backtest.simulate_trading()
+	results.print_summary()
+	if args.profile:
+		results.profile.save_json(args.profile)
@@ -0,0 +1,292 @@
+"""
+Order book of the resting limit and stop orders of the simulated execution.
+
+The orders of every symbol sit in four heaps sorted by the price at which they trigger, so a new bar only pops
+the orders its low/high reaches: O(log n) per fill instead of a scan of every open order.
+
+	buy limits	fill when low <= limit	max-heap on the limit
+	sell limits	fill when high >= limit	min-heap on the limit
+	buy stops	fill when high >= stop	min-heap on the stop
+	sell stops	fill when low <= stop	max-heap on the stop
+
+Cancelling or replacing an order does not search the heaps: the order is dropped from (or updated in) the table of
+live orders and its heap entry is discarded the next time it reaches the top (lazy deletion). Expiry by bar count
+uses one more heap, sorted by the last bar of every order. A heap is compacted once more than half of its entries
+are stale, so orders cancelled far from the market do not pile up, and the symbols with live orders in their heaps
+are kept up to date so a bar only visits their books.
+"""
+
+import heapq
+import itertools
+
+BUY, SELL = 1, -1
+LIMIT, STOP = 'LMT', 'STP'
+
+
+class RestingOrder(object):
+	"""
+	A live limit or stop order.
+	"""
+	__slots__ = ('order_id', 'symbol', 'order_type', 'side', 'quantity', 'price', 'activation', 'expiry', 'version')
+
+	def __init__(self, order_id, symbol, order_type, side, quantity, price, activation, expiry):
+		"""
+		:param order_id: unique identifier of the order
+		:param symbol: the ticker symbol
+		:param order_type: 'LMT' or 'STP'
+		:param side: BUY or SELL
+		:param quantity: quantity to fill
+		:param price: limit or stop price
+		:param activation: first bar the order can fill on
+		:param expiry: last bar the order can fill on, or None until cancelled
+		"""
+		self.order_id = order_id
+		self.symbol = symbol
+		self.order_type = order_type
+		self.side = side
+		self.quantity = quantity
+		self.price = price
+		self.activation = activation
+		self.expiry = expiry
+		# bumped by every replace, so older heap entries of the order are recognised as stale
+		self.version = 0
+
+
+class SymbolBook(object):
+	"""
+	The four price-sorted heaps of one symbol. Every entry is (key, sequence, version, order_id), the key being
+	the price negated for the max-heaps, so the orders trigger by price and then by time of arrival.
+	"""
+	def __init__(self):
+		self.buy_limits = []
+		self.sell_limits = []
+		self.buy_stops = []
+		self.sell_stops = []
+		# live orders in the heaps, every other entry is stale
+		self.live = 0
+
+	def heap(self, order):
+		"""
+		:return: (heap, sign of the key) of the order
+		"""
+		if order.order_type == LIMIT:
+			return (self.buy_limits, -1.0) if order.side == BUY else (self.sell_limits, 1.0)
+		return (self.buy_stops, 1.0) if order.side == BUY else (self.sell_stops, -1.0)
+
+	def heaps(self):
+		return self.buy_limits, self.sell_limits, self.buy_stops, self.sell_stops
+
+	def __len__(self):
+		return len(self.buy_limits) + len(self.sell_limits) + len(self.buy_stops) + len(self.sell_stops)
+
+
+class OrderBook(object):
+	"""
+	The resting limit and stop orders of every symbol, matched against the high and low of each new bar.
+	"""
+	def __init__(self):
+		self.orders = {}
+		self.books = {}
+		# (activation bar, sequence, order_id) of the orders not at the market yet
+		self.in_flight = []
+		# (expiry bar, sequence, order_id) of the orders at the market with an expiry
+		self.expiries = []
+		# orders at the market with an expiry, every other entry of expiries is stale
+		self._expiring = 0
+		# symbols with live orders in their heaps, in order of arrival (a dict as an ordered set)
+		self.active = {}
+		self._sequence = itertools.count()
+		# index of the latest bar, set by advance()
+		self.bar = -1
+
+	def __len__(self):
+		return len(self.orders)
+
+	def __getstate__(self):
+		# the sequence counter is pickled as its next value
+		state = self.__dict__.copy()
+		state['_sequence'] = next(self._sequence)
+		self._sequence = itertools.count(state['_sequence'])
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._sequence = itertools.count(state['_sequence'])
+
+	def __contains__(self, order_id):
+		return order_id in self.orders
+
+	def _push_price(self, order):
+		heap, sign = self.books.setdefault(order.symbol, SymbolBook()).heap(order)
+		heapq.heappush(heap, (sign * order.price, next(self._sequence), order.version, order.order_id))
+
+	def _push_expiry(self, order):
+		if order.expiry is not None:
+			heapq.heappush(self.expiries, (order.expiry, next(self._sequence), order.order_id))
+
+	def _activate(self, order):
+		"""
+		Puts an order reaching the market in the heaps of its symbol.
+		"""
+		self._push_price(order)
+		self._push_expiry(order)
+		self.books[order.symbol].live += 1
+		self.active[order.symbol] = None
+		if order.expiry is not None:
+			self._expiring += 1
+
+	def _deactivate(self, order):
+		"""
+		Accounts for an order at the market leaving the book, its heap entries being stale from now on.
+		"""
+		book = self.books[order.symbol]
+		book.live -= 1
+		if book.live == 0:
+			del self.active[order.symbol]
+		if order.expiry is not None:
+			self._expiring -= 1
+
+	def _is_live(self, order_id, version=None, expiry=None):
+		"""
+		:return: True if a heap entry of the order with this version, or this expiry, is not stale
+		"""
+		order = self.orders.get(order_id)
+		if order is None or order.activation > self.bar:
+			return False
+		return order.version == version if expiry is None else order.expiry == expiry
+
+	def _compact(self, symbol):
+		"""
+		Drops the stale entries of the heaps of a symbol, and of the expiry heap, once they are more than half of them.
+		"""
+		book = self.books[symbol]
+		if len(book) > 2 * book.live:
+			for heap in book.heaps():
+				heap[:] = [entry for entry in heap if self._is_live(entry[3], entry[2])]
+				heapq.heapify(heap)
+		if len(self.expiries) > 2 * self._expiring:
+			self.expiries = [entry for entry in self.expiries if self._is_live(entry[2], expiry=entry[0])]
+			heapq.heapify(self.expiries)
+
+	def add(self, order):
+		"""
+		Rests a new order; it enters the heaps of its symbol on its activation bar.
+
+		:param order: a RestingOrder
+		"""
+		if order.order_id in self.orders:
+			raise ValueError("Order %s is already in the order book." % order.order_id)
+		self.orders[order.order_id] = order
+		heapq.heappush(self.in_flight, (order.activation, next(self._sequence), order.order_id))
+
+	def cancel(self, order_id):
+		"""
+		:param order_id: identifier of the order
+		:return: the cancelled RestingOrder, or None if the order is not live
+		"""
+		order = self.orders.pop(order_id, None)
+		if order is not None and order.activation <= self.bar:
+			self._deactivate(order)
+			self._compact(order.symbol)
+		return order
+
+	def replace(self, order_id, quantity=None, price=None, expiry=None):
+		"""
+		Changes the quantity, price or expiry of a live order. A new price loses the time priority of the order.
+
+		:param order_id: identifier of the order
+		:param quantity: new quantity, or None to keep it
+		:param price: new limit or stop price, or None to keep it
+		:param expiry: new last bar, or None to keep it
+		:return: the RestingOrder, or None if the order is not live
+		"""
+		order = self.orders.get(order_id)
+		if order is None:
+			return None
+		# an order still in flight enters the heaps with its new terms on activation
+		active = order.activation <= self.bar
+		if quantity is not None:
+			order.quantity = quantity
+		if price is not None:
+			order.price = price
+			order.version += 1
+			if active:
+				self._push_price(order)
+		if expiry is not None and expiry != order.expiry:
+			if active and order.expiry is None:
+				self._expiring += 1
+			order.expiry = expiry
+			if active:
+				self._push_expiry(order)
+		if active:
+			self._compact(order.symbol)
+		return order
+
+	def advance(self, bar):
+		"""
+		Moves to a new bar: activates the orders reaching the market and drops the expired ones.
+
+		:param bar: index of the new bar
+		:return: list of the RestingOrder objects expired
+		"""
+		self.bar = bar
+		while self.in_flight and self.in_flight[0][0] <= bar:
+			_, _, order_id = heapq.heappop(self.in_flight)
+			order = self.orders.get(order_id)
+			if order is not None:
+				self._activate(order)
+
+		expired = []
+		while self.expiries and self.expiries[0][0] < bar:
+			expiry, _, order_id = heapq.heappop(self.expiries)
+			order = self.orders.get(order_id)
+			# an entry whose expiry was replaced since is stale
+			if order is not None and order.expiry == expiry:
+				expired.append(self.orders.pop(order_id))
+				self._deactivate(order)
+		for symbol in set(order.symbol for order in expired):
+			self._compact(symbol)
+		return expired
+
+	def _pop_triggered(self, heap, sign, bound, fills, price):
+		"""
+		Pops the live orders of a heap whose key is at most sign * bound, the price reached by the bar.
+
+		:param price: callable(order) of the fill price
+		"""
+		limit = sign * bound
+		while heap and heap[0][0] <= limit:
+			_, _, version, order_id = heapq.heappop(heap)
+			order = self.orders.get(order_id)
+			if order is None or order.version != version:
+				# cancelled, filled or replaced since it was pushed
+				continue
+			del self.orders[order_id]
+			self._deactivate(order)
+			fills.append((order, price(order)))
+
+	def match(self, symbol, open_, high, low):
+		"""
+		Fills the orders of a symbol reached by a bar. A bar gapping through a price fills at the open.
+
+		:param symbol: the ticker symbol
+		:param open_, high, low: the prices of the bar
+		:return: list of (RestingOrder, fill price)
+		"""
+		fills = []
+		if symbol not in self.active:
+			return fills
+		book = self.books[symbol]
+		self._pop_triggered(book.buy_limits, -1.0, low, fills, lambda o: min(o.price, open_))
+		self._pop_triggered(book.sell_limits, 1.0, high, fills, lambda o: max(o.price, open_))
+		self._pop_triggered(book.buy_stops, 1.0, high, fills, lambda o: max(o.price, open_))
+		self._pop_triggered(book.sell_stops, -1.0, low, fills, lambda o: min(o.price, open_))
+		if fills:
+			self._compact(symbol)
+		return fills
+
+	def symbols(self):
+		"""
+		:return: list of the symbols with live orders in their heaps
+		"""
+		return list(self.active)
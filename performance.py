@@ -9,7 +9,7 @@ def get_sharpe_ratio(returns, risk_free=0, periods='Daily'):
 	:param periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
 	:return:
 	"""
-	if not returns:
+	if returns is None:
 		raise ValueError('Input value returns is None.')
 	assert periods == 'Daily' or periods == 'Hour' or periods == 'Minute', ''
 	assert risk_free >= 0 and risk_free <= 1, 'risk_free rate must lie in [0,1]'
@@ -19,36 +19,177 @@ def get_sharpe_ratio(returns, risk_free=0, periods='Daily'):
 
 def create_drawdowns(equity_curve):
 	"""
+	Calculates the drawdown from the high water mark and the drawdown duration of every bar,
+	with cumulative-max array operations rather than a loop over the bars.
 
-	:param equity_curve - A pandas Series representing period percentage returns.
-	:return: res - list of tuple(drawdown, duration) sorted by drawdown in descending order
+	:param equity_curve - A pandas Series representing the equity curve.
+	:return: drawdown, duration - pandas Series of the drawdown and of the number of bars since the last high water mark
 	"""
-	# Set up the High Water Mark
-	# Then create the drawdown and duration series
-	hwm = [0]
-	drawdown = pd.Series(index=equity_curve.index)
-	duration = pd.Series(index=equity_curve.index)
+	values = equity_curve.to_numpy(dtype=np.float64)
 
-	# Loops over the index range
-	for t,_ in enumerate(equity_curve.index):
-		# update current high water mark
-		cur_hwm = max(hwm[t-1], equity_curve[t])
-		hwm.append(cur_hwm)
-		# update current drawdown and duration
-		drawdown[t] = hwm[t] - equity_curve[t]
-		duration[t] = 0 if drawdown[t]==0 else duration[t-1]+1
+	# Set up the High Water Mark, which starts at zero and ignores missing values
+	hwm = np.fmax.accumulate(np.fmax(values, 0.0))
+	drawdown = np.nan_to_num(hwm - values, nan=0.0)
 
-	# sort by drawdown value in descending order
-	res = sorted(zip(drawdown, duration), key=lambda obj:obj[0], reverse=True)
-	return res
+	# The duration counts the bars since the last bar at the high water mark
+	idx = np.arange(len(values))
+	last_hwm = np.maximum.accumulate(np.where(drawdown == 0, idx, -1))
+	duration = idx - last_hwm
+
+	return pd.Series(drawdown, index=equity_curve.index), pd.Series(duration, index=equity_curve.index)
 
 def get_max_drawdowns(equity_curve):
 	"""
 
-	:param equity_curve - A pandas Series representing period percentage returns.
-	:return: drawdown, duration - Highest peak-to-trough drawdown and duration.
+	:param equity_curve - A pandas Series representing the equity curve.
+	:return: drawdown, duration - Highest peak-to-trough drawdown and the duration at its trough.
 	"""
-	if not equity_curve:
+	if equity_curve is None:
 		raise ValueError('Input value equity_curve is None.')
-	res = create_drawdowns(equity_curve)
-	return res[0][0], res[0][1]
\ No newline at end of file
+	drawdown, duration = create_drawdowns(equity_curve)
+	if len(drawdown) == 0:
+		return 0.0, 0
+	trough = int(np.argmax(drawdown.to_numpy()))
+	return drawdown.iloc[trough], duration.iloc[trough]
+
+def get_top_drawdowns(equity_curve, k=5):
+	"""
+	Finds the K deepest drawdown episodes. An episode runs from a high water mark to the next bar
+	back at the high water mark, or to the end of the curve if it has not recovered.
+
+	:param equity_curve - A pandas Series representing the equity curve.
+	:param k - number of episodes to return
+	:return: pandas DataFrame with the columns start, trough, recovery (NaT if not recovered),
+	drawdown and duration (bars from start to recovery, or to the end of the curve), sorted by drawdown in descending order
+	"""
+	drawdown, _ = create_drawdowns(equity_curve)
+	dd = drawdown.to_numpy()
+	index = equity_curve.index
+	n = len(dd)
+
+	# Edges of the runs of bars in drawdown
+	edges = np.diff(np.concatenate(([0], (dd > 0).astype(np.int8), [0])))
+	starts = np.flatnonzero(edges == 1)
+	ends = np.flatnonzero(edges == -1)
+	columns = ['start', 'trough', 'recovery', 'drawdown', 'duration']
+	if len(starts) == 0:
+		return pd.DataFrame(columns=columns)
+
+	depth = np.maximum.reduceat(dd, starts)
+	# np.maximum.reduceat also spans the bars between runs, but those are all zero
+	top = np.argsort(-depth, kind='stable')[:k]
+
+	rows = []
+	for e in top:
+		s, t = starts[e], ends[e]
+		peak = max(s - 1, 0)
+		rows.append((
+			index[peak],
+			index[s + int(np.argmax(dd[s:t]))],
+			index[t] if t < n else pd.NaT,
+			depth[e],
+			t - peak,
+		))
+	return pd.DataFrame(rows, columns=columns)
+
+
+class OnlineMetrics(object):
+	"""
+	Incremental performance metrics of an equity curve, updated in O(1) per bar.
+
+	Keeps the running mean and variance of the period returns (Welford's algorithm), the high water mark
+	of the equity curve, the current and maximum drawdown and the drawdown duration, so the metrics can
+	be read at any point of a run without rebuilding the curve. The definitions match get_sharpe_ratio()
+	and create_drawdowns() on the equity curve built by the portfolio.
+	"""
+	def __init__(self, init_total, periods='Daily'):
+		"""
+		:param init_total: value of the portfolio before the first bar
+		:param periods: Daily (252), Hourly (252*6.5), Minutely(252*6.5*60), see get_sharpe_ratio()
+		"""
+		assert periods == 'Daily' or periods == 'Hour' or periods == 'Minute', ''
+		self.init_total = init_total
+		self.periods = periods
+		self.last_total = init_total
+
+		# Welford's running mean and sum of squared deviations of the returns
+		self.n = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+
+		# The high water mark of the equity curve starts at zero, as in create_drawdowns()
+		self.hwm = 0.0
+		self.drawdown = 0.0
+		self.duration = 0
+		self.max_drawdown = 0.0
+		self.max_drawdown_duration = 0
+		self.max_duration = 0
+
+	def update(self, total):
+		"""
+		:param total: value of the portfolio at the new bar
+		"""
+		if self.last_total != 0:
+			ret = total / self.last_total - 1.0
+			self.n += 1
+			delta = ret - self.mean
+			self.mean += delta / self.n
+			self.m2 += delta * (ret - self.mean)
+		self.last_total = total
+
+		equity = total / self.init_total
+		if equity >= self.hwm:
+			self.hwm = equity
+			self.drawdown = 0.0
+			self.duration = 0
+		else:
+			self.drawdown = self.hwm - equity
+			self.duration += 1
+			if self.drawdown > self.max_drawdown:
+				self.max_drawdown = self.drawdown
+				self.max_drawdown_duration = self.duration
+			if self.duration > self.max_duration:
+				self.max_duration = self.duration
+
+	@property
+	def variance(self):
+		"""
+		:return: population variance of the returns so far
+		"""
+		return self.m2 / self.n if self.n > 0 else 0.0
+
+	@property
+	def sharpe_ratio(self):
+		"""
+		:return: the Sharpe ratio of the returns so far, NaN before two returns are known
+		"""
+		std = np.sqrt(self.variance)
+		if std == 0:
+			return np.nan
+		period = {'Daily': 252, 'Hour': 252*6.5, 'Minute': 252*6.5*60}
+		return np.sqrt(period[self.periods]) * self.mean / std
+
+	@property
+	def total_return(self):
+		"""
+		:return: total return of the portfolio so far
+		"""
+		return self.last_total / self.init_total - 1.0
+
+	def snapshot(self):
+		"""
+		:return: dict of the current metrics
+		"""
+		return {
+			'bars': self.n,
+			'total_return': self.total_return,
+			'mean_return': self.mean,
+			'volatility': np.sqrt(self.variance),
+			'sharpe_ratio': self.sharpe_ratio,
+			'high_water_mark': self.hwm,
+			'drawdown': self.drawdown,
+			'drawdown_duration': self.duration,
+			'max_drawdown': self.max_drawdown,
+			'max_drawdown_duration': self.max_drawdown_duration,
+			'max_duration': self.max_duration,
+		}
@@ -12,8 +12,9 @@ import queue
 from abc import ABCMeta, abstractmethod
 from math import floor
 
-from event import FillEvent, OrderEvent
-from performance import get_sharpe_ratio, get_max_drawdowns
+from data import BAR_FIELDS
+from event import EventType, FillEvent, OrderEvent
+from performance import OnlineMetrics, get_sharpe_ratio, get_max_drawdowns
 
 class Portfolio(object):
 	"""
@@ -40,8 +41,138 @@ class Portfolio(object):
 		"""
 		raise NotImplementedError("Should implement update_fill()")
 
+class Ledger(object):
+	"""
+	Array-backed record of the positions and holdings of a portfolio at every bar.
+
+	The positions are kept in a (bar, symbol) matrix and the holdings in a (bar, symbol + cash,
+	commission, total) matrix, both preallocated and doubled in size when full. The DataFrames of
+	the ledger are built on views of the filled rows, without copying them.
+	"""
+	HOLDINGS_COLUMNS = ('cash', 'commission', 'total')
+
+	def __init__(self, symbol_list, capacity=1024):
+		"""
+		:param symbol_list: A list of symbol strings.
+		:param capacity: The number of bars to preallocate.
+		"""
+		self.symbol_list = list(symbol_list)
+		self.holdings_columns = self.symbol_list + list(self.HOLDINGS_COLUMNS)
+		self.size = 0
+
+		capacity = max(capacity, 1)
+		self.datetimes = np.empty(capacity, dtype='datetime64[ns]')
+		self.positions = np.zeros((capacity, len(self.symbol_list)))
+		self.holdings = np.zeros((capacity, len(self.holdings_columns)))
+
+	def _grow(self):
+		"""
+		Doubles the capacity of the ledger.
+		"""
+		capacity = 2 * len(self.datetimes)
+		for name in ('datetimes', 'positions', 'holdings'):
+			old = getattr(self, name)
+			new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+			new[:self.size] = old[:self.size]
+			setattr(self, name, new)
+
+	def append(self, timestamp, positions, holdings, cash, commission, total):
+		"""
+		Records one bar.
+
+		:param timestamp: the datetime of the bar, or None
+		:param positions: array of the quantity held of every symbol
+		:param holdings: array of the market value of every symbol
+		:param cash: cash held
+		:param commission: cumulative commission paid
+		:param total: total value of the portfolio
+		"""
+		if self.size == len(self.datetimes):
+			self._grow()
+		i = self.size
+		self.datetimes[i] = np.datetime64('NaT') if timestamp is None else np.datetime64(timestamp, 'ns')
+		self.positions[i] = positions
+		row = self.holdings[i]
+		row[:-3] = holdings
+		row[-3] = cash
+		row[-2] = commission
+		row[-1] = total
+		self.size += 1
+
+	def record_dtype(self):
+		"""
+		:return: numpy dtype of a row of the ledger in its binary file, see write_rows()
+		"""
+		return np.dtype([('datetime', 'datetime64[ns]'), ('positions', np.float64, (len(self.symbol_list),)),
+						 ('holdings', np.float64, (len(self.holdings_columns),))])
+
+	def write_rows(self, f, start):
+		"""
+		Appends the rows from start on to a binary file, one fixed-size record of record_dtype() per bar.
+
+		:param f: file opened for binary writing
+		:param start: first row to write, the rows before are in the file already
+		:return: the number of rows written
+		"""
+		stop = self.size
+		records = np.empty(stop - start, dtype=self.record_dtype())
+		records['datetime'] = self.datetimes[start:stop]
+		records['positions'] = self.positions[start:stop]
+		records['holdings'] = self.holdings[start:stop]
+		f.write(records.tobytes())
+		return stop - start
+
+	def read_rows(self, path, rows):
+		"""
+		Replaces the rows of the ledger with the first rows of a file written by write_rows().
+
+		:param path: path of the file
+		:param rows: number of rows to read
+		"""
+		records = np.fromfile(path, dtype=self.record_dtype(), count=rows)
+		if len(records) < rows:
+			raise ValueError("Ledger file %s holds %d rows, %d expected." % (path, len(records), rows))
+		self.size = 0
+		while len(self.datetimes) < rows:
+			self._grow()
+		self.datetimes[:rows] = records['datetime']
+		self.positions[:rows] = records['positions']
+		self.holdings[:rows] = records['holdings']
+		self.size = rows
+
+	@classmethod
+	def from_arrays(cls, symbol_list, datetimes, positions, holdings):
+		"""
+		Wraps arrays computed elsewhere, e.g. by the vectorized backtest, without copying them.
+
+		:param symbol_list: A list of symbol strings.
+		:param datetimes: datetime64 array of length bars
+		:param positions: (bar, symbol) array
+		:param holdings: (bar, symbol + cash, commission, total) array
+		:return: a full Ledger
+		"""
+		ledger = cls(symbol_list, capacity=1)
+		ledger.datetimes, ledger.positions, ledger.holdings = datetimes, positions, holdings
+		ledger.size = len(datetimes)
+		return ledger
+
+	def positions_frame(self):
+		"""
+		:return: a pandas DataFrame of the positions, indexed by datetime, on a view of the ledger
+		"""
+		return pd.DataFrame(self.positions[:self.size], index=pd.DatetimeIndex(self.datetimes[:self.size], name='datetime'),
+							columns=self.symbol_list, copy=False)
+
+	def holdings_frame(self):
+		"""
+		:return: a pandas DataFrame of the holdings, cash, commission and total, indexed by datetime, on a view of the ledger
+		"""
+		return pd.DataFrame(self.holdings[:self.size], index=pd.DatetimeIndex(self.datetimes[:self.size], name='datetime'),
+							columns=self.holdings_columns, copy=False)
+
+
 class NaivePortfolio(Portfolio):
-    """
+	"""
 	The NaivePortfolio object is designed to send orders to
 	a brokerage object with a constant quantity size blindly,
 	without any risk management or position sizing.
@@ -60,37 +191,45 @@ class NaivePortfolio(Portfolio):
 		self.start_date = start_date
 		self.init_capital = init_capital
 
-		self.all_position = self.construct_all_positions()
+		self.ledger = self.construct_ledger()
 		self.current_positions = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list] )
-
-		self.all_holdings = self.construct_all_holdings()
 		self.current_holdings = self.construct_current_holdings()
 		self.equity_curve = None
+		# last known close of every symbol, the bars of a gap are NaN with fill_policy='nan'
+		self.last_close = np.full(len(self.symbol_list), np.nan)
 
-	def construct_all_positions(self):
+		# Updated on every bar, readable at any point of the run
+		self.metrics = OnlineMetrics(self.init_capital)
+
+	def construct_ledger(self):
 		"""
-		Constructs the positions list using the start_date
+		Constructs the positions and holdings ledger using the start_date
         to determine when the time index will begin.
 
 		:return:
 		"""
-		d = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list] )
-		d['datetime'] = self.start_date
-		return [d]
+		# Preallocate every bar if the data handler knows how many there are
+		bar_store = getattr(self.bars, 'bar_store', None)
+		capacity = 1024 if bar_store is None else bar_store.size + 1
 
-	def construct_all_holdings(self):
+		ledger = Ledger(self.symbol_list, capacity)
+		zeros = np.zeros(len(self.symbol_list))
+		ledger.append(self.start_date, zeros, zeros, self.init_capital, 0.0, self.init_capital)
+		return ledger
+
+	@property
+	def all_positions(self):
 		"""
-		Constructs the holdings list using the start_date
-        to determine when the time index will begin.
+		:return: pandas DataFrame of the positions at every bar
+		"""
+		return self.ledger.positions_frame()
 
-		:return:
+	@property
+	def all_holdings(self):
 		"""
-		d = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list] )
-		d['datetime'] = self.start_date
-		d['cash'] = self.init_capital
-		d['commission'] = 0.0
-		d['total']  = self.init_capital
-		return [d]
+		:return: pandas DataFrame of the holdings at every bar
+		"""
+		return self.ledger.holdings_frame()
 
 
 	def construct_current_holdings(self):
@@ -104,7 +243,28 @@ class NaivePortfolio(Portfolio):
 		d['cash'] = self.init_capital
 		d['commission'] = 0.0
 		d['total']  = self.init_capital
-		return [d]
+		return d
+
+	def get_state(self):
+		"""
+		:return: the current positions, holdings and metrics, for a checkpoint; the ledger is saved by rows,
+		see checkpoint.Checkpointer
+		"""
+		return {
+			'current_positions': dict(self.current_positions),
+			'current_holdings': dict(self.current_holdings),
+			'metrics': self.metrics,
+			'last_close': self.last_close.copy(),
+		}
+
+	def set_state(self, state):
+		"""
+		:param state: a state from get_state()
+		"""
+		self.current_positions = dict(state['current_positions'])
+		self.current_holdings = dict(state['current_holdings'])
+		self.metrics = state['metrics']
+		self.last_close = state['last_close'].copy()
 
 	def update_timeindex(self, event):
 		"""
@@ -115,27 +275,22 @@ class NaivePortfolio(Portfolio):
 		:param event:
 		:return:
 		"""
-		bars = {sym:self.bars.get_latest_bars(sym, N=1) for sym in self.symbol_list}
+		latest_datetime = self.bars.get_latest_bar_datetime(self.symbol_list[0])
 
-		# update positions
-		dp = dict((k, v) for k, v in [(s, 0) for s in self.symbol_list])
-		dp['datetime'] = bars[self.symbol_list[0]][0][1]
-		for s in self.symbol_list:
-			dp[s] = self.current_positions[s]
-		self.all_position.append(dp)
+		# update positions, current_positions is ordered as the symbol list
+		positions = np.fromiter(self.current_positions.values(), dtype=np.float64, count=len(self.symbol_list))
 
 		# Update holdings
-		dh = dict((k, v) for k, v in [(s, 0) for s in self.symbol_list])
-		dh['datetime'] = bars[self.symbol_list[0]][0][1]
-		dh['cash'] = self.current_holdings['cash']
-		dh['commission'] = self.current_holdings['commission']
-		dh['total'] = self.current_holdings['cash']
-		for s in self.symbol_list:
-			# # Approximation to the real value by close price
-			market_val = self.current_positions[s] * bars[s][0][5]
-			dh[s] = market_val
-			dh['total'] += market_val
-		self.all_holdings.append(dh)
+		# # Approximation to the real value by the last known close, a flat symbol may not be listed yet
+		close = self.bars.get_latest_cross_section()[:, BAR_FIELDS.index('close')]
+		known = ~np.isnan(close)
+		self.last_close[known] = close[known]
+		market_val = positions * self.last_close
+		market_val[positions == 0] = 0.0
+		cash = self.current_holdings['cash']
+		total = cash + market_val.sum()
+		self.ledger.append(latest_datetime, positions, market_val, cash, self.current_holdings['commission'], total)
+		self.metrics.update(total)
 
 	def update_positions_from_fill(self, fill):
 		"""
@@ -170,8 +325,15 @@ class NaivePortfolio(Portfolio):
 		if fill.direction == 'SELL':
 			fill_dir = -1
 
-		# Update holdings list with new quantities
-		fill_price = self.bars.get_latest_bars(fill.symbol)[0][5]  # Close price
+		# Update holdings list with new quantities, at the last known close if the fill has no price
+		fill_price = fill.fill_cost
+		if fill_price is None:
+			fill_price = self.bars.get_latest_bars_values(fill.symbol, 'close')[-1]
+			if np.isnan(fill_price):
+				fill_price = self.last_close[self.symbol_list.index(fill.symbol)]
+		if np.isnan(fill_price):
+			# a fill without a price would corrupt the cash for the rest of the run
+			raise ValueError("Fill of %s without a known price." % fill.symbol)
 		fill_cost = fill_dir * fill_price * fill.quantity
 		self.current_holdings[fill.symbol] += fill_cost
 		self.current_holdings['commission'] += fill.commission
@@ -185,7 +347,7 @@ class NaivePortfolio(Portfolio):
 		:param event: a FillEvent
 		:return:
 		"""
-		if event.type == 'FILL':
+		if event.type == EventType.FILL:
 			self.update_holdings_from_fill(event)
 			self.update_positions_from_fill(event)
 
@@ -196,9 +358,10 @@ class NaivePortfolio(Portfolio):
 		:param event: a SignalEvent
 		:return:
 		"""
-		if event.type == 'SIGNAL':
+		if event.type == EventType.SIGNAL:
 			order_event = self.generate_naive_order(event)
-			self.events.put(order_event)
+			if order_event is not None:
+				self.events.put(order_event)
 
 	def generate_naive_order(self, signal):
 		"""
@@ -213,7 +376,8 @@ class NaivePortfolio(Portfolio):
 		direction = signal.signal_type
 		strength = signal.strength
 
-		mkt_quantity = floor(100 * strength)
+		# rounding first keeps e.g. a strength of 0.29 from flooring to 28
+		mkt_quantity = floor(round(100 * strength, 6))
 		cur_quantity = self.current_positions[symbol]
 		order_type = 'MKT'
 
@@ -231,12 +395,11 @@ class NaivePortfolio(Portfolio):
 
 	def create_equity_curve_dataframe(self):
 		"""
-		Creates a pandas DataFrame from the all_holdings
-        list of dictionaries.
+		Creates a pandas DataFrame from the holdings of the ledger,
+        on a view of its rows.
 		:return:
 		"""
-		curve = pd.DataFrame(self.all_holdings)
-		curve.set_index('datetime', inplace=True)
+		curve = self.ledger.holdings_frame()
 		curve['returns'] = curve['total'].pct_change()
 		curve['equity_curve'] = (1.0+curve['returns']).cumprod()
 		self.equity_curve = curve
@@ -247,14 +410,22 @@ class NaivePortfolio(Portfolio):
 		as Sharpe Ratio and drawdown information.
 		"""
 		self.create_equity_curve_dataframe()
-		total_return = self.equity_curve['equity_curve'][-1]
-		returns = self.equity_curve['returns']
-		pnl = self.equity_curve['equity_curve']
+		return summary_stats(self.equity_curve)
+
+
+def summary_stats(equity_curve):
+	"""
+	:param equity_curve: pandas DataFrame with the returns and equity_curve columns, see create_equity_curve_dataframe()
+	:return: list of (name, formatted value) of the total return, Sharpe ratio and drawdown
+	"""
+	total_return = equity_curve['equity_curve'].iloc[-1]
+	returns = equity_curve['returns']
+	pnl = equity_curve['equity_curve']
 
-		sharpe_ratio = get_sharpe_ratio(returns)
-		max_dd, dd_duration = get_max_drawdowns(pnl)
+	sharpe_ratio = get_sharpe_ratio(returns)
+	max_dd, dd_duration = get_max_drawdowns(pnl)
 
-		return [("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
-				 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
-				 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
-				 ("Drawdown Duration", "%d" % dd_duration)]
\ No newline at end of file
+	return [("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
+			 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
+			 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
+			 ("Drawdown Duration", "%d" % dd_duration)]
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+Event loop profiler
+
+Instruments the event loop of a Backtest(profile=True) to see where the time of a run goes: the number of
+events of each type, the cumulative time and the percentiles of the time of every handler (update_bars,
+caculate_signals, update_timeindex, update_signal, execute_order, update_fill, ...), and the depth of the
+event queue at each event, with its peak per heartbeat and over the run.
+
+The profiler never sits in the loop of an unprofiled run: Backtest only swaps the dispatch table and
+update_bars for their instrumented versions when profiling, so a run without it pays nothing.
+The report is available as a dict for JSON export and as a text table.
+"""
+
+import array
+import collections
+import json
+import time
+
+import numpy as np
+
+from event import EventType
+
+
+def _handler_name(handler):
+	"""
+	:return: 'Class.method' for a bound method, the name of the function otherwise
+	"""
+	owner = getattr(handler, '__self__', None)
+	name = getattr(handler, '__name__', repr(handler))
+	if owner is None:
+		return name
+	return '%s.%s' % (type(owner).__name__, name)
+
+
+class EventLoopProfiler(object):
+	"""
+	Collects the counters and timings of the event loop, see the module docstring.
+	"""
+	def __init__(self, events, max_series=1000):
+		"""
+		:param events: the event queue, whose qsize() gives the depth
+		:param max_series: points at most of the queue depth series of the report
+		"""
+		self.events = events
+		self.max_series = max_series
+		self.event_counts = [0] * len(EventType)
+		# handler name -> durations of its calls in nanoseconds
+		self.handler_times = collections.OrderedDict()
+		# depth of the queue when each event is taken from it, the event included
+		self.depths = array.array('q')
+		# peak depth of each heartbeat
+		self.heartbeat_peaks = array.array('q')
+		self.elapsed = 0.0
+		self._start = None
+
+	def _times(self, handler):
+		return self.handler_times.setdefault(_handler_name(handler), array.array('q'))
+
+	def instrument(self, table):
+		"""
+		:param table: dispatch table from event.make_dispatch_table()
+		:return: the same table where each event type dispatches through one timed chain of its handlers
+		"""
+		return tuple((self._chain(t, handlers),) if handlers else handlers for t, handlers in zip(EventType, table))
+
+	def _chain(self, event_type, handlers):
+		timed = [(handler, self._times(handler)) for handler in handlers]
+		counts = self.event_counts
+		depths = self.depths
+		peaks = self.heartbeat_peaks
+		qsize = self.events.qsize
+		timer = time.perf_counter_ns
+
+		def dispatch(event):
+			counts[event_type] += 1
+			depth = qsize() + 1
+			depths.append(depth)
+			if peaks and depth > peaks[-1]:
+				peaks[-1] = depth
+			for handler, times in timed:
+				start = timer()
+				handler(event)
+				times.append(timer() - start)
+		return dispatch
+
+	def wrap_update_bars(self, update_bars):
+		"""
+		:param update_bars: the update_bars() of the data handler
+		:return: a timed update_bars() that also starts a new heartbeat of the queue depth series
+		"""
+		times = self._times(update_bars)
+		peaks = self.heartbeat_peaks
+		timer = time.perf_counter_ns
+
+		def profiled_update_bars():
+			peaks.append(0)
+			start = timer()
+			update_bars()
+			times.append(timer() - start)
+		return profiled_update_bars
+
+	def timed(self, handler):
+		"""
+		:param handler: a callable of the loop outside the dispatch table, e.g. ExecutionHandler.flush
+		:return: the handler, timed
+		"""
+		times = self._times(handler)
+		timer = time.perf_counter_ns
+
+		def profiled(*args):
+			start = timer()
+			result = handler(*args)
+			times.append(timer() - start)
+			return result
+		return profiled
+
+	def start(self):
+		self._start = time.perf_counter()
+
+	def stop(self):
+		self.elapsed = time.perf_counter() - self._start
+
+	def _depth_series(self):
+		"""
+		:return: the peak depth per heartbeat, as the max over chunks of heartbeats if there are more than max_series
+		"""
+		peaks = np.frombuffer(self.heartbeat_peaks, dtype=np.int64)
+		if len(peaks) <= self.max_series:
+			return peaks.tolist()
+		chunk = -(-len(peaks) // self.max_series)
+		padded = np.zeros(chunk * self.max_series, dtype=np.int64)
+		padded[:len(peaks)] = peaks
+		return padded.reshape(self.max_series, chunk).max(axis=1).tolist()
+
+	def to_dict(self):
+		"""
+		:return: the report as a JSON-serialisable dict, times in seconds and microseconds
+		"""
+		handlers = collections.OrderedDict()
+		for name, times in self.handler_times.items():
+			durations = np.frombuffer(times, dtype=np.int64) / 1e3
+			stats = {'calls': len(durations), 'total_s': float(durations.sum()) / 1e6}
+			if len(durations):
+				p50, p90, p99 = np.percentile(durations, (50, 90, 99))
+				stats.update(mean_us=float(durations.mean()), p50_us=float(p50), p90_us=float(p90),
+							 p99_us=float(p99), max_us=float(durations.max()))
+			stats['share'] = stats['total_s'] / self.elapsed if self.elapsed else 0.0
+			handlers[name] = stats
+
+		depths = np.frombuffer(self.depths, dtype=np.int64)
+		return {
+			'elapsed_s': self.elapsed,
+			'handlers_s': sum(h['total_s'] for h in handlers.values()),
+			'events': dict((t.name, self.event_counts[t]) for t in EventType),
+			'handlers': handlers,
+			'queue_depth': {
+				'peak': int(depths.max()) if len(depths) else 0,
+				'mean': float(depths.mean()) if len(depths) else 0.0,
+				'p99': float(np.percentile(depths, 99)) if len(depths) else 0.0,
+				'by_heartbeat': self._depth_series(),
+			},
+		}
+
+	def save_json(self, path):
+		"""
+		Writes the report of to_dict() to path.
+		"""
+		with open(path, 'w') as f:
+			json.dump(self.to_dict(), f, indent=2)
+
+	def format_table(self):
+		"""
+		:return: the report as a text table, the handlers by decreasing cumulative time
+		"""
+		report = self.to_dict()
+		lines = ["%-44s %9s %9s %6s %9s %9s %9s %9s" % (
+			'Handler', 'Calls', 'Total s', 'Share', 'Mean us', 'p50 us', 'p99 us', 'Max us')]
+		handlers = sorted(report['handlers'].items(), key=lambda item: -item[1]['total_s'])
+		for name, h in handlers:
+			if not h['calls']:
+				continue
+			lines.append("%-44s %9d %9.4f %5.1f%% %9.2f %9.2f %9.2f %9.2f" % (
+				name, h['calls'], h['total_s'], 100.0 * h['share'], h['mean_us'], h['p50_us'], h['p99_us'], h['max_us']))
+		lines.append("%-44s %9s %9.4f %5.1f%%" % (
+			'Loop and queue', '', report['elapsed_s'] - report['handlers_s'],
+			100.0 * (1.0 - report['handlers_s'] / report['elapsed_s']) if report['elapsed_s'] else 0.0))
+		lines.append('')
+		lines.append('Events: ' + ', '.join('%s %d' % (name.capitalize(), n) for name, n in report['events'].items()))
+		depth = report['queue_depth']
+		lines.append('Queue depth: peak %d, mean %.2f, p99 %.0f' % (depth['peak'], depth['mean'], depth['p99']))
+		return '\n'.join(lines)
@@ -0,0 +1,192 @@
+"""
+Market data replay
+
+Plays the historic CSV files back over a local socket in the feed format of live_data, to run the live path
+(LiveDataHandler, and an execution handler such as AsyncIBExecutionHandler against fake_tws) on known data.
+The bars are sent in timestamp order, paced on the wall clock at 1x or Nx the speed of the history, or as fast
+as possible. In 'ticks' mode every bar is sent as four ticks (open, low, high, close) within the bar, which a
+LiveDataHandler with the same bar_seconds aggregates back into the original bar.
+
+The last message of a bar is followed by a close message, so the bar is published as soon as it is complete
+rather than on the first message of the next bar, and every message carries the wall-clock time it was sent at,
+from which latency measures the end-to-end latency of the live path.
+
+Usage as a command:
+	python replay.py CSV_DIR SYMBOL [SYMBOL ...] --port 7600 --speed 60
+"""
+
+import argparse
+import asyncio
+import os, os.path
+import socket
+import threading
+import time
+
+import numpy as np
+
+from cache import read_csv_bars
+from line_protocol import SEPARATOR, format_message
+
+
+def load_replay_messages(csv_dir, symbol_list, mode='bars', bar_seconds=60):
+	"""
+	Reads the CSV files and builds the messages of the feed in timestamp order.
+
+	:param csv_dir: Absolute directory path to the CSV files.
+	:param symbol_list: A list of symbol strings.
+	:param mode: 'bars' for one bar message per bar, 'ticks' for four tick messages per bar
+	:param bar_seconds: length of the bars, to spread the ticks of a bar within it
+	:return: (timestamps, messages) - an int64 nanoseconds array and the list of encoded lines, sorted by time,
+	with a close message after the last message of each bar
+	"""
+	timestamps = []
+	# start of the bar of each message
+	starts = []
+	messages = []
+	quarter = int(bar_seconds * 1e9) // 4
+	for s in symbol_list:
+		ts, values = read_csv_bars(os.path.join(csv_dir, '%s.csv' % s))
+		ts = ts.view(np.int64)
+		if mode == 'bars':
+			for t, bar in zip(ts.tolist(), values.T.tolist()):
+				timestamps.append(t)
+				starts.append(t)
+				messages.append(format_message('bar', s, t, *bar))
+		elif mode == 'ticks':
+			for t, (o, l, h, c, v, _) in zip(ts.tolist(), values.T.tolist()):
+				for k, price in enumerate((o, l, h, c)):
+					timestamps.append(t + k * quarter)
+					starts.append(t)
+					messages.append(format_message('tick', s, t + k * quarter, price, v / 4.0))
+		else:
+			raise ValueError("Unknown replay mode %r, expected 'bars' or 'ticks'." % mode)
+
+	timestamps = np.asarray(timestamps, dtype=np.int64)
+	order = np.argsort(timestamps, kind='stable')
+	timestamps = timestamps[order]
+	starts = np.asarray(starts, dtype=np.int64)[order]
+
+	# the messages of a bar are contiguous once sorted, the close message goes right after the last one,
+	# at the end of the bar for ticks
+	last = np.flatnonzero(np.append(starts[1:] != starts[:-1], True)) if len(starts) else starts
+	closes = timestamps[last] if mode == 'bars' else starts[last] + 4 * quarter
+	sorted_messages = []
+	begin = 0
+	for end in last.tolist():
+		sorted_messages.extend(messages[i] for i in order[begin:end + 1])
+		sorted_messages.append(format_message('close', starts[end]))
+		begin = end + 1
+	return np.insert(timestamps, last + 1, closes), sorted_messages
+
+
+class ReplayServer(object):
+	"""
+	Serves the replay of the CSV files to every TCP client that connects, or sends it to a UDP address.
+	"""
+	def __init__(self, csv_dir, symbol_list, host='127.0.0.1', port=0, speed=1.0, mode='bars', bar_seconds=60,
+				 protocol='tcp'):
+		"""
+		:param csv_dir: Absolute directory path to the CSV files.
+		:param symbol_list: A list of symbol strings.
+		:param host: host to listen on, or to send the datagrams to for UDP
+		:param port: port to listen on, 0 for any free port, or to send the datagrams to for UDP
+		:param speed: multiple of the speed of the history, e.g. 1.0 for real time, None for as fast as possible
+		:param mode: 'bars' or 'ticks', see load_replay_messages()
+		:param bar_seconds: length of the bars in 'ticks' mode
+		:param protocol: 'tcp' or 'udp'
+		"""
+		self.host = host
+		self.port = port
+		self.speed = speed
+		self.protocol = protocol
+		self.timestamps, self.messages = load_replay_messages(csv_dir, symbol_list, mode, bar_seconds)
+		self._server = None
+		self._loop = None
+		self._thread = None
+
+	async def _play(self, send, drain=None):
+		"""
+		Sends every message at its time, stamped with the time it is sent at, then the end message.
+
+		:param send: callable(line) sending a message
+		:param drain: coroutine function flushing the socket, or None
+		"""
+		stamp_separator = SEPARATOR.encode('utf-8')
+		start = time.monotonic()
+		first = self.timestamps[0] if len(self.timestamps) else 0
+		for t, line in zip(self.timestamps.tolist(), self.messages):
+			if self.speed:
+				delay = start + (t - first) / 1e9 / self.speed - time.monotonic()
+				if delay > 0:
+					if drain is not None:
+						await drain()
+					await asyncio.sleep(delay)
+			send(b'%s%s%d\n' % (line[:-1], stamp_separator, time.time_ns()))
+			if drain is not None and self.speed is None:
+				# give the other tasks of the loop a turn without waiting on the clock
+				await drain()
+		send(format_message('end'))
+		if drain is not None:
+			await drain()
+
+	async def _serve_client(self, reader, writer):
+		try:
+			await self._play(writer.write, writer.drain)
+		except ConnectionError:
+			pass
+		writer.close()
+
+	async def start(self):
+		"""
+		Starts listening on the running loop (TCP) or starts sending (UDP).
+
+		:return: the port listened on, or sent to
+		"""
+		if self.protocol == 'tcp':
+			self._server = await asyncio.start_server(self._serve_client, self.host, self.port)
+			self.port = self._server.sockets[0].getsockname()[1]
+		else:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			address = (self.host, self.port)
+			self._task = asyncio.ensure_future(self._play(lambda line: sock.sendto(line, address)))
+			self._task.add_done_callback(lambda _: sock.close())
+		return self.port
+
+	async def stop(self):
+		if self._server is not None:
+			self._server.close()
+			await self._server.wait_closed()
+
+	def start_in_thread(self):
+		"""
+		Runs the server on its own loop in a background thread.
+
+		:return: the port listened on, or sent to
+		"""
+		self._loop = asyncio.new_event_loop()
+		self._thread = threading.Thread(target=self._loop.run_forever, name='ReplayServer', daemon=True)
+		self._thread.start()
+		return asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+	def stop_thread(self):
+		asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+		self._loop.call_soon_threadsafe(self._loop.stop)
+		self._thread.join()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Replay historic CSV files as a live feed.")
+	parser.add_argument('csv_dir')
+	parser.add_argument('symbols', nargs='+')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=7600)
+	parser.add_argument('--speed', type=float, default=1.0, help='multiple of real time, 0 for as fast as possible')
+	parser.add_argument('--mode', choices=('bars', 'ticks'), default='bars')
+	parser.add_argument('--bar-seconds', type=float, default=60)
+	args = parser.parse_args()
+
+	async def serve():
+		server = ReplayServer(args.csv_dir, args.symbols, args.host, args.port, args.speed or None, args.mode, args.bar_seconds)
+		print("Replaying %d messages on %s:%d" % (len(server.messages), args.host, await server.start()))
+		await server._server.serve_forever()
+	asyncio.run(serve())
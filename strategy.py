@@ -2,8 +2,8 @@
 
 Strategy objects take market data as input and produce trading signal events as output
 A Strategy object encapsulates all calculations on market data that generate advisory signals to a Portfolio object.
-At this stage in the event-driven backtester development there is no concept of an indicator or filter, such as those
-found in technical trading. These are also good candidates for creating a class hierarchy but are beyond the scope of this article.
+Indicators such as moving averages, volatility, RSI or ATR live in the indicators module: a strategy registers them
+once in an IndicatorSet and updates them incrementally from the latest cross-section on every MarketEvent.
 The strategy hierarchy is relatively simple as it consists of an abstract base class with a single pure virtual method for generating SignalEvent objects
 
 """
@@ -15,7 +15,8 @@ import queue
 
 from abc import ABCMeta, abstractmethod
 
-from event import SignalEvent
+from data import BAR_FIELDS
+from event import EventType, SignalEvent
 
 
 class Strategy(object):
@@ -40,7 +41,61 @@ class Strategy(object):
 		"""
 		raise NotImplementedError("Should implement calculate_signals()")
 
-class BuyAndHoldStrategy(Strategy):
+# Codes of the direction vector of a BatchStrategy, 0 for no signal
+LONG, SHORT, EXIT = 1, -1, 2
+SIGNAL_TYPES = {LONG: 'LONG', SHORT: 'SHORT', EXIT: 'EXIT'}
+
+
+class BatchStrategy(Strategy):
+	"""
+	A strategy that computes the signals of every symbol at once from the latest cross-section of the
+	DataHandler, a (symbol, OLHCVI) array, and returns them as vectors. Only the symbols with a non-zero
+	direction are turned into SignalEvent objects, so the cost of a bar in Python grows with the number
+	of signals rather than with the number of symbols.
+	"""
+	def __init__(self, bars, events):
+		"""
+		:param bars: The DataHandler object that provides bar information
+		:param events: The Event Queue object.
+		"""
+		self.bars = bars
+		self.events = events
+		self.symbol_list = self.bars.symbol_list
+
+	@abstractmethod
+	def calculate_batch_signals(self, cross_section):
+		"""
+		:param cross_section: (symbol, OLHCVI) array of the latest bar of every symbol, in symbol list order
+		:return: (direction, strength) - an integer vector of LONG, SHORT, EXIT or 0 per symbol, and
+		a float vector of the strength of the signals or a scalar strength shared by all of them
+		"""
+		raise NotImplementedError("Should implement calculate_batch_signals()")
+
+	def caculate_signals(self, event):
+		"""
+		Computes the signals of the latest bar and puts one SignalEvent per non-zero direction on the queue.
+
+		:param event: A MarketEvent object.
+		:return:
+		"""
+		if event.type == EventType.MARKET:
+			direction, strength = self.calculate_batch_signals(self.bars.get_latest_cross_section())
+			index = np.flatnonzero(direction)
+			if len(index) == 0:
+				return
+
+			dt = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+			directions = np.asarray(direction)[index].tolist()
+			if np.ndim(strength) == 0:
+				strengths = [float(strength)] * len(index)
+			else:
+				strengths = np.asarray(strength, dtype=np.float64)[index].tolist()
+			put = self.events.put
+			for i, d, w in zip(index.tolist(), directions, strengths):
+				put(SignalEvent(self.symbol_list[i], dt, SIGNAL_TYPES[d], w))
+
+
+class BuyAndHoldStrategy(BatchStrategy):
 	"""
 	This is an extremely simple strategy that goes LONG all of the
     symbols as soon as a bar is received. It will never exit a position.
@@ -53,38 +108,141 @@ class BuyAndHoldStrategy(Strategy):
 		:param bars: The DataHandler object that provides bar information
 		:param events: The Event Queue object.
 		"""
+		super(BuyAndHoldStrategy, self).__init__(bars, events)
+
+		# Once buy & hold signal is given, the symbol is set to True
+		self.bought = np.zeros(len(self.symbol_list), dtype=bool)
+
+	def calculate_batch_signals(self, cross_section):
+		"""
+		For "Buy and Hold" we generate a single signal per symbol and then
+		no additional signals: a LONG signal for every symbol not bought yet
+		whose latest bar is known.
+
+		:param cross_section: (symbol, OLHCVI) array of the latest bar of every symbol
+		:return: (direction, strength)
+		"""
+		# a symbol that is not listed yet has NaN bars
+		buy = ~self.bought & ~np.isnan(cross_section[:, BAR_FIELDS.index('close')])
+		self.bought |= buy
+		return np.where(buy, LONG, 0), 1.0
+
+	def get_state(self):
+		"""
+		:return: the symbols bought, for a checkpoint
+		"""
+		return {'bought': self.bought.copy()}
+
+	def set_state(self, state):
+		self.bought = state['bought'].copy()
+
+
+class VectorizedStrategy(Strategy):
+	"""
+	A strategy whose target position of every symbol at every bar depends only on the bars up to it,
+	so it can be computed for the whole history at once. Such a strategy can be run by the vectorized
+	mode of the Backtest, which simulates the fills with array operations, and still runs in the
+	event-driven loop, where it emits the signals that move the portfolio to its targets.
+
+	For the event-driven path through NaivePortfolio a position must be closed before another one is
+	opened: a target may go from flat to long or short and back to flat, but not flip or resize directly.
+	A symbol without a price at a bar (a gap with fill_policy='nan') keeps its previous target until its next
+	bar with a price, as in the vectorized mode.
+	"""
+	def __init__(self, bars, events):
+		"""
+		:param bars: The DataHandler object that provides bar information, it must hold a bar_store
+		:param events: The Event Queue object.
+		"""
 		self.bars = bars
 		self.events = events
 		self.symbol_list = self.bars.symbol_list
 
-		# Once buy & hold signal is given, these are set to True
-		self.bought = {s:False for s in self.symbol_list} # self._calculate_initial_bought()
+		self.targets = None
+		self.current_targets = np.zeros(len(self.symbol_list))
 
-	def _calculate_initial_bought(self):
+	@abstractmethod
+	def generate_target_positions(self, bar_store):
 		"""
-		Adds keys to the bought dictionary for all symbols
-        and sets them to False.
-		:return: dictionary where keys are symbols, values are True if to buy
+		:param bar_store: the data.BarStore of the whole history
+		:return: (time, symbol) array of the signed quantity to hold after each bar, row t may only use bars up to t
 		"""
-		bought = {s:False for s in self.symbol_list}
-		return bought
+		raise NotImplementedError("Should implement generate_target_positions()")
 
+	def get_state(self):
+		"""
+		:return: the targets of the latest bar, for a checkpoint; the targets of the history are computed again
+		"""
+		return {'current_targets': np.array(self.current_targets)}
+
+	def set_state(self, state):
+		self.current_targets = state['current_targets']
 
 	def caculate_signals(self, event):
 		"""
-		For "Buy and Hold" we generate a single signal per symbol and then
-		no additional signals. This is implemented by constantly adding long signal
-		to the market in the queue data-structure since the date of strategy initialisation
+		Emits the signals that move the portfolio from the previous targets to the targets of the latest bar.
 
 		:param event: A MarketEvent object.
 		:return:
 		"""
-		if event.type == 'MARKET':
-			for s in self.symbol_list:
-				bars = self.bars.get_latest_bars(s, N=1)
-				if bars is not None and bars != []:
-					if self.bought[s] == False:
-						# (Symbol, Datetime, Type = LONG, SHORT or EXIT)
-						signal = SignalEvent(bars[0][0], bars[0][1], 'LONG')
-						self.events.put(signal)
-						self.bought[s] = False
+		if event.type == EventType.MARKET:
+			bar_store = self.bars.bar_store
+			if self.targets is None:
+				self.targets = np.asarray(self.generate_target_positions(bar_store), dtype=np.float64)
+
+			targets = self.targets[bar_store.cursor - 1]
+			close = bar_store.values[:, bar_store.field_index['close'], bar_store.cursor - 1]
+			targets = np.where(np.isnan(close), self.current_targets, targets)
+			dt = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+			for i in np.flatnonzero(targets != self.current_targets):
+				s, old, new = self.symbol_list[i], self.current_targets[i], targets[i]
+				if new == 0:
+					signal = SignalEvent(s, dt, 'EXIT')
+				elif old == 0:
+					signal = SignalEvent(s, dt, 'LONG' if new > 0 else 'SHORT', abs(new) / 100.0)
+				else:
+					raise ValueError("Target of %s goes from %g to %g without going flat." % (s, old, new))
+				self.events.put(signal)
+			self.current_targets = targets
+
+
+class MovingAverageCrossStrategy(VectorizedStrategy):
+	"""
+	Holds a long position of a constant quantity in a symbol while the short moving average
+	of its closes is above the long one, and is flat otherwise.
+	"""
+	def __init__(self, bars, events, short_window=10, long_window=40, quantity=100):
+		"""
+		:param bars: The DataHandler object that provides bar information
+		:param events: The Event Queue object.
+		:param short_window: bars of the short moving average
+		:param long_window: bars of the long moving average
+		:param quantity: quantity held while long
+		"""
+		super(MovingAverageCrossStrategy, self).__init__(bars, events)
+		self.short_window = short_window
+		self.long_window = long_window
+		self.quantity = quantity
+
+	def _moving_average(self, close, window):
+		"""
+		:return: trailing mean of close over window bars along the time axis, NaN until window bars are known
+		"""
+		ma = np.full_like(close, np.nan)
+		if len(close) < window:
+			return ma
+		# the sums skip the NaN bars of a symbol not listed yet, which the count of valid bars then excludes
+		zero = np.zeros((1,) + close.shape[1:])
+		csum = np.concatenate((zero, np.cumsum(np.nan_to_num(close, nan=0.0), axis=0)))
+		count = np.concatenate((zero, np.cumsum(~np.isnan(close), axis=0)))
+		total = csum[window:] - csum[:-window]
+		valid = (count[window:] - count[:-window]) == window
+		ma[window - 1:][valid] = total[valid] / window
+		return ma
+
+	def generate_target_positions(self, bar_store):
+		close = bar_store.values[:, bar_store.field_index['close'], :bar_store.size].T
+		short_ma = self._moving_average(close, self.short_window)
+		long_ma = self._moving_average(close, self.long_window)
+		# comparisons with NaN are False, so the strategy is flat until both averages are known
+		return np.where(short_ma > long_ma, float(self.quantity), 0.0)
@@ -0,0 +1,166 @@
+"""
+Parameter sweep
+
+Runs one backtest per point of a parameter grid of a Strategy class across a pool of processes.
+The market data is read and aligned once; the bar store is written as NPY files that every worker
+memory-maps, so the workers share the same pages of data rather than each receiving a pickled copy.
+The summary statistics of every run are collected into one results table. The progress of a sweep is
+reported through a callback, by default to the logger of this module.
+"""
+
+import itertools
+import logging
+import shutil
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from backtest import Backtest
+from data import BarStore, HistoricCSVDataHandler
+from event_queue import create_event_queue
+from execution import SimulatedExecutionHandler
+from portfolio import NaivePortfolio
+
+logger = logging.getLogger(__name__)
+
+# Set in every worker by _init_worker()
+_worker_store_dir = None
+_worker_settings = None
+
+
+def expand_grid(param_grid):
+	"""
+	:param param_grid: dict of parameter name -> list of values, or a list of such dicts, or a list of parameter dicts
+	:return: list of parameter dicts, the cartesian product of each grid
+	"""
+	if isinstance(param_grid, dict):
+		param_grid = [param_grid]
+	points = []
+	for grid in param_grid:
+		if all(isinstance(v, (list, tuple)) for v in grid.values()):
+			names = list(grid.keys())
+			points.extend(dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names]))
+		else:
+			points.append(dict(grid))
+	return points
+
+def make_settings(strategy_cls, init_capital=100000.0, start_date=None, portfolio_cls=NaivePortfolio,
+				  execution_handler_cls=SimulatedExecutionHandler, data_handler_kwargs=None):
+	"""
+	:return: dict of the Backtest settings shared by every run of a sweep, sent to the workers
+	"""
+	return {
+		'init_capital': init_capital,
+		'start_date': start_date,
+		'strategy_cls': strategy_cls,
+		'portfolio_cls': portfolio_cls,
+		'execution_handler_cls': execution_handler_cls,
+		'data_handler_kwargs': data_handler_kwargs or {},
+	}
+
+def load_shared_bar_store(csv_dir, symbol_list, store_dir, **data_handler_kwargs):
+	"""
+	Reads and aligns the CSV files once and writes the bar store for the workers to memory-map.
+
+	:param csv_dir: Absolute directory path to the CSV files.
+	:param symbol_list: A list of symbol strings.
+	:param store_dir: directory the bar store is written to
+	:param data_handler_kwargs: extra keyword arguments of HistoricCSVDataHandler, e.g. fill_policy
+	"""
+	bars = HistoricCSVDataHandler(create_event_queue(), csv_dir, symbol_list, **data_handler_kwargs)
+	bars.bar_store.save(store_dir)
+
+def _init_worker(store_dir, settings):
+	global _worker_store_dir, _worker_settings
+	_worker_store_dir = store_dir
+	_worker_settings = settings
+
+def backtest_bar_store(bar_store, settings, params):
+	"""
+	Runs one backtest on a bar store already loaded, e.g. memory-mapped by a worker.
+
+	:param bar_store: a BarStore with none of its bars released
+	:param settings: dict of the Backtest settings shared by the runs, see run_sweep()
+	:param params: the keyword arguments of the strategy
+	:return: a BacktestResult
+	"""
+	backtest = Backtest(
+		None, bar_store.symbol_list, settings['init_capital'], settings['start_date'],
+		strategy_cls=settings['strategy_cls'], portfolio_cls=settings['portfolio_cls'],
+		execution_handler_cls=settings['execution_handler_cls'],
+		data_handler_kwargs=dict(settings['data_handler_kwargs'], bar_store=bar_store),
+		strategy_kwargs=params
+	)
+	return backtest.simulate_trading()
+
+def _run_backtest(job, params):
+	"""
+	Runs one backtest on the memory-mapped bar store of the worker.
+
+	:return: (job, params, BacktestResult without its equity curve)
+	"""
+	result = backtest_bar_store(BarStore.load(_worker_store_dir), _worker_settings, params)
+	# the equity curve is a view of the worker's ledger, only the summary is sent back
+	result.equity_curve = None
+	return job, params, result
+
+def log_progress(done, total, params, result, elapsed=None):
+	"""
+	Default progress report of run_sweep(), to the logger of this module.
+	"""
+	if result is None:
+		logger.info("Sweep of %d runs done in %0.2fs", total, elapsed)
+	else:
+		logger.info("[%d/%d] %s %s", done, total, params, ", ".join("%s=%s" % stat for stat in result.stats))
+
+def run_sweep(strategy_cls, param_grid, csv_dir, symbol_list, init_capital=100000.0, start_date=None,
+			  portfolio_cls=NaivePortfolio, execution_handler_cls=SimulatedExecutionHandler, data_handler_kwargs=None,
+			  max_workers=None, progress=log_progress):
+	"""
+	Runs a backtest of strategy_cls for every point of the parameter grid across a process pool.
+
+	:param strategy_cls: the Strategy class, called as strategy_cls(bars, events, **params)
+	:param param_grid: see expand_grid()
+	:param csv_dir: Absolute directory path to the CSV files.
+	:param symbol_list: A list of symbol strings.
+	:param init_capital: The starting capital of every run.
+	:param start_date: The start datetime of every run.
+	:param portfolio_cls: Portfolio class of every run.
+	:param execution_handler_cls: ExecutionHandler class of every run.
+	:param data_handler_kwargs: extra keyword arguments of HistoricCSVDataHandler.
+	:param max_workers: number of processes, os.cpu_count() if None.
+	:param progress: callable(done, total, params, result) called as runs complete, then once more as
+	callable(total, total, None, None, elapsed=seconds) when the sweep is done, or None.
+	:return: pandas DataFrame with one row per run: the parameters, the summary statistics
+	from output_summary_stats(), the numeric metrics and the elapsed seconds, in grid order
+	"""
+	points = expand_grid(param_grid)
+	settings = make_settings(strategy_cls, init_capital, start_date, portfolio_cls, execution_handler_cls, data_handler_kwargs)
+
+	store_dir = tempfile.mkdtemp(prefix='sweep-')
+	try:
+		load_shared_bar_store(csv_dir, symbol_list, store_dir, **settings['data_handler_kwargs'])
+
+		rows = [None] * len(points)
+		start = time.perf_counter()
+		with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(store_dir, settings)) as pool:
+			futures = [pool.submit(_run_backtest, job, params) for job, params in enumerate(points)]
+			for done, future in enumerate(as_completed(futures), 1):
+				job, params, result = future.result()
+				row = dict(params)
+				row.update(result.stats)
+				if result.metrics is not None:
+					row.update(('metric_%s' % k, v) for k, v in result.metrics.items())
+				row['elapsed'] = result.elapsed
+				rows[job] = row
+				if progress is not None:
+					progress(done, len(points), params, result)
+		if progress is not None:
+			progress(len(points), len(points), None, None, elapsed=time.perf_counter() - start)
+	finally:
+		shutil.rmtree(store_dir, ignore_errors=True)
+
+	return pd.DataFrame(rows)
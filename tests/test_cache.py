@@ -0,0 +1,113 @@
+"""
+Keys, rebuilds, LRU eviction and invalidation of the binary CSV cache.
+"""
+
+import os, os.path
+import time
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import write_synthetic_csvs
+from cache import CSVCache, read_csv_bars
+
+
+@pytest.fixture
+def csv_dir(tmp_path):
+	directory = str(tmp_path / 'csv')
+	write_synthetic_csvs(directory, 4, 200)
+	return directory
+
+@pytest.fixture
+def cache(tmp_path):
+	return CSVCache(str(tmp_path / 'cache'), max_bytes=None)
+
+def csv_path(csv_dir, i):
+	return os.path.join(csv_dir, 'S%04d.csv' % i)
+
+def entries(cache):
+	return sorted(name for name in os.listdir(cache.cache_dir) if not name.startswith('.'))
+
+def test_load_matches_the_csv(cache, csv_dir):
+	timestamps, values = cache.load(csv_path(csv_dir, 0))
+	expected_timestamps, expected_values = read_csv_bars(csv_path(csv_dir, 0))
+	np.testing.assert_array_equal(timestamps, expected_timestamps)
+	np.testing.assert_array_equal(values, expected_values)
+	assert isinstance(values, np.memmap)
+	assert len(entries(cache)) == 1
+
+def test_touched_csv_is_parsed_again(cache, csv_dir):
+	path = csv_path(csv_dir, 0)
+	cache.load(path)
+	before = entries(cache)
+	cache.load(path)
+	assert entries(cache) == before
+
+	st = os.stat(path)
+	os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+	cache.load(path)
+	after = entries(cache)
+	# a new version key for the same path key, the old entry is gone
+	assert len(after) == 1 and after != before
+	assert after[0].split('-')[0] == before[0].split('-')[0]
+
+def test_resized_csv_is_parsed_again(cache, csv_dir):
+	path = csv_path(csv_dir, 0)
+	st = os.stat(path)
+	cache.load(path)
+	with open(path, 'a') as f:
+		f.write('2010-01-04 13:10:00,1.0,1.0,1.0,1.0,100,0\n')
+	os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+	timestamps, _ = cache.load(path)
+	assert len(timestamps) == 201
+	assert len(entries(cache)) == 1
+
+def test_invalidate_one_file(cache, csv_dir):
+	cache.load(csv_path(csv_dir, 0))
+	cache.load(csv_path(csv_dir, 1))
+	cache.invalidate(csv_path(csv_dir, 0))
+	assert entries(cache) == [os.path.basename(cache._entry_name(csv_path(csv_dir, 1)))]
+
+def test_evict_least_recently_used(cache, csv_dir):
+	paths = [csv_path(csv_dir, i) for i in range(4)]
+	for path in paths:
+		cache.load(path)
+	names = [cache._entry_name(path) for path in paths]
+	# entry 0 is the least recently used, entry 3 the most recently used
+	now = time.time()
+	for i, name in enumerate(names):
+		os.utime(os.path.join(cache.cache_dir, name), (now - 3600 * (4 - i), now - 3600 * (4 - i)))
+	entry_bytes = cache.size() // 4
+
+	cache.max_bytes = 2 * entry_bytes
+	keep = os.path.join(cache.cache_dir, names[0])
+	freed = cache.evict(keep=keep)
+	# the oldest entry is kept, the next oldest ones go until the cache fits
+	assert entries(cache) == sorted([names[0], names[3]])
+	assert freed == 2 * entry_bytes
+	assert cache.size() <= cache.max_bytes
+
+	cache.max_bytes = 0
+	cache.evict(keep=keep)
+	assert entries(cache) == [names[0]]
+
+def test_load_evicts_down_to_max_bytes(tmp_path, csv_dir):
+	cache = CSVCache(str(tmp_path / 'capped'), max_bytes=None)
+	cache.load(csv_path(csv_dir, 0))
+	cache.max_bytes = cache.size()
+	for i in range(1, 4):
+		cache.load(csv_path(csv_dir, i))
+		# the entry just built is never evicted
+		assert entries(cache) == [cache._entry_name(csv_path(csv_dir, i))]
+
+def test_invalidate_spares_recent_builds(cache, csv_dir):
+	cache.load(csv_path(csv_dir, 0))
+	recent = os.path.join(cache.cache_dir, '.build-recent')
+	stale = os.path.join(cache.cache_dir, '.build-stale')
+	os.mkdir(recent)
+	os.mkdir(stale)
+	old = time.time() - 2 * cache.build_grace
+	os.utime(stale, (old, old))
+
+	cache.invalidate()
+	assert os.listdir(cache.cache_dir) == ['.build-recent']
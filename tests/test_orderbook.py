@@ -0,0 +1,109 @@
+"""
+Matching, cancels, replaces, expiries and compaction of the resting orders of orderbook.OrderBook.
+"""
+
+import pytest
+
+from orderbook import BUY, LIMIT, SELL, STOP, OrderBook, RestingOrder
+
+
+def rest(book, order_id, order_type, side, price, symbol='AAA', expiry=None):
+	"""
+	Adds an order reaching the market on the next bar, and moves the book to that bar.
+	"""
+	book.add(RestingOrder(order_id, symbol, order_type, side, 100, price, book.bar + 1, expiry))
+	return book.advance(book.bar + 1)
+
+def fills(book, open_, high, low, symbol='AAA'):
+	return [(order.order_id, price) for order, price in book.match(symbol, open_, high, low)]
+
+@pytest.fixture
+def book():
+	book = OrderBook()
+	book.advance(0)
+	return book
+
+def test_fill_at_the_limit(book):
+	rest(book, 1, LIMIT, BUY, 100.0)
+	assert fills(book, 102.0, 103.0, 101.0) == []
+	assert fills(book, 101.0, 101.5, 99.0) == [(1, 100.0)]
+	assert len(book) == 0 and book.symbols() == []
+
+@pytest.mark.parametrize('order_type, side, price, bar, expected', [
+	(LIMIT, BUY, 100.0, (95.0, 96.0, 94.0), 95.0),
+	(LIMIT, SELL, 100.0, (105.0, 106.0, 104.0), 105.0),
+	(STOP, BUY, 100.0, (105.0, 106.0, 104.0), 105.0),
+	(STOP, SELL, 100.0, (95.0, 96.0, 94.0), 95.0),
+])
+def test_gap_through_fills_at_the_open(book, order_type, side, price, bar, expected):
+	rest(book, 1, order_type, side, price)
+	assert fills(book, *bar) == [(1, expected)]
+
+def test_cancelled_order_does_not_fill(book):
+	rest(book, 1, LIMIT, BUY, 100.0)
+	assert book.cancel(1).order_id == 1
+	assert book.cancel(1) is None
+	assert book.symbols() == []
+	assert fills(book, 99.0, 99.5, 90.0) == []
+
+def test_replaced_price_does_not_fill_at_the_old_one(book):
+	rest(book, 1, LIMIT, BUY, 100.0)
+	book.replace(1, price=90.0)
+	# the stale entry at 100 is reached, the live one at 90 is not
+	assert fills(book, 99.0, 99.5, 95.0) == []
+	assert fills(book, 92.0, 93.0, 89.0) == [(1, 90.0)]
+	assert fills(book, 80.0, 81.0, 70.0) == []
+
+def test_replaced_quantity_fills(book):
+	rest(book, 1, STOP, SELL, 100.0)
+	book.replace(1, quantity=50)
+	[(order, price)] = book.match('AAA', 101.0, 101.0, 99.0)
+	assert (order.quantity, price) == (50, 100.0)
+
+def test_expiry(book):
+	rest(book, 1, LIMIT, BUY, 50.0, expiry=3)
+	assert book.advance(3) == []
+	assert [o.order_id for o in book.advance(4)] == [1]
+	assert book.symbols() == [] and len(book) == 0
+
+def test_expiry_after_a_replace(book):
+	rest(book, 1, LIMIT, BUY, 50.0, expiry=3)
+	rest(book, 2, LIMIT, BUY, 50.0, expiry=10)
+	book.replace(1, expiry=6)
+	book.replace(2, expiry=4)
+	# the stale expiry entry of order 1 at bar 3 does not expire it
+	assert book.advance(4) == []
+	assert [o.order_id for o in book.advance(5)] == [2]
+	assert book.advance(7)[0].order_id == 1
+	assert len(book) == 0
+
+def test_expiry_of_an_order_in_flight(book):
+	book.add(RestingOrder(1, 'AAA', LIMIT, BUY, 100, 50.0, 5, 2))
+	book.replace(1, expiry=8)
+	assert book.advance(5) == []
+	assert [o.order_id for o in book.advance(9)] == [1]
+
+def test_compaction_after_many_cancels(book):
+	rest(book, 0, LIMIT, BUY, 10.0, expiry=10 ** 6)
+	for i in range(1, 1001):
+		rest(book, i, LIMIT, BUY, 50.0 + i % 7, expiry=10 ** 6)
+		rest(book, -i, STOP, SELL, 5.0, symbol='BBB')
+		book.cancel(i)
+		book.cancel(-i)
+		live = book.books['AAA'].live
+		assert live == 1
+		assert len(book.books['AAA']) <= 2 * live + 1
+		assert len(book.expiries) <= 2 * 1 + 1
+	assert book.symbols() == ['AAA']
+	assert len(book.books['BBB']) <= 1
+	assert fills(book, 9.0, 9.5, 8.0) == [(0, 9.0)]
+	assert book.symbols() == []
+
+def test_symbols_follow_the_live_orders(book):
+	rest(book, 1, LIMIT, BUY, 100.0, symbol='AAA')
+	rest(book, 2, LIMIT, SELL, 100.0, symbol='BBB')
+	assert book.symbols() == ['AAA', 'BBB']
+	fills(book, 101.0, 101.0, 99.0, symbol='AAA')
+	assert book.symbols() == ['BBB']
+	book.cancel(2)
+	assert book.symbols() == []
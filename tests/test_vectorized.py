@@ -0,0 +1,101 @@
+"""
+Equivalence of the event-driven and the vectorized runs of vectorized strategies on synthetic data with a symbol
+listed late, gaps and histories shorter than the long window, under the 'pad' and 'nan' fill policies.
+"""
+
+import datetime
+import os.path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import check_vectorized_equivalence
+from strategy import MovingAverageCrossStrategy, VectorizedStrategy
+
+START_DATE = datetime.datetime(1990, 1, 1)
+
+
+def write_csv(csv_dir, symbol, index, close):
+	"""
+	Writes the bars of a symbol in the format read by HistoricCSVDataHandler, flat bars at the close.
+	"""
+	frame = pd.DataFrame({
+		'datetime': index.strftime('%Y-%m-%d %H:%M:%S'),
+		'open': close, 'low': close, 'high': close, 'close': close,
+		'volume': 1000, 'oi': 0,
+	})
+	frame.to_csv(os.path.join(str(csv_dir), '%s.csv' % symbol), index=False, float_format='%.4f')
+
+@pytest.fixture
+def late_listing_dir(tmp_path):
+	"""
+	AAA trends up then down over 80 bars, BBB is listed 50 bars late, with 30 bars and a gap,
+	so its history is shorter than a long window of 40 bars.
+	"""
+	index = pd.date_range('2010-01-04 09:30:00', periods=80, freq='min')
+	aaa = 100.0 + np.concatenate((np.arange(50.0), 50.0 - 2.0 * np.arange(30.0)))
+	write_csv(tmp_path, 'AAA', index, aaa)
+	late = np.delete(np.arange(50, 80), 10)
+	write_csv(tmp_path, 'BBB', index[late], 50.0 + np.arange(float(len(late))))
+	return tmp_path
+
+@pytest.fixture
+def gap_dir(tmp_path):
+	"""
+	AAA has every bar of 60, BBB misses every seventh bar and a run of five bars.
+	"""
+	index = pd.date_range('2010-01-04 09:30:00', periods=60, freq='min')
+	write_csv(tmp_path, 'AAA', index, 100.0 + np.sin(np.arange(60.0)))
+	listed = np.array([t for t in range(60) if t % 7 != 3 and not 30 <= t < 35])
+	write_csv(tmp_path, 'BBB', index[listed], 50.0 + np.cos(listed / 3.0))
+	return tmp_path
+
+class AlternatingStrategy(VectorizedStrategy):
+	"""
+	Long 100 for three bars then flat for three bars, whatever the prices, so the targets change within the gaps.
+	"""
+	def generate_target_positions(self, bar_store):
+		phase = (np.arange(bar_store.size) // 3) % 2 == 0
+		return np.repeat(np.where(phase, 100.0, 0.0)[:, None], len(self.symbol_list), axis=1)
+
+def test_moving_average_matches_pandas():
+	close = np.arange(1.0, 31.0).reshape(15, 2)
+	close[:5, 1] = np.nan
+	strategy = MovingAverageCrossStrategy.__new__(MovingAverageCrossStrategy)
+	expected = pd.DataFrame(close).rolling(4).mean().to_numpy()
+	np.testing.assert_allclose(strategy._moving_average(close, 4), expected)
+	assert np.isnan(strategy._moving_average(close, 20)).all()
+
+@pytest.mark.parametrize('fill_policy', ['pad', 'nan'])
+def test_late_listing_symbol(late_listing_dir, fill_policy):
+	event_result, vector_result = check_vectorized_equivalence(
+		str(late_listing_dir), ['AAA', 'BBB'], MovingAverageCrossStrategy, start_date=START_DATE,
+		data_handler_kwargs={'fill_policy': fill_policy}, short_window=5, long_window=40)
+	assert event_result.stats == vector_result.stats
+	assert np.isfinite(event_result.equity_curve['total']).all()
+	# AAA trades once both of its averages are known, BBB never has long_window bars
+	assert (event_result.equity_curve['AAA'] != 0.0).any()
+	assert (event_result.equity_curve['BBB'] == 0.0).all()
+
+@pytest.mark.parametrize('fill_policy', ['pad', 'nan'])
+def test_history_shorter_than_long_window(late_listing_dir, fill_policy):
+	event_result, vector_result = check_vectorized_equivalence(
+		str(late_listing_dir), ['AAA', 'BBB'], MovingAverageCrossStrategy, start_date=START_DATE,
+		data_handler_kwargs={'fill_policy': fill_policy}, short_window=5, long_window=100)
+	# neither moving average is ever known, so the strategy never trades
+	assert (event_result.equity_curve['total'] == 100000.0).all()
+	assert event_result.stats == vector_result.stats
+
+@pytest.mark.parametrize('fill_policy', ['pad', 'nan'])
+def test_targets_changing_within_gaps(gap_dir, fill_policy):
+	event_result, vector_result = check_vectorized_equivalence(
+		str(gap_dir), ['AAA', 'BBB'], AlternatingStrategy, start_date=START_DATE,
+		data_handler_kwargs={'fill_policy': fill_policy})
+	assert np.isfinite(event_result.equity_curve['total']).all()
+
+@pytest.mark.parametrize('fill_policy', ['pad', 'nan'])
+def test_moving_averages_with_gaps(gap_dir, fill_policy):
+	check_vectorized_equivalence(
+		str(gap_dir), ['AAA', 'BBB'], MovingAverageCrossStrategy, start_date=START_DATE,
+		data_handler_kwargs={'fill_policy': fill_policy}, short_window=2, long_window=5)
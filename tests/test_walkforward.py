@@ -0,0 +1,39 @@
+"""
+Folds and stitched out-of-sample equity curve of the walk-forward evaluation.
+"""
+
+import datetime
+
+import pytest
+
+from benchmarks.synthetic import write_synthetic_csvs
+from strategy import MovingAverageCrossStrategy
+from walkforward import make_folds, run_walk_forward
+
+N_BARS = 100
+
+
+@pytest.fixture
+def csv_dir(tmp_path):
+	write_synthetic_csvs(str(tmp_path), 2, N_BARS)
+	return str(tmp_path)
+
+@pytest.mark.parametrize('warmup', [0, 10])
+def test_stitched_curve_with_start_date(csv_dir, warmup):
+	folds, combined = run_walk_forward(
+		MovingAverageCrossStrategy, {'short_window': [3], 'long_window': [8]}, csv_dir, ['S0000', 'S0001'],
+		train_bars=40, test_bars=20, warmup=warmup, start_date=datetime.datetime(2000, 1, 1), max_workers=1)
+	# one row per out-of-sample bar, without the start_date row of any fold
+	assert len(combined) == N_BARS - 40
+	assert combined.index.is_unique
+	assert combined.index.is_monotonic_increasing
+	assert combined.index[0] == folds['oos_start'].iloc[0]
+
+@pytest.mark.parametrize('train_bars, test_bars', [(0, 20), (40, 0), (-1, 20)])
+def test_make_folds_rejects_empty_windows(train_bars, test_bars):
+	with pytest.raises(ValueError):
+		make_folds(N_BARS, train_bars, test_bars)
+
+def test_make_folds():
+	assert make_folds(10, 4, 3) == [(0, 4, 4, 7), (3, 7, 7, 10)]
+	assert make_folds(10, 4, 3, anchored=True) == [(0, 4, 4, 7), (0, 7, 7, 10)]
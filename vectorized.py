@@ -0,0 +1,76 @@
+"""
+Vectorized backtest
+
+For a VectorizedStrategy the target position of every symbol at every bar is known up front, so pushing
+each bar through MarketEvent -> SignalEvent -> OrderEvent -> FillEvent objects is pure overhead. This module
+computes the fills, commissions, positions, holdings and equity of the whole run with array operations,
+following the same conventions as the event-driven path with NaivePortfolio and SimulatedExecutionHandler:
+
+* the targets of bar t are traded at the close of bar t, commissions follow the IB fee schedule of FillEvent;
+* the ledger row of bar t is recorded before the trades of bar t, valuing the positions held at the close of bar t;
+* a bar without a price (a gap with fill_policy='nan') does not trade, the targets are reached on the next bar with a
+  price, and the positions are valued at the last known close meanwhile.
+"""
+
+import numpy as np
+
+from event import ib_commission
+from portfolio import Ledger
+
+
+def simulate_target_positions(bar_store, targets, init_capital, start_date=None):
+	"""
+	Simulates holding the target positions over the bars of a bar store.
+
+	:param bar_store: the data.BarStore the targets were computed on
+	:param targets: (time, symbol) array of the signed quantity to hold after each bar
+	:param init_capital: The starting capital in USD.
+	:param start_date: The start date (bar) of the portfolio.
+	:return: (ledger, trades) - a portfolio.Ledger with the start row and one row per bar,
+	and the (time, symbol) array of signed quantities traded
+	"""
+	close = bar_store.values[:, bar_store.field_index['close'], :bar_store.size].T
+	targets = np.asarray(targets, dtype=np.float64)
+	n_bars, n_symbols = targets.shape
+
+	# index of the last bar with a price of every symbol at every bar, -1 before the first one
+	symbols = np.arange(n_symbols)
+	last_known = np.where(np.isnan(close), -1, np.arange(n_bars)[:, None])
+	np.maximum.accumulate(last_known, axis=0, out=last_known)
+	listed = last_known >= 0
+	last_close = np.where(listed, close[last_known.clip(0), symbols], np.nan)
+	# the targets are only traded on the bars with a price
+	targets = np.where(listed, targets[last_known.clip(0), symbols], 0.0)
+
+	# positions held before the trades of each bar
+	held = np.zeros_like(targets)
+	held[1:] = targets[:-1]
+	trades = targets - held
+	traded = trades != 0
+
+	# Fills at the close, with the commission of each fill
+	fill_cost = np.where(traded, trades * close, 0.0)
+	commission = np.where(traded, ib_commission(np.abs(trades), close), 0.0)
+	commission_after = np.cumsum(commission.sum(axis=1))
+	cash_after = init_capital - np.cumsum(fill_cost.sum(axis=1) + commission.sum(axis=1))
+
+	# The row of a bar sees the cash and commission before its own trades
+	cash = np.concatenate(([init_capital], cash_after[:-1]))
+	commission_paid = np.concatenate(([0.0], commission_after[:-1]))
+	# # Approximation to the real value by the last known close, a flat symbol may not be listed yet
+	market_val = np.where(held != 0, held * last_close, 0.0)
+
+	holdings = np.empty((n_bars + 1, n_symbols + len(Ledger.HOLDINGS_COLUMNS)))
+	holdings[0, :n_symbols] = 0.0
+	holdings[0, n_symbols:] = (init_capital, 0.0, init_capital)
+	holdings[1:, :n_symbols] = market_val
+	holdings[1:, -3] = cash
+	holdings[1:, -2] = commission_paid
+	holdings[1:, -1] = cash + market_val.sum(axis=1)
+
+	positions = np.concatenate((np.zeros((1, n_symbols)), held))
+	datetimes = np.empty(n_bars + 1, dtype='datetime64[ns]')
+	datetimes[0] = np.datetime64('NaT') if start_date is None else np.datetime64(start_date, 'ns')
+	datetimes[1:] = bar_store.timestamps[:bar_store.size]
+
+	return Ledger.from_arrays(bar_store.symbol_list, datetimes, positions, holdings), trades
@@ -0,0 +1,171 @@
+"""
+Walk-forward evaluation
+
+Splits the timeline into rolling (or anchored) in-sample / out-of-sample folds. The market data is read
+and aligned once and memory-mapped by the worker processes; every fold is a zero-copy window of that
+bar store, so no CSV is parsed again per fold. Within a fold the parameter grid is evaluated in-sample,
+the best parameters by a metric of performance.OnlineMetrics are run out-of-sample, and the folds run
+in parallel. An out-of-sample run starts `warmup` bars before its window, so the indicators of the strategy
+are warm on its first bar, and only its rows of the window are kept, without the start_date row of the run. The out-of-sample equity curves
+are stitched into one combined curve.
+"""
+
+import shutil
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data import BarStore
+from execution import SimulatedExecutionHandler
+from performance import OnlineMetrics
+from portfolio import NaivePortfolio, summary_stats
+from sweep import backtest_bar_store, expand_grid, load_shared_bar_store, make_settings
+
+
+def make_folds(n_bars, train_bars, test_bars, step=None, anchored=False):
+	"""
+	:param n_bars: number of bars of the timeline
+	:param train_bars: number of in-sample bars of a fold
+	:param test_bars: number of out-of-sample bars of a fold, the last fold may be shorter
+	:param step: bars between the starts of two folds, test_bars if None so the out-of-sample windows tile the timeline
+	:param anchored: if True every in-sample window starts at the first bar (expanding window)
+	:return: list of (is_start, is_stop, oos_start, oos_stop) bar indices
+	:raise ValueError: if a fold would have no in-sample or no out-of-sample bar
+	"""
+	if train_bars < 1 or test_bars < 1:
+		raise ValueError("train_bars=%d and test_bars=%d must both be at least 1." % (train_bars, test_bars))
+	step = step or test_bars
+	folds = []
+	oos_start = train_bars
+	while oos_start < n_bars:
+		is_start = 0 if anchored else oos_start - train_bars
+		folds.append((is_start, oos_start, oos_start, min(oos_start + test_bars, n_bars)))
+		oos_start += step
+	return folds
+
+def _trim_to_window(result, n_bars):
+	"""
+	Keeps the rows of the last n_bars bars of an out-of-sample result, dropping its start_date row and its warmup,
+	and computes its statistics and metrics again on those rows, from the total of the portfolio just before them.
+	"""
+	curve = result.equity_curve
+	# the ledger holds the start_date row then one row per bar
+	start_total = curve['total'].to_numpy()[-n_bars - 1]
+	curve = curve.iloc[-n_bars:].copy()
+	curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
+
+	metrics = OnlineMetrics(start_total)
+	for total in curve['total'].tolist():
+		metrics.update(total)
+	result.stats = summary_stats(curve)
+	result.metrics = metrics.snapshot()
+	result.equity_curve = curve[['total', 'returns']]
+	return result
+
+def _run_fold(store_dir, settings, fold, points, metric, warmup=0):
+	"""
+	Runs one fold on the memory-mapped bar store: every parameter point in-sample, then the best one out-of-sample,
+	from warmup bars before the out-of-sample window.
+
+	:return: (fold, best params, in-sample score, out-of-sample BacktestResult)
+	"""
+	bar_store = BarStore.load(store_dir)
+	is_start, is_stop, oos_start, oos_stop = fold
+
+	best_params, best_score = points[0], np.nan
+	if len(points) > 1:
+		for params in points:
+			result = backtest_bar_store(bar_store.window(is_start, is_stop), settings, params)
+			score = result.metrics[metric]
+			if np.isnan(best_score) or score > best_score:
+				best_params, best_score = params, score
+
+	run_start = max(oos_start - warmup, 0)
+	result = backtest_bar_store(bar_store.window(run_start, oos_stop), settings, best_params)
+	# copy the out-of-sample curve off the worker's ledger before sending it back
+	result.equity_curve = result.equity_curve[['total', 'returns']].copy()
+	return fold, best_params, best_score, _trim_to_window(result, oos_stop - oos_start)
+
+def stitch_equity_curves(curves):
+	"""
+	Chains the returns of consecutive out-of-sample equity curves into one curve.
+
+	:param curves: list of (fold number, equity curve DataFrame with a 'returns' column and one row per
+	out-of-sample bar), in time order
+	:return: pandas DataFrame with the columns fold, returns and equity_curve
+	"""
+	parts = []
+	for k, curve in curves:
+		part = curve[['returns']].copy()
+		part['fold'] = k
+		parts.append(part)
+	combined = pd.concat(parts)
+	combined['returns'] = combined['returns'].fillna(0.0)
+	combined['equity_curve'] = (1.0 + combined['returns']).cumprod()
+	return combined[['fold', 'returns', 'equity_curve']]
+
+def run_walk_forward(strategy_cls, param_grid, csv_dir, symbol_list, train_bars, test_bars, step=None,
+					 anchored=False, warmup=0, metric='sharpe_ratio', init_capital=100000.0, start_date=None,
+					 portfolio_cls=NaivePortfolio, execution_handler_cls=SimulatedExecutionHandler,
+					 data_handler_kwargs=None, max_workers=None):
+	"""
+	Runs a walk-forward evaluation of strategy_cls.
+
+	:param strategy_cls: the Strategy class, called as strategy_cls(bars, events, **params)
+	:param param_grid: see sweep.expand_grid(), a single point skips the in-sample runs
+	:param csv_dir: Absolute directory path to the CSV files.
+	:param symbol_list: A list of symbol strings.
+	:param train_bars, test_bars, step, anchored: see make_folds()
+	:param warmup: bars before each out-of-sample window the out-of-sample run starts at, e.g. the longest lookback
+	of the strategy; they are not part of the out-of-sample results
+	:param metric: key of OnlineMetrics.snapshot() maximised in-sample
+	:param init_capital: The starting capital of every run.
+	:param start_date: The start datetime of every run.
+	:param portfolio_cls: Portfolio class of every run.
+	:param execution_handler_cls: ExecutionHandler class of every run.
+	:param data_handler_kwargs: extra keyword arguments of HistoricCSVDataHandler.
+	:param max_workers: number of processes, os.cpu_count() if None.
+	:return: (folds, combined) - pandas DataFrame of the windows, chosen parameters, in-sample score and
+	out-of-sample statistics of every fold, and the stitched out-of-sample equity curve
+	:raise ValueError: if the timeline is too short for a single fold
+	"""
+	points = expand_grid(param_grid)
+	settings = make_settings(strategy_cls, init_capital, start_date, portfolio_cls, execution_handler_cls, data_handler_kwargs)
+
+	store_dir = tempfile.mkdtemp(prefix='walkforward-')
+	try:
+		load_shared_bar_store(csv_dir, symbol_list, store_dir, **settings['data_handler_kwargs'])
+		bar_store = BarStore.load(store_dir)
+		timestamps = np.array(bar_store.timestamps)
+		folds = make_folds(bar_store.size, train_bars, test_bars, step, anchored)
+		if not folds:
+			raise ValueError("%d bars leave no out-of-sample bar after train_bars=%d." % (bar_store.size, train_bars))
+
+		with ProcessPoolExecutor(max_workers) as pool:
+			futures = [pool.submit(_run_fold, store_dir, settings, fold, points, metric, warmup) for fold in folds]
+			results = [f.result() for f in futures]
+	finally:
+		shutil.rmtree(store_dir, ignore_errors=True)
+
+	rows = []
+	curves = []
+	for k, (fold, params, score, result) in enumerate(results):
+		is_start, is_stop, oos_start, oos_stop = fold
+		row = {
+			'fold': k,
+			'is_start': pd.Timestamp(timestamps[is_start]),
+			'is_end': pd.Timestamp(timestamps[is_stop - 1]),
+			'oos_start': pd.Timestamp(timestamps[oos_start]),
+			'oos_end': pd.Timestamp(timestamps[oos_stop - 1]),
+			'params': params,
+			'is_%s' % metric: score,
+		}
+		row.update(result.stats)
+		row.update(('metric_%s' % name, v) for name, v in result.metrics.items())
+		rows.append(row)
+		curves.append((k, result.equity_curve))
+
+	return pd.DataFrame(rows), stitch_equity_curves(curves)